@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+__version__ = '0.4.0'
+
 # import submodules
 from sc2reader import plugins, data, scripts
 
@@ -24,8 +26,11 @@ load_map_infos = __defaultSC2Reader.load_map_infos
 load_map_info = __defaultSC2Reader.load_map_info
 load_map_histories = __defaultSC2Reader.load_map_headers
 load_map_history = __defaultSC2Reader.load_map_header
+scan_headers = __defaultSC2Reader.scan_headers
 
 configure = __defaultSC2Reader.configure
 reset = __defaultSC2Reader.reset
 
 register_plugin = __defaultSC2Reader.register_plugin
+register_reader = __defaultSC2Reader.register_reader
+register_datapack = __defaultSC2Reader.register_datapack
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks each stage of loading replays, grouped by the directory the
+replays are in; the bundled test_replays are stored a build per directory.
+For every stage the wall time, the growth in resident memory and, for the
+stages that handle game events, events per second are reported as JSON::
+
+    python -m sc2reader.bench test_replays --repeat 3 --output bench.json
+
+The stages are opening the archive, reading the header, extracting and
+reading each data file, the load_details, load_messages, load_players and
+load_events steps of a replay load and each of the bundled plugins.
+
+Resident memory is only known on systems with /proc, it is null elsewhere.
+The peak resident memory of the whole run is reported as well.
+"""
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import time
+import argparse
+from cStringIO import StringIO
+from collections import defaultdict, OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # Not available on windows
+    resource = None
+
+import sc2reader
+from sc2reader import utils
+from sc2reader.resources import Replay
+from sc2reader.plugins.replay import APMTracker, SelectionTracker, toJSON
+
+#: The plugins benchmarked on each replay, in order
+PLUGINS = [('APMTracker', APMTracker), ('SelectionTracker', SelectionTracker), ('toJSON', toJSON)]
+
+#: The stages that report events per second
+EVENT_STAGES = set(['read:replay.game.events', 'load_events', 'plugin:APMTracker', 'plugin:SelectionTracker'])
+
+
+def peak_rss():
+    """The peak resident memory of the process in KB, 0 if unknown."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024 if sys.platform == 'darwin' else peak
+
+
+def current_rss():
+    """The resident memory of the process right now in KB, None if unknown."""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages*os.sysconf('SC_PAGE_SIZE')/1024
+    except (IOError, IndexError, ValueError, AttributeError):
+        return None
+
+
+def run_stage(stages, stage, func, *args):
+    """Runs the stage, recording its (seconds, resident memory growth in KB)."""
+    rss = current_rss()
+    start = time.time()
+    result = func(*args)
+    elapsed = time.time()-start
+    stages[stage] = (elapsed, current_rss()-rss if rss is not None else None)
+    return result
+
+
+class TimedReplay(Replay):
+    """A replay that records each stage of its load in :attr:`stages`."""
+    def __init__(self, *args, **options):
+        self.stages = OrderedDict()
+        super(TimedReplay, self).__init__(*args, **options)
+
+    def _run_stage(self, stage, func, *args):
+        return run_stage(self.stages, stage, func, *args)
+
+
+def bench_replay(path, plugins=PLUGINS):
+    """
+    Loads the replay a stage at a time. Returns an ordered dictionary of stage
+    name => (seconds, resident memory growth in KB) and the number of game events.
+    """
+    stages = OrderedDict()
+    with open(path, 'rb') as replay_file:
+        contents = replay_file.read()
+
+    run_stage(stages, 'open_archive', utils.open_archive, StringIO(contents))
+    run_stage(stages, 'read_header', utils.read_header, StringIO(contents))
+
+    replay = TimedReplay(StringIO(contents), filename=path, debug=False)
+    stages.update(replay.stages)
+
+    for name, plugin in plugins:
+        run_stage(stages, 'plugin:'+name, plugin(), replay)
+
+    return stages, len(replay.raw_data.get('replay.game.events', []))
+
+
+class Totals(object):
+    """Sums up the stage timings of a group of replays."""
+    def __init__(self):
+        self.replays = 0
+        self.events = 0
+        self.failed = defaultdict(int)
+        self.seconds = OrderedDict()
+        self.growth = dict()
+
+    def add(self, stage, seconds, growth):
+        self.seconds[stage] = self.seconds.get(stage, 0.0)+seconds
+        if growth is not None:
+            self.growth[stage] = max(self.growth.get(stage, growth), growth)
+
+    def as_dict(self):
+        stages = OrderedDict()
+        for stage, seconds in self.seconds.items():
+            stages[stage] = OrderedDict([('seconds', round(seconds, 6)), ('rss_growth_kb', self.growth.get(stage))])
+            if stage in EVENT_STAGES:
+                stages[stage]['events_per_sec'] = round(self.events/seconds, 1) if seconds else None
+
+        result = OrderedDict()
+        result['replays'] = self.replays
+        result['failed'] = dict(self.failed)
+        result['events'] = self.events
+        result['seconds'] = round(sum(self.seconds.values()), 6)
+        result['peak_rss_kb'] = peak_rss()
+        result['stages'] = stages
+        return result
+
+
+def bench(paths, repeat=1, plugins=PLUGINS):
+    """
+    Benchmarks every replay found in the given paths and returns the results
+    for each directory, and all of them together, as a JSON ready dictionary.
+    Each replay is loaded ``repeat`` times and the fastest time of each stage
+    is kept.
+    """
+    groups = defaultdict(list)
+    for path in paths:
+        for filename in utils.get_files(path, extension='SC2Replay'):
+            groups[os.path.basename(os.path.dirname(os.path.abspath(filename)))].append(filename)
+
+    results = OrderedDict()
+    results['sc2reader'] = sc2reader.__version__
+    results['python'] = sys.version.split()[0]
+    results['repeat'] = repeat
+    results['builds'] = OrderedDict()
+
+    total = Totals()
+    for group in sorted(groups.keys()):
+        totals = Totals()
+        for filename in sorted(groups[group]):
+            try:
+                runs = [bench_replay(filename, plugins) for i in range(repeat)]
+            except Exception as e:
+                totals.failed[type(e).__name__] += 1
+                total.failed[type(e).__name__] += 1
+                continue
+
+            events = runs[0][1]
+            for stage in runs[0][0].keys():
+                seconds = min(stages[stage][0] for stages, count in runs)
+                growth = max(stages[stage][1] for stages, count in runs)
+                totals.add(stage, seconds, growth)
+                total.add(stage, seconds, growth)
+            totals.replays += 1
+            totals.events += events
+            total.replays += 1
+            total.events += events
+
+        results['builds'][group] = totals.as_dict()
+    results['total'] = total.as_dict()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks each stage of loading the replays in the given paths, by directory, as JSON.")
+    parser.add_argument('paths', metavar='path', type=str, nargs='+',
+                        help="Paths to one or more SC2Replay files or directories")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Load each replay this many times and keep the fastest time for each stage")
+    parser.add_argument('--output', type=str, default=None,
+                        help="Write the results to this file instead of stdout")
+    parser.add_argument('--no-plugins', action="store_true", default=False,
+                        help="Don't benchmark the bundled plugins")
+    arguments = parser.parse_args()
+
+    results = bench(arguments.paths, arguments.repeat, [] if arguments.no_plugins else PLUGINS)
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    else:
+        print json.dumps(results, indent=2)
+
+if __name__ == '__main__':
+    main()
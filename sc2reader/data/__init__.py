@@ -1,6 +1,13 @@
 from __future__ import absolute_import
 
+import os
+import sys
+import types
+import hashlib
+import marshal
 import pkgutil
+import threading
+import zlib
 
 class Build(object):
     def __init__(self, build_id, units, abilities):
@@ -8,6 +15,41 @@ class Build(object):
         self.units = units
         self.abilities = abilities
 
+    def __reduce_ex__(self, protocol):
+        # Builds are shared, pickle a reference to the build instead
+        reference = get_reference(self)
+        if reference is None:
+            return super(Build, self).__reduce_ex__(protocol)
+        return (load_reference, (reference,))
+
+#: Builds loaded by load_build, keyed by build id
+builds = dict()
+
+def get_reference(obj):
+    """
+    Returns a picklable reference to the given build, unit class, or ability
+    class if it was loaded by :func:`load_build`, else None. These classes
+    are created on the fly and can't be pickled by name so objects holding
+    them pickle references instead; see :func:`load_reference`.
+    """
+    # Only the objects themselves hold a reference, not their subclasses
+    return getattr(obj, '__dict__', {}).get('_reference')
+
+def load_reference(reference):
+    """Returns the build, unit class, or ability class for a reference."""
+    kind, build_id, key = reference
+    build = load_build(build_id)
+    if kind == 'build':
+        return build
+    elif kind == 'unit':
+        return build.units[key]
+    else:
+        return build.abilities[key]
+
+def _load_unit(reference):
+    unit_class = load_reference(reference)
+    return unit_class.__new__(unit_class)
+
 from collections import namedtuple
 UnitRow = namedtuple('UnitRow',['id','type','title'])
 AbilRow = namedtuple('AbilRow',['id','type','title'])
@@ -250,55 +292,45 @@ class Unit(object):
     def __repr__(self):
         return str(self)
 
+    def __reduce_ex__(self, protocol):
+        # Unit classes can't be pickled by name, see get_reference
+        reference = get_reference(self.__class__)
+        if reference is None:
+            return super(Unit, self).__reduce_ex__(protocol)
+        return (_load_unit, (reference,), self.__dict__)
+
 class Ability(object):
     pass
 
 
-def create_build(build):
-    units = dict()
+def compile_build(build):
+    """
+    Parses the unit and ability CSV files of a build into the rows that
+    :func:`create_build` makes the unit and ability classes from. The rows
+    are plain tuples so they can be precompiled, see :func:`write_datapack`.
+    """
+    units = list()
     units_file = "{0}_{1}.csv".format(build,"units")
     units_data = pkgutil.get_data('sc2reader.data',units_file).split('\n')[:-1]
     for row in [UnitRow(*line.strip().split('|')[1:]) for line in units_data]:
         unit_id = int(row.id, 10) << 8 | 1
         values = dict(cost=[0,0,0], race='Neutral',is_army=False, is_building=False, is_worker=False)
-        race, minerals, vespene, supply = "Neutral", 0, 0, 0
         for race in ('Protoss','Terran','Zerg'):
             if row.type.lower() in unit_lookup[race]:
                 values.update(unit_lookup[race][row.type.lower()])
                 values['race']=race
                 break
 
-        units[unit_id] = type(row.title,(Unit,), dict(
-            type=unit_id,
-            name=row.title,
-            title=row.title,
-            race=values['race'],
-            minerals=values['cost'][0],
-            vespene=values['cost'][1],
-            supply=values['cost'][2],
-            is_building=values['is_building'],
-            is_worker=values['is_worker'],
-            is_army=values['is_army'],
-        ))
+        minerals, vespene, supply = values['cost']
+        units.append((unit_id, row.title, values['race'], minerals, vespene, supply,
+                      values['is_building'], values['is_worker'], values['is_army']))
 
         if row.title.lower() in ('probe','zealot','stalker','immortal','phoenix','hightemplar','warpprism','archon','colossus','voidray'):
-            units[unit_id+1] = type("Hallucinated"+row.title,(Unit,), dict(
-                type=unit_id+1,
-                name="Hallucinated"+row.title,
-                title="Hallucinated"+row.title,
-                race='Protoss',
-                minerals=0,
-                vespene=0,
-                supply=0,
-                is_building=False,
-                is_army=True,
-                is_worker=False,
-            ))
-
+            units.append((unit_id+1, "Hallucinated"+row.title, 'Protoss', 0, 0, 0, False, False, True))
 
     abils_file = "{0}_{1}.csv".format(build,"abilities")
     abils_data = pkgutil.get_data('sc2reader.data',abils_file).split('\n')[:-1]
-    abilities = {0:type('RightClick',(Ability,), dict(type=0, name='RightClick', title='Right Click', is_build=False, build_time=None, build_unit=None))}
+    abilities = [(0, 'RightClick', 'Right Click')]
     for row in [line.strip().split('|') for line in abils_data]:
         base = int(row[1],10) << 5
         if base == 0: continue
@@ -310,31 +342,48 @@ def create_build(build):
             real_abils = [(base|i,t) for i,t in enumerate(row[3:]) if t.strip()!='']
 
         for abil_id, title in real_abils:
-            abilities[abil_id] = type(title,(Ability,), dict(
-                type=abil_id,
-                name=title,
-                title=title,
-                is_build=False,
-                build_time=None,
-                build_unit=None
-            ))
-
+            abilities.append((abil_id, title, title))
 
         # Some abilities have missing entries..
         if len(real_abils) == 0:
-            abilities[base] = type(row[2],(Ability,), dict(
-                type=base,
-                name=row[2],
-                title=row[2],
-                is_build=False,
-                build_time=None,
-                build_unit=None
-            ))
-
-        if int(row[1],10) == 249 and build==22612:
-            pass
-            #print row
-            #print abilities[0x1f20], abilities[0x1f21], abilities[0x1f22], abilities[0x1f23]
+            abilities.append((base, row[2], row[2]))
+
+    return units, abilities
+
+def create_build(build, rows=None):
+    """
+    Creates a new :class:`Build` datapack for the given build from the rows
+    made by :func:`compile_build`, which are compiled from the CSV files if
+    they aren't given. Use :func:`load_build` to get the shared datapacks;
+    only those can be pickled by reference.
+    """
+    unit_rows, ability_rows = rows if rows is not None else compile_build(build)
+
+    units = dict()
+    for unit_id, name, race, minerals, vespene, supply, is_building, is_worker, is_army in unit_rows:
+        units[unit_id] = type(name,(Unit,), dict(
+            type=unit_id,
+            name=name,
+            title=name,
+            race=race,
+            minerals=minerals,
+            vespene=vespene,
+            supply=supply,
+            is_building=is_building,
+            is_worker=is_worker,
+            is_army=is_army,
+        ))
+
+    abilities = dict()
+    for abil_id, name, title in ability_rows:
+        abilities[abil_id] = type(name,(Ability,), dict(
+            type=abil_id,
+            name=name,
+            title=title,
+            is_build=False,
+            build_time=None,
+            build_unit=None
+        ))
 
     data = Build(build, units, abilities)
     for unit in units.values():
@@ -350,10 +399,122 @@ def create_build(build):
 
     return data
 
-# His build numbers don't map at ALL to the first effective
-# build number so do the correct range mapping down here.
-build16117 = create_build(16939)
-build17326 = create_build(17811)
-build18092 = create_build(18701)
-build19458 = create_build(21029)
-build22612 = create_build(22612)
+#: The builds there are CSV files and datapacks for
+BUILDS = (16939, 17811, 18701, 21029, 22612)
+
+#: The version of the rows in the precompiled datapack files. Files made for
+#: any other version, or from other CSV files, are ignored and the CSV files
+#: are parsed instead.
+DATAPACK_VERSION = 3
+
+_lock = threading.Lock()
+
+def load_build(build_id):
+    """
+    Returns the datapack of the given build, creating it the first time it is
+    asked for. Datapacks are created from the precompiled ``{build}.datapack``
+    files, which is a good deal quicker than parsing the CSV files, so only
+    the builds that are used are ever created.
+    """
+    build = builds.get(build_id)
+    if build is None:
+        with _lock:
+            build = builds.get(build_id)
+            if build is None:
+                build = create_build(build_id, read_datapack(build_id))
+
+                # Mark the shared classes so they pickle by reference
+                build._reference = ('build', build_id, None)
+                for unit_type, unit in build.units.items():
+                    unit._reference = ('unit', build_id, unit_type)
+                for ability_code, ability in build.abilities.items():
+                    ability._reference = ('ability', build_id, ability_code)
+                builds[build_id] = build
+    return build
+
+def source_files(build):
+    """The names of the unit and ability CSV files of the build."""
+    return ["{0}_{1}.csv".format(build, kind) for kind in ('units', 'abilities')]
+
+def source_hash(build):
+    """The sha1 hex digest of the unit and ability CSV files of the build."""
+    digest = hashlib.sha1()
+    for name in source_files(build):
+        digest.update(pkgutil.get_data('sc2reader.data', name))
+    return digest.hexdigest()
+
+def sources_unchanged(build, sizes):
+    """
+    Returns True if the CSV files of the build are the given sizes and no
+    newer than its datapack file, so they can't have changed since it was
+    written. Files that can't be checked on disk count as changed.
+    """
+    try:
+        written = os.path.getmtime(os.path.join(BASE_PATH, "{0}.datapack".format(build)))
+        stats = [os.stat(os.path.join(BASE_PATH, name)) for name in source_files(build)]
+    except OSError:
+        return False
+    return [stat.st_size for stat in stats] == list(sizes) and all(stat.st_mtime <= written for stat in stats)
+
+def read_datapack(build):
+    """
+    Returns the rows precompiled for the build by :func:`write_datapack`, or
+    None if there is no datapack file for it made from the current CSV files.
+    The CSV files are only hashed, to compare with the hash in the datapack,
+    when they may have changed since it was written.
+    """
+    try:
+        version, csv_hash, csv_sizes, rows = marshal.loads(zlib.decompress(pkgutil.get_data('sc2reader.data', "{0}.datapack".format(build))))
+    except (IOError, EOFError, ValueError, TypeError, zlib.error):
+        return None
+    if version != DATAPACK_VERSION:
+        return None
+    if not sources_unchanged(build, csv_sizes) and csv_hash != source_hash(build):
+        return None
+    return rows
+
+def write_datapack(build, path=BASE_PATH):
+    """
+    Precompiles the CSV files of the build into the ``{build}.datapack`` file
+    :func:`load_build` creates the datapack from, along with the hash and
+    sizes of the CSV files. Run this for every build whenever the CSV files or
+    :func:`compile_build` change; until then the CSV files are parsed::
+
+        python -c "from sc2reader import data; map(data.write_datapack, data.BUILDS)"
+    """
+    sizes = tuple(len(pkgutil.get_data('sc2reader.data', name)) for name in source_files(build))
+    filename = os.path.join(path, "{0}.datapack".format(build))
+    with open(filename, 'wb') as datapack:
+        datapack.write(zlib.compress(marshal.dumps((DATAPACK_VERSION, source_hash(build), sizes, compile_build(build)), 2), 9))
+    return filename
+
+
+#: The names the datapacks were created under on import in earlier versions
+#: and the build id they are loaded with now.
+BUILD_NAMES = dict(build16117=16939, build17326=17811, build18092=18701, build19458=21029, build22612=22612)
+
+class _DataModule(types.ModuleType):
+    """
+    Stands in for this module so the datapacks can still be used by the
+    names in :data:`BUILD_NAMES`, loading them on first access. Everything
+    else is got from, and set on, the module itself.
+    """
+    def __init__(self, module):
+        super(_DataModule, self).__init__(module.__name__, module.__doc__)
+        self.__dict__['_module'] = module
+
+    def __getattr__(self, name):
+        if name in BUILD_NAMES:
+            return load_build(BUILD_NAMES[name])
+        return getattr(self._module, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._module, name, value)
+
+    def __delattr__(self, name):
+        delattr(self._module, name)
+
+    def __dir__(self):
+        return sorted(set(dir(self._module)) | set(BUILD_NAMES))
+
+sys.modules[__name__] = _DataModule(sys.modules[__name__])
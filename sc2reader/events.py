@@ -1,23 +1,55 @@
 from __future__ import absolute_import
 
 from sc2reader.utils import Length, LITTLE_ENDIAN
-from sc2reader.data import Unit
+from sc2reader.data import Unit, get_reference, load_reference
 from sc2reader.log_utils import loggable
 
+
+_slot_names_cache = dict()
+
+def _slot_names(cls):
+    # All the slots of an event class, including those of its bases
+    if cls not in _slot_names_cache:
+        _slot_names_cache[cls] = frozenset(name for base in cls.__mro__ for name in base.__dict__.get('__slots__', ()))
+    return _slot_names_cache[cls]
+
 @loggable
 class Event(object):
+    """
+    Events are plentiful so they keep their fields in ``__slots__`` rather
+    than an instance ``__dict__``. Anything derived from the fields, like
+    the time of the event, is worked out when it is asked for.
+    """
     name = 'Event'
 
+    __slots__ = ('pid', 'frame', 'player', 'bytes')
+
     def __init__(self, frame, pid):
         self.pid = pid
         self.frame = frame
-        self.second = frame >> 4
-        self.time = Length(seconds=self.second)
+
+    @property
+    def second(self):
+        return self.frame >> 4
+
+    @property
+    def time(self):
+        return Length(seconds=self.frame >> 4)
 
     def load_context(self, replay):
         if self.pid != 16:
             self.player = replay.person[self.pid]
 
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in _slot_names(type(self)) if hasattr(self, name))
+
+    def __setstate__(self, state):
+        # Events pickled before they had slots also carry their derived fields
+        slots = _slot_names(type(self))
+        for name, value in state.items():
+            if name in slots:
+                setattr(self, name, value)
+
     def _str_prefix(self):
         player_name = self.player.name if getattr(self,'pid', 16)!=16 else "Global"
         return "%s\t%-15s " % (Length(seconds=int(self.frame/16)), player_name)
@@ -29,16 +61,28 @@ class Event(object):
 class GameEvent(Event):
     name = 'GameEvent'
 
+    __slots__ = ('type',)
+
     """Abstract Event Type, should not be directly instanciated"""
     def __init__(self, frame, pid, event_type):
         super(GameEvent, self).__init__(frame, pid)
-
         self.type = event_type
-        self.is_local = (pid != 16)
-        event_class = event_type >> 4
-        self.is_init = (event_class == 0)
-        self.is_player_action = (event_class == 1)
-        self.is_camera_movement = (event_class == 3)
+
+    @property
+    def is_local(self):
+        return self.pid != 16
+
+    @property
+    def is_init(self):
+        return self.type >> 4 == 0
+
+    @property
+    def is_player_action(self):
+        return self.type >> 4 == 1
+
+    @property
+    def is_camera_movement(self):
+        return self.type >> 4 == 3
 
 #############################################3
 # Message Events
@@ -48,6 +92,8 @@ class GameEvent(Event):
 class MessageEvent(Event):
     name = 'MessageEvent'
 
+    __slots__ = ('flags',)
+
     def __init__(self, frame, pid, flags):
         super(MessageEvent, self).__init__(frame, pid)
         self.flags=flags
@@ -56,18 +102,31 @@ class MessageEvent(Event):
 class ChatEvent(MessageEvent):
     name = 'ChatEvent'
 
+    __slots__ = ('target', 'text')
+
     def __init__(self, frame, pid, flags, target, text):
         super(ChatEvent, self).__init__(frame, pid, flags)
         self.target = target
         self.text = text
-        self.to_all = (self.target == 0)
-        self.to_allies = (self.target == 2)
-        self.to_observers = (self.target == 4)
+
+    @property
+    def to_all(self):
+        return self.target == 0
+
+    @property
+    def to_allies(self):
+        return self.target == 2
+
+    @property
+    def to_observers(self):
+        return self.target == 4
 
 @loggable
 class PacketEvent(MessageEvent):
     name = 'PacketEvent'
 
+    __slots__ = ('info',)
+
     def __init__(self, frame, pid, flags, info):
         super(PacketEvent, self).__init__(frame, pid, flags)
         self.info = info
@@ -76,6 +135,8 @@ class PacketEvent(MessageEvent):
 class PingEvent(MessageEvent):
     name = 'PingEvent'
 
+    __slots__ = ('x', 'y')
+
     def __init__(self, frame, pid, flags, x, y):
         super(PingEvent, self).__init__(frame, pid, flags)
         self.x, self.y = x, y
@@ -88,9 +149,13 @@ class PingEvent(MessageEvent):
 class UnknownEvent(GameEvent):
     name = 'UnknownEvent'
 
+    __slots__ = ()
+
 class PlayerJoinEvent(GameEvent):
     name = 'PlayerJoinEvent'
 
+    __slots__ = ('flags',)
+
     def __init__(self, frames, pid, event_type, flags):
         super(PlayerJoinEvent, self).__init__(frames, pid, event_type)
         self.flags = flags
@@ -98,12 +163,18 @@ class PlayerJoinEvent(GameEvent):
 class GameStartEvent(GameEvent):
     name = 'GameStartEvent'
 
+    __slots__ = ()
+
 class PlayerLeaveEvent(GameEvent):
     name = 'PlayerLeaveEvent'
 
+    __slots__ = ()
+
 class CameraEvent(GameEvent):
     name = 'CameraEvent'
 
+    __slots__ = ('x', 'y', 'distance', 'pitch', 'yaw', 'height_offset')
+
     def __init__(self, frames, pid, event_type, x, y, distance, pitch, yaw, height_offset):
         super(CameraEvent, self).__init__(frames, pid, event_type)
         self.x, self.y = x, y
@@ -118,10 +189,14 @@ class CameraEvent(GameEvent):
 class PlayerActionEvent(GameEvent):
     name = 'PlayerActionEvent'
 
+    __slots__ = ()
+
 @loggable
 class SendResourceEvent(PlayerActionEvent):
     name = 'SendResourceEvent'
 
+    __slots__ = ('sender', 'reciever', 'minerals', 'vespene', 'terrazine', 'custom')
+
     def __init__(self, frames, pid, event_type, target, minerals, vespene, terrazine, custom):
         super(SendResourceEvent, self).__init__(frames, pid, event_type)
         self.sender = pid
@@ -143,6 +218,8 @@ class SendResourceEvent(PlayerActionEvent):
 class RequestResourceEvent(PlayerActionEvent):
     name = 'RequestResourceEvent'
 
+    __slots__ = ('minerals', 'vespene', 'terrazine', 'custom')
+
     def __init__(self, frames, pid, event_type, minerals, vespene, terrazine, custom):
         super(RequestResourceEvent, self).__init__(frames, pid, event_type)
         self.minerals = minerals
@@ -157,6 +234,8 @@ class RequestResourceEvent(PlayerActionEvent):
 class AbilityEvent(PlayerActionEvent):
     name = 'AbilityEvent'
 
+    __slots__ = ('ability_code', 'ability_name', 'flags', 'ability')
+
     def __init__(self, frame, pid, event_type, ability, flags):
         super(AbilityEvent, self).__init__(frame, pid, event_type)
         self.ability_code = ability
@@ -182,6 +261,19 @@ class AbilityEvent(PlayerActionEvent):
             self.ability = replay.datapack.abilities[self.ability_code]
             self.ability_name = self.ability.name
 
+    def __getstate__(self):
+        # Ability classes can't be pickled by name, see data.get_reference
+        state = super(AbilityEvent, self).__getstate__()
+        reference = get_reference(state.get('ability'))
+        if reference is not None:
+            state['ability'] = reference
+        return state
+
+    def __setstate__(self, state):
+        super(AbilityEvent, self).__setstate__(state)
+        if isinstance(getattr(self, 'ability', None), tuple):
+            self.ability = load_reference(self.ability)
+
 
     def __str__(self):
         return self._str_prefix() + "Ability (%s) - %s" % (hex(self.ability_code), self.ability_name)
@@ -190,6 +282,8 @@ class AbilityEvent(PlayerActionEvent):
 class TargetAbilityEvent(AbilityEvent):
     name = 'TargetAbilityEvent'
 
+    __slots__ = ('target', 'target_id', 'target_type', 'target_owner', 'target_owner_id', 'target_team', 'target_team_id', 'location')
+
     def __init__(self, frame, pid, event_type, ability, flags, target, player, team, location):
         super(TargetAbilityEvent, self).__init__(frame, pid, event_type, ability, flags)
         self.target = None
@@ -255,6 +349,8 @@ class TargetAbilityEvent(AbilityEvent):
 class LocationAbilityEvent(AbilityEvent):
     name = 'LocationAbilityEvent'
 
+    __slots__ = ('location',)
+
     def __init__(self, frame, pid, event_type, ability, flags, location):
         super(LocationAbilityEvent, self).__init__(frame, pid, event_type, ability, flags)
         self.location = location
@@ -266,6 +362,8 @@ class LocationAbilityEvent(AbilityEvent):
 class SelfAbilityEvent(AbilityEvent):
     name = 'SelfAbilityEvent'
 
+    __slots__ = ('info',)
+
     def __init__(self, frame, pid, event_type, ability, flags, info):
         super(SelfAbilityEvent, self).__init__(frame, pid, event_type, ability, flags)
         self.info = info
@@ -274,6 +372,8 @@ class SelfAbilityEvent(AbilityEvent):
 class HotkeyEvent(PlayerActionEvent):
     name = 'HotkeyEvent'
 
+    __slots__ = ('hotkey', 'deselect', 'selected')
+
     def __init__(self, frame, pid, event_type, hotkey, deselect):
         super(HotkeyEvent, self).__init__(frame, pid, event_type)
         self.hotkey = hotkey
@@ -282,16 +382,24 @@ class HotkeyEvent(PlayerActionEvent):
 class SetToHotkeyEvent(HotkeyEvent):
     name = 'SetToHotkeyEvent'
 
+    __slots__ = ()
+
 class AddToHotkeyEvent(HotkeyEvent):
     name = 'AddToHotkeyEvent'
 
+    __slots__ = ()
+
 class GetFromHotkeyEvent(HotkeyEvent):
     name = 'GetFromHotkeyEvent'
 
+    __slots__ = ()
+
 @loggable
 class SelectionEvent(PlayerActionEvent):
     name = 'SelectionEvent'
 
+    __slots__ = ('bank', 'raw_objects', 'deselect', 'objects', 'selected')
+
     def __init__(self, frame, pid, event_type, bank, objects, deselect):
         super(SelectionEvent, self).__init__(frame, pid, event_type)
         self.bank = bank
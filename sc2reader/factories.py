@@ -2,20 +2,39 @@ from __future__ import absolute_import
 
 import os
 import re
+import time
+import zlib
+import sqlite3
+import mmap
+import socket
+import httplib
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import urllib2
 from cStringIO import StringIO
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple, OrderedDict
+from itertools import groupby
 
 
+import sc2reader
 from sc2reader import readers
 from sc2reader import data
 from sc2reader import exceptions
 from sc2reader import utils
 from sc2reader import log_utils
-from sc2reader.objects import DepotFile
+from sc2reader.objects import DepotFile, ReplayHeader
 from sc2reader.resources import Resource, Replay, Map, GameSummary, MapInfo, MapHeader, Localization
+from sc2reader.plugins.utils import EventPlugin, run_event_plugins
+
+
+#: Returned in place of a resource by parallel loads when a file fails to
+#: load with a :class:`ReadError` or :class:`MPQError`. ``error`` is the
+#: exception class and ``traceback`` the formatted traceback from the worker.
+LoadFailure = namedtuple('LoadFailure', ['filename', 'error', 'message', 'traceback'])
 
 @log_utils.loggable
 class SC2Factory(object):
@@ -41,6 +60,52 @@ class SC2Factory(object):
     sc2reader comes with some post processing capabilities which, depending
     on your needs, may be useful. You can register these plugins to the load
     process with the :meth:`register_plugins` method.
+
+    The plural load methods can spread the work over a pool of processes
+    with the ``workers`` option::
+
+        for replay in factory.load_replays(path, workers=4, ordered=False):
+            if isinstance(replay, LoadFailure):
+                print replay.filename, replay.message
+
+    Results are yielded in input order unless ``ordered`` is False, in which
+    case they come back as they finish; ``chunksize`` sets how many files
+    are handed to a worker at a time. Files that fail with a
+    :class:`ReadError` or :class:`MPQError` are yielded as a
+    :class:`LoadFailure` instead of stopping the batch. Plugins run inside
+    the workers and the finished resources are pickled back to the calling
+    process without their archive. Workers inherit the factory by forking
+    so this mode is only supported on platforms with fork.
+
+    Local files are read into memory before they are loaded. With the
+    ``mmap`` option they are memory mapped instead, so hashing, reading the
+    header and reading from the archive all work from the one mapping of
+    the file rather than from copies of it.
+
+    Resources hash their file with sha256 as they load, see
+    :attr:`Resource.filehash`. The ``hash_algorithm`` option switches to
+    another hashlib algorithm, to the much faster ``crc32`` or ``adler32``
+    checksums, or turns hashing off when set to None.
+
+    Maps loaded from the depot for replays, see :meth:`Replay.load_map`, are
+    kept in a :class:`MapCache` keyed on their depot hash so each map is
+    downloaded and parsed just once. The ``map_cache_size`` most recently
+    used maps are kept in memory and, given a ``map_cache_path`` directory,
+    the downloaded s2ma files are kept there for later runs, laid out as a
+    :class:`DepotMirror`.
+
+    Depot files, and urls pointing at the depot servers, are fetched by the
+    factory's ``depot_resolver``. The default :class:`DepotResolver`
+    downloads them every time; a :class:`DepotMirror` keeps them in a local
+    directory and, when ``offline``, never touches the network::
+
+        factory = SC2Factory(depot_resolver=DepotMirror('depot', offline=True))
+
+    When a list of depot files is loaded, like the localization sheets of a
+    :class:`GameSummary`, they are all fetched at once by a
+    :class:`DepotFetcher` with up to ``depot_workers`` requests in flight.
+    Failed requests are retried ``depot_retries`` times. :meth:`close` shuts
+    the fetcher's threads down once the factory is done with them.
     """
 
     _resource_name_map = dict(replay=Replay,map=Map)
@@ -50,8 +115,15 @@ class SC2Factory(object):
         Replay: {'load_level':4, 'load_map':False},
     }
 
-    def __init__(self, **options):
+    def __init__(self, map_cache_size=16, map_cache_path=None, depot_resolver=None, depot_workers=8, depot_retries=2, **options):
         self.plugins = list()
+        self.map_cache = MapCache(map_cache_size, map_cache_path)
+        self.depot_resolver = depot_resolver or DepotResolver()
+        self.depot_fetcher = DepotFetcher(depot_workers, depot_retries)
+
+        # Readers and datapacks for the replays this factory loads
+        self.registered_readers = defaultdict(list)
+        self.registered_datapacks = list()
 
         # Bootstrap with the default options
         self.options = defaultdict(dict)
@@ -80,7 +152,12 @@ class SC2Factory(object):
         return self.load_all(Localization, sources, options, extension='s2ml', **new_options)
 
     def load_map(self, source, options=None, **new_options):
-        """Loads a single s2ma file. Accepts file path, url, or file object."""
+        """
+        Loads a single s2ma file. Accepts file path, url, file object, or
+        :class:`DepotFile`. Depot files are loaded through the map cache.
+        """
+        if isinstance(source, DepotFile):
+            return self._load_depot_map(source, options or self._get_options(Map, **new_options))
         return self.load(Map, source, options, **new_options)
 
     def load_maps(self, sources, options=None, **new_options):
@@ -111,6 +188,28 @@ class SC2Factory(object):
         """Loads a collection of s2mh files, returns a generator."""
         return plugins_all(MapHeader, sources, options, extension='s2mh', **new_options)
 
+    def scan_headers(self, sources):
+        """
+        Reads just the header of each SC2Replay file without opening its MPQ
+        archive, returns a generator of :class:`ReplayHeader` records. Only
+        a couple hundred bytes are read from each file. Accepts a directory,
+        or a collection of file paths and file objects.
+        """
+        if isinstance(sources, basestring):
+            sources = utils.get_files(sources, extension='SC2Replay')
+
+        for source in sources:
+            if isinstance(source, basestring):
+                with open(source, 'rb') as replay_file:
+                    header = dict(utils.read_header(replay_file))
+                filename = source
+            else:
+                header = dict(utils.read_header(source))
+                filename = getattr(source, 'name', 'Unknown')
+
+            expansion = ['','WoL','HotS'][header['versions'][1]]
+            yield ReplayHeader(filename=filename, expansion=expansion, **header)
+
     def configure(self, cls=None, **options):
         """ Configures the factory to use the supplied options. If cls is specified
             the options will only be applied when loading that class"""
@@ -129,6 +228,24 @@ class SC2Factory(object):
             cls = self._resource_name_map.get(cls.lower(),Resource)
         self.plugins.append((cls, plugin))
 
+    def register_reader(self, data_file, reader, filterfunc=lambda r: True):
+        """
+        Registers a reader for the replays loaded by this factory, see
+        :meth:`Replay.register_reader`.
+        """
+        self.registered_readers[data_file].insert(0,(filterfunc, reader))
+
+    def register_datapack(self, datapack, filterfunc=lambda r: True):
+        """
+        Registers a datapack for the replays loaded by this factory, see
+        :meth:`Replay.register_datapack`.
+        """
+        self.registered_datapacks.insert(0,(filterfunc, datapack))
+
+    def close(self):
+        "Shuts down the threads the factory fetches depot files with"
+        self.depot_fetcher.close()
+
 
     # Support Functions
     def load(self, cls, source, options=None, **new_options):
@@ -138,18 +255,65 @@ class SC2Factory(object):
 
     def load_all(self, cls, sources, options=None, **new_options):
         options = options or self._get_options(cls, **new_options)
-        for resource, filename in self._load_resources(sources, options=options):
-            yield self._load(cls, resource, filename=filename, options=options)
+        if options.get('workers', 1) > 1:
+            for obj in self._load_all_parallel(cls, sources, options=options):
+                yield obj
+        else:
+            for resource, filename in self._load_resources(sources, options=options):
+                yield self._load(cls, resource, filename=filename, options=options)
 
 
     # Internal Functions
     def _load(self, cls, resource, filename, options):
         obj = cls(resource, filename=filename, factory=self, **options)
-        for plugin in options.get('plugins',self._get_plugins(cls)):
-            # TODO: What if you want to do a transform?
-            plugin(obj)
+        plugins = options.get('plugins',self._get_plugins(cls))
+        for batched, group in groupby(plugins, lambda plugin: isinstance(plugin, EventPlugin)):
+            if batched:
+                # Event plugins registered one after another share a single
+                # pass over the events
+                run_event_plugins(obj, list(group))
+            else:
+                for plugin in group:
+                    # TODO: What if you want to do a transform?
+                    plugin(obj)
         return obj
 
+    def _load_depot_map(self, depot_file, options):
+        map_obj = self.map_cache.get(depot_file.hash)
+        if map_obj is None:
+            contents = self.map_cache.read(depot_file)
+            if contents is None:
+                contents = self.load_depot_resource_contents(depot_file, **options)
+                self.map_cache.write(depot_file, contents)
+
+            options = utils.merged_dict(options, dict(gateway=depot_file.server, map_hash=depot_file.hash))
+            map_obj = self._load(Map, StringIO(contents), filename=depot_file.url, options=options)
+            self.map_cache.set(depot_file.hash, map_obj)
+        return map_obj
+
+    def _load_all_parallel(self, cls, sources, options):
+        # Path to a folder, retrieve all relevant files as the collection
+        if isinstance(sources, basestring):
+            sources = utils.get_files(sources, **options)
+
+        # File objects can't be shared with the workers so read them here
+        sources = (_portable_source(source) for source in sources)
+
+        pool = multiprocessing.Pool(options['workers'], _init_worker, (self, cls, options))
+        try:
+            imap = pool.imap if options.get('ordered', True) else pool.imap_unordered
+            for result in imap(_load_worker, sources, options.get('chunksize', 1)):
+                if isinstance(result, LoadFailure):
+                    yield result
+                else:
+                    obj = utils.deserialize(result)
+                    obj.factory = self
+                    yield obj
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
     def _get_plugins(self, cls):
         plugins = list()
         for ext_cls, plugin in self.plugins:
@@ -173,37 +337,64 @@ class SC2Factory(object):
         if isinstance(resources, basestring):
             resources = utils.get_files(resources, **options)
 
+        # Start fetching all the depot files at once rather than one by one
+        fetches = dict()
+        if isinstance(resources, (list, tuple)):
+            depot_files = [resource for resource in resources if isinstance(resource, DepotFile)]
+            if len(depot_files) > 1:
+                fetch = lambda depot_file: self.load_depot_resource_contents(depot_file, **options)
+                for depot_file in depot_files:
+                    fetches[id(depot_file)] = self.depot_fetcher.submit(depot_file, fetch)
+
         for resource in resources:
-            yield self._load_resource(resource, options=options)
+            if id(resource) in fetches:
+                yield (StringIO(fetches[id(resource)].get()), resource.url)
+            else:
+                yield self._load_resource(resource, options=options)
 
     def load_remote_resource_contents(self, resource, **options):
         self.logger.info("Fetching remote resource: "+resource)
         return urllib2.urlopen(resource).read()
 
+    def load_depot_resource_contents(self, depot_file, **options):
+        return self.depot_resolver.resolve(depot_file, lambda url: self.load_remote_resource_contents(url, **options))
+
     def load_local_resource_contents(self, location, **options):
         # Extract the contents so we can close the file
         with open(location, 'rb') as resource_file:
             return resource_file.read()
 
+    def load_local_resource_map(self, location, **options):
+        # The map stays valid after the file is closed
+        with open(location, 'rb') as resource_file:
+            if os.fstat(resource_file.fileno()).st_size == 0:
+                return StringIO('')
+            return mmap.mmap(resource_file.fileno(), 0, access=mmap.ACCESS_READ)
+
     def _load_resource(self, resource, options=None, **new_options):
         """http links, filesystem locations, and file-like objects"""
         options = options or self._get_options(Resource, **new_options)
 
+        if isinstance(resource, basestring):
+            resource = DepotFile.from_url(resource) or resource
+
         if isinstance(resource, DepotFile):
-            resource = resource.url
+            resource_name = resource.url
+            resource = StringIO(self.load_depot_resource_contents(resource, **options))
 
-        if isinstance(resource, basestring):
+        elif isinstance(resource, basestring):
+            # StringIO implements a fuller file-like object
+            resource_name = resource
             if re.match(r'https?://',resource):
-                contents = self.load_remote_resource_contents(resource, **options)
+                resource = StringIO(self.load_remote_resource_contents(resource, **options))
 
             else:
                 directory = options.get('directory','')
                 location = os.path.join(directory, resource)
-                contents = self.load_local_resource_contents(location, **options)
-
-            # StringIO implements a fuller file-like object
-            resource_name = resource
-            resource = StringIO(contents)
+                if options.get('mmap', False):
+                    resource = self.load_local_resource_map(location, **options)
+                else:
+                    resource = StringIO(self.load_local_resource_contents(location, **options))
 
         else:
             # Totally not designed for large files!!
@@ -219,28 +410,311 @@ class SC2Factory(object):
         return (resource, resource_name)
 
 
-class SC2Cache(SC2Factory):
-
-    def __init__(self, **options):
-        super(SC2Cache, self).__init__(self, **options)
-        self.cache = IntitializeCache(**options)
+# Parallel loading support. Each worker process holds the (forked) factory,
+# resource class, and options for the batch it is loading.
+_worker = None
 
-    def load_map(self, map_file, options=None, **new_options):
-        options = options or utils.merged_dict(self.options, new_options)
+def _init_worker(factory, cls, options):
+    global _worker
+    _worker = (factory, cls, options)
 
-        if self.cache.has(map_file):
-            return self.cache.get(map_file)
+def _load_worker(source):
+    factory, cls, options = _worker
+    try:
+        if isinstance(source, tuple):
+            resource, filename = StringIO(source[0]), source[1]
         else:
-            map = super(SC2Cache, self).load_map(map_file, options=options)
-            self.cache.set(map_file, map)
-            return map
+            resource, filename = factory._load_resource(source, options=options)
+        return utils.serialize(factory._load(cls, resource, filename=filename, options=options))
 
-    def load_replay(self, replay_file, options=None, **new_options):
-        options = options or utils.merged_dict(self.options, new_options)
+    except (exceptions.ReadError, exceptions.MPQError) as e:
+        return LoadFailure(filename, e.__class__, str(e), traceback.format_exc())
 
-        if self.cache.has(replay_file):
-            return self.cache.get(replay_file)
+def _portable_source(source):
+    if isinstance(source, (basestring, DepotFile)):
+        return source
+    return (source.read(), getattr(source, 'name', 'Unknown'))
+
+class SqliteCache(object):
+    """
+    A size limited key => string store kept in a sqlite database. Once the
+    stored values grow past ``max_size`` bytes the least recently used
+    entries are evicted. Safe to share between processes.
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._db = None
+        self._pid = None
+
+    @property
+    def db(self):
+        # sqlite connections can't be carried across a fork so every process
+        # gets a connection of its own.
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=60)
+            self._db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+            self._pid = os.getpid()
+        return self._db
+
+    def get(self, key):
+        with self.db as db:
+            row = db.execute('SELECT value FROM cache WHERE key=?', (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE cache SET used=? WHERE key=?', (time.time(), key))
+            return str(row[0])
+
+    def set(self, key, value):
+        with self.db as db:
+            db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (key, sqlite3.Binary(value), len(value), time.time()))
+
+            # Evict the least recently used entries until we fit again, but
+            # always keep the entry we just added.
+            excess = db.execute('SELECT SUM(size) FROM cache').fetchone()[0] - self.max_size
+            evicted = list()
+            for old_key, size in db.execute('SELECT key, size FROM cache WHERE key!=? ORDER BY used', (key,)):
+                if excess <= 0:
+                    break
+                evicted.append((old_key,))
+                excess -= size
+            db.executemany('DELETE FROM cache WHERE key=?', evicted)
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class MapCache(object):
+    """
+    Keeps the ``size`` most recently used maps in memory, keyed on their
+    depot hash. Given a ``path`` the downloaded s2ma files are also stored
+    in a :class:`DepotMirror` there, so later runs, and factories resolving
+    depot files from the same mirror, don't download them again. ``hits``
+    counts maps served from memory, ``disk_hits`` maps parsed from a stored
+    file and ``misses`` maps that had to be downloaded.
+    """
+    def __init__(self, size=16, path=None):
+        self.size = size
+        self.path = path
+        self.mirror = DepotMirror(path) if path is not None else None
+        self.maps = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, map_hash):
+        map_obj = self.maps.pop(map_hash, None)
+        if map_obj is not None:
+            self.maps[map_hash] = map_obj
+            self.hits += 1
+        return map_obj
+
+    def set(self, map_hash, map_obj):
+        self.maps.pop(map_hash, None)
+        self.maps[map_hash] = map_obj
+        while len(self.maps) > self.size:
+            self.maps.popitem(last=False)
+
+    def read(self, depot_file):
+        """Returns the stored contents of the map's depot file, None if not stored."""
+        contents = self.mirror.read(depot_file) if self.mirror is not None else None
+        if contents is not None:
+            self.disk_hits += 1
         else:
-            replay = super(SC2Cache, self).load_replay(replay_file, options=options)
-            self.cache.set(replay_file, replay)
-            return replay
+            self.misses += 1
+        return contents
+
+    def write(self, depot_file, contents):
+        if self.mirror is not None:
+            self.mirror.store(depot_file, contents)
+
+    def clear(self):
+        self.maps.clear()
+
+    def __len__(self):
+        return len(self.maps)
+
+
+class DepotResolver(object):
+    """
+    Fetches the files hosted on the battle.net depot servers. Subclasses
+    override :meth:`resolve` to find them elsewhere.
+    """
+    def resolve(self, depot_file, download):
+        """
+        Returns the contents of the :class:`DepotFile`. ``download`` fetches
+        the contents of a url.
+        """
+        return download(depot_file.url)
+
+
+class DepotFetcher(object):
+    """
+    Fetches depot files on a pool of ``workers`` threads, which also limits
+    the number of requests in flight. Requests that time out, fail to connect
+    or get a server error are retried up to ``retries`` times, waiting
+    ``retry_delay`` seconds longer before each retry; other errors, such as a
+    file missing from the depot, are raised right away. A file requested again while it is still being
+    fetched, by this or another thread, shares the request already made.
+    """
+    def __init__(self, workers=8, retries=2, retry_delay=0.5):
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pending = dict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    @property
+    def pool(self):
+        # Threads don't survive a fork so every process starts its own pool
+        if self._pid != os.getpid():
+            self._pool = ThreadPool(self.workers)
+            self._pid = os.getpid()
+        return self._pool
+
+    def submit(self, depot_file, fetch):
+        """
+        Starts fetching the :class:`DepotFile` with ``fetch`` and returns an
+        AsyncResult; its ``get`` method returns the contents of the file.
+        """
+        with self._lock:
+            result = self.pending.get(depot_file.url)
+            if result is None:
+                result = self.pool.apply_async(self._fetch, (depot_file, fetch))
+                self.pending[depot_file.url] = result
+            return result
+
+    def close(self):
+        """
+        Waits for the fetches in flight and shuts the pool of threads down.
+        The fetcher starts a new pool if it is used again.
+        """
+        with self._lock:
+            pool, pid = self._pool, self._pid
+            self._pool = self._pid = None
+
+        # A pool inherited through a fork has no threads to shut down
+        if pool is not None and pid == os.getpid():
+            pool.close()
+            pool.join()
+
+    def _fetch(self, depot_file, fetch):
+        try:
+            for attempt in range(self.retries+1):
+                try:
+                    return fetch(depot_file)
+                except (IOError, httplib.HTTPException) as e:
+                    if attempt == self.retries or not self._retryable(e):
+                        raise
+                    time.sleep(self.retry_delay*(attempt+1))
+        finally:
+            with self._lock:
+                self.pending.pop(depot_file.url, None)
+
+    def _retryable(self, error):
+        # Client errors such as a 404 won't go away by asking again
+        if isinstance(error, urllib2.HTTPError):
+            return error.code >= 500
+        return isinstance(error, (urllib2.URLError, socket.error, httplib.HTTPException))
+
+
+class DepotMirror(DepotResolver):
+    """
+    Serves depot files from a local directory, stored by hash and extension
+    as ``path/ab/abcdef....s2ml``. Depot files never change so the mirror
+    never needs refreshing. Files missing from the mirror are downloaded
+    and stored, or, when ``offline``, raise a :class:`FileError`.
+    """
+    def __init__(self, path, offline=False):
+        self.path = path
+        self.offline = offline
+
+    def resolve(self, depot_file, download):
+        contents = self.read(depot_file)
+        if contents is not None:
+            return contents
+
+        if self.offline:
+            raise exceptions.FileError("{0} is not in the depot mirror at {1}".format(depot_file, self.path))
+
+        contents = download(depot_file.url)
+        self.store(depot_file, contents)
+        return contents
+
+    def read(self, depot_file):
+        """Returns the mirrored contents of the depot file, None if not mirrored."""
+        try:
+            with open(self.file_path(depot_file), 'rb') as depot:
+                return depot.read()
+        except IOError:
+            return None
+
+    def store(self, depot_file, contents):
+        file_path = self.file_path(depot_file)
+        directory = os.path.dirname(file_path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process got there first
+                pass
+
+        # Write to a temporary file first so other processes never see a
+        # partially written file
+        temp_path = "{0}.{1}.tmp".format(file_path, os.getpid())
+        with open(temp_path, 'wb') as depot:
+            depot.write(contents)
+        os.rename(temp_path, file_path)
+
+    def file_path(self, depot_file):
+        file_hash = depot_file.hash.lower()
+        return os.path.join(self.path, file_hash[:2], "{0}.{1}".format(file_hash, depot_file.type.strip('\x00').lower()))
+
+
+class SC2Cache(SC2Factory):
+    """
+    A factory that keeps the raw reader output of the replays it loads in
+    a sqlite database at ``cache_path``. Loading a replay again at the same
+    load level with the same sc2reader version rebuilds it from the cache
+    without decompressing or parsing the archive. The rest of the load,
+    plugins included, runs as usual.
+
+    Entries are keyed on the sha256 of the replay file and stored zlib
+    compressed, separately for each set of ``event_types`` they are read
+    with. When the cache grows past ``cache_size`` bytes the least
+    recently used replays are evicted. Other resources are loaded as usual.
+    """
+
+    def __init__(self, cache_path='sc2reader_cache.db', cache_size=1024**3, **options):
+        super(SC2Cache, self).__init__(**options)
+        self.cache = SqliteCache(cache_path, cache_size)
+
+    def _load(self, cls, resource, filename, options):
+        if not issubclass(cls, Replay):
+            return super(SC2Cache, self)._load(cls, resource, filename, options)
+
+        filehash = utils.hash_file(resource)
+        key = self._cache_key(filehash, options)
+        cached = self.cache.get(key)
+        raw_data_store = utils.deserialize(zlib.decompress(cached)) if cached else dict()
+        stored = len(raw_data_store)
+
+        # Share the hash so the replay doesn't hash the file again
+        options = utils.merged_dict(options, dict(raw_data_store=raw_data_store, filehash=filehash))
+        replay = super(SC2Cache, self)._load(cls, resource, filename, options)
+
+        if len(raw_data_store) != stored:
+            self.cache.set(key, zlib.compress(utils.serialize(raw_data_store)))
+        return replay
+
+    def _cache_key(self, filehash, options):
+        key = "{0}:{1}:{2}".format(filehash, options.get('load_level', 4), sc2reader.__version__)
+
+        # Replays read with only some event types keep only those events
+        event_types = options.get('event_types')
+        if event_types is not None:
+            key += ":"+",".join(sorted(cls.__name__ for cls in event_types))
+        return key
@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 
+import re
 import hashlib
+import binascii
 
 from collections import namedtuple
 
@@ -13,6 +15,22 @@ MapData = namedtuple('MapData',['gateway','map_hash'])
 PlayerData = namedtuple('PlayerData',['name','bnet','race','color','unknown1','unknown2','handicap','unknown3','result'])
 ColorData = namedtuple('ColorData',['a','r','g','b'])
 BnetData = namedtuple('BnetData',['unknown1','unknown2','subregion','uid'])
+Details = namedtuple('Details',['players','map','unknown1','unknown2','os','file_time','utc_adjustment','unknown4','unknown5','unknown6','unknown7','unknown8','unknown9','unknown10'])
+Details22612 = namedtuple('Details22612',['players','map','unknown1','unknown2','os','file_time','utc_adjustment','unknown4','unknown5','unknown6','unknown7','unknown8','unknown9','unknown10', 'unknown11'])
+DetailsBeta = namedtuple('DetailsBeta',['players','map','unknown1','unknown2','os','file_time','utc_adjustment','unknown4','unknown5','unknown6','unknown7','unknown8','unknown9','unknown10', 'unknown11', 'unknown12'])
+
+ReplayHeader = namedtuple('ReplayHeader',['filename','versions','build','release_string','expansion','frames','length'])
+
+# Game summary records, the values under keys they don't name are kept in extra
+SummaryDetails = namedtuple('SummaryDetails',['options','players','properties','lobby','game_length','end_time','extra'])
+SummaryLobby = namedtuple('SummaryLobby',['settings','s2mv_files','localizations','extra'])
+SummaryPlayer = namedtuple('SummaryPlayer',['slot','result','race','extra'])
+SummaryProperty = namedtuple('SummaryProperty',['id','values','name','requirements','defaults','extra'])
+SummaryMapping = namedtuple('SummaryMapping',['id','translation','extra'])
+SummaryItem = namedtuple('SummaryItem',['id','values','extra'])
+SummaryEntry = namedtuple('SummaryEntry',['value','info','time','extra'])
+
+DEPOT_URL = re.compile(r'https?://(\w+)\.depot\.battle\.net:1119/([0-9a-fA-F]{64})\.(\w+)$')
 
 class DepotFile(object):
     url_template = 'http://{0}.depot.battle.net:1119/{1}.{2}'
@@ -26,6 +44,15 @@ class DepotFile(object):
     def url(self):
         return self.url_template.format(self.server, self.hash, self.type)
 
+    @classmethod
+    def from_url(cls, url):
+        """Builds the depot file for a depot url, None for other urls."""
+        match = DEPOT_URL.match(url)
+        if match is None:
+            return None
+        server, file_hash, file_type = match.groups()
+        return cls(file_type.ljust(4, '\x00')+server.ljust(4, '\x00')+file_hash.decode('hex'))
+
     def __hash__(self):
         return hash(self.url)
 
@@ -33,6 +60,75 @@ class DepotFile(object):
         return self.url
 
 
+class SelectionMask(object):
+    """
+    The units deselected by a selection update, packed into an integer:
+    when bit ``i`` of ``bits`` is set the unit at index ``i`` of the current
+    selection is deselected. The mask covers the first ``length`` units and
+    behaves like a list of ``length`` booleans, True => Deselect, but the
+    booleans are only built when it is iterated over.
+    """
+    __slots__ = ('bits', 'length')
+
+    #: Maps the binary digits of the mask to flags for the units kept
+    KEEP_FLAGS = ''.join(chr(c == '0') for c in map(chr, range(256)))
+
+    def __init__(self, bits, length):
+        self.bits = bits
+        self.length = length
+
+    @classmethod
+    def from_bytes(cls, data, length):
+        """Builds a mask from its bytes in little endian order."""
+        return cls(int(binascii.hexlify(data[::-1]), 16) if data else 0, length)
+
+    @classmethod
+    def from_list(cls, mask):
+        """Builds a mask from a list of booleans."""
+        return cls(sum(1 << index for index, deselect in enumerate(mask) if deselect), len(mask))
+
+    def keep_flags(self):
+        """A bytearray with a 1 for each of the units the mask keeps."""
+        digits = bin(self.bits)[:1:-1][:self.length] if self.bits else ''
+        return bytearray(digits.translate(self.KEEP_FLAGS).ljust(self.length, '\x01'))
+
+    def indexes(self):
+        """The indexes of the deselected units."""
+        return [index for index, keep in enumerate(self.keep_flags()) if not keep]
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return (not keep for keep in self.keep_flags())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("SelectionMask index out of range")
+        return bool(self.bits >> index & 1)
+
+    def __eq__(self, other):
+        if isinstance(other, SelectionMask):
+            return (self.bits, self.length) == (other.bits, other.length)
+        return list(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getstate__(self):
+        return (self.bits, self.length)
+
+    def __setstate__(self, state):
+        self.bits, self.length = state
+
+    def __repr__(self):
+        return "SelectionMask({0:#x}, {1})".format(self.bits, self.length)
+
+
 class Team(object):
     """
     The team object primarily a container object for organizing :class:`Player`
@@ -339,3 +435,71 @@ class Graph():
 
     def __str__(self):
         return "Graph with {0} values".format(len(self.times))
+
+
+class EventTable(object):
+    """
+    A columnar copy of a replay's game events, see :meth:`Replay.event_table`.
+    Each column is a NumPy array with an entry for every event, in frame order.
+    Fields an event doesn't have are -1 for integer columns and NaN for the
+    location columns. Requires NumPy.
+
+    The game events reader fills tables in as it decodes with :meth:`append`
+    and :meth:`finish`, see :meth:`GameEventsReader_Base.read_table`. Passing
+    already loaded ``events`` converts them instead.
+    """
+
+    #: The names and NumPy types of the columns, in order
+    columns = [
+        ('frame', 'i4'), ('pid', 'i1'), ('event_type', 'i2'), ('name', 'S24'),
+        ('ability_code', 'i4'), ('x', 'f8'), ('y', 'f8'), ('z', 'f8'),
+        ('target_id', 'i8'), ('target_type', 'i8'),
+    ]
+
+    #: Columns of the :attr:`selections` side table. ``event`` is the row of
+    #: the :class:`SelectionEvent` the unit was selected by.
+    selection_columns = [('event', 'i4'), ('unit_id', 'i8'), ('unit_type', 'i8')]
+
+    def __init__(self, events=None):
+        # Plain python values are collected per column until finish
+        self._values = tuple(list() for column in self.columns)
+        self._selections = list()
+        if events is not None:
+            for event in events:
+                self.append(event)
+            self.finish()
+
+    def append(self, event):
+        """Adds the fields of the given event as the next row of the table."""
+        if hasattr(event, 'location'):
+            x, y, z = event.location
+        elif hasattr(event, 'x'):
+            x, y, z = event.x, event.y, float('nan')
+        else:
+            x = y = z = float('nan')
+
+        values = self._values
+        index = len(values[0])
+        for column, value in zip(values, (
+                event.frame, event.pid, event.type, event.name,
+                getattr(event, 'ability_code', -1), x, y, z,
+                getattr(event, 'target_id', -1), getattr(event, 'target_type', -1))):
+            column.append(value)
+
+        for unit_id, unit_type in getattr(event, 'raw_objects', ()):
+            self._selections.append((index, unit_id, unit_type))
+
+    def finish(self):
+        """Turns the collected columns into NumPy arrays and returns the table."""
+        import numpy
+
+        for (column, dtype), values in zip(self.columns, self._values):
+            setattr(self, column, numpy.array(values, dtype=dtype))
+
+        selections = numpy.array(self._selections, dtype=self.selection_columns)
+        self.selections = AttributeDict((column, selections[column].copy()) for column, dtype in self.selection_columns)
+        del self._values, self._selections
+        return self
+
+    def __len__(self):
+        return len(self.frame)
@@ -3,17 +3,19 @@ from __future__ import absolute_import
 import json
 import functools
 from collections import defaultdict
+from itertools import islice
 
-from sc2reader import log_utils
+from sc2reader.log_utils import loggable
 from sc2reader.utils import Length
-from sc2reader.events import SelectionEvent, HotkeyEvent, AddToHotkeyEvent, GetFromHotkeyEvent, SetToHotkeyEvent
-from sc2reader.plugins.utils import PlayerSelection, GameState, JSONDateEncoder, plugin
+from sc2reader.events import PlayerActionEvent, PlayerLeaveEvent, UnknownEvent, SelectionEvent, HotkeyEvent, AddToHotkeyEvent, GetFromHotkeyEvent, SetToHotkeyEvent
+from sc2reader.plugins.utils import PlayerSelection, StateHistory, EventPlugin, JSONDateEncoder, plugin
+from sc2reader.plugins.utils import action_columns, action_counts, rolling_average
 
 @plugin
 def toJSON(replay, **user_options):
     options = dict(cls=JSONDateEncoder)
     options.update(user_options)
-    return json.dumps(toDict(replay), **options)
+    return json.dumps(toDict()(replay), **options)
 
 @plugin
 def toDict(replay):
@@ -80,66 +82,139 @@ def toDict(replay):
         'observers': observers
     }
 
-@plugin
-def APMTracker(replay):
-    efilter = lambda event: getattr(event,'is_player_action',False)
-    for player in replay.players:
-        player.aps = defaultdict(int)
-        player.apm = defaultdict(int)
-        for event in filter(efilter, player.events):
-            player.aps[event.second] += 1
-            player.apm[event.second/60] += 1
-        if len(player.apm.keys()) > 0:
-            player.avg_apm = sum(player.apm.values())/float(len(player.apm.keys()))
-        else:
-            player.avg_apm = 0
+class APMTracker(EventPlugin):
+    # Every event that can be a player action, camera events never are
+    handles = (PlayerActionEvent, PlayerLeaveEvent, UnknownEvent)
+
+    def start(self, replay):
+        for player in replay.players:
+            player.aps = defaultdict(int)
+            player.apm = defaultdict(int)
+
+    def handle(self, event, replay):
+        if event.pid != 16 and event.is_player_action:
+            player, second = event.player, event.second
+            if not player.is_observer:
+                player.aps[second] += 1
+                player.apm[second/60] += 1
+
+    def finish(self, replay):
+        for player in replay.players:
+            if len(player.apm.keys()) > 0:
+                player.avg_apm = sum(player.apm.values())/float(len(player.apm.keys()))
+            else:
+                player.avg_apm = 0
+
+
+def batch_apm(replays, rolling=60, chunk_size=64):
+    """
+    Works out the actions of every player in the replays together with NumPy
+    instead of event by event. Sets the same fields as the :class:`APMTracker`
+    but ``player.aps`` and ``player.apm`` are arrays indexed by second and
+    minute, and adds ``player.rolling_apm``, the APM over the ``rolling``
+    seconds up to each second. The replays are counted ``chunk_size`` at a
+    time, which bounds the memory the counts take while they are worked out.
+    Requires NumPy.
+    """
+    import numpy
+
+    replays = iter(replays)
+    while True:
+        chunk = list(islice(replays, chunk_size))
+        if not chunk:
+            break
+
+        columns = [action_columns(replay) for replay in chunk]
+        lengths = [(max([replay.frames]+list(frames[-1:]))//16+1)*16 for replay, (frames, pids) in zip(chunk, columns)]
+        aps = action_counts(columns, window=16, lengths=lengths)
+        apm = action_counts(columns, window=60*16, lengths=lengths)
+        for replay, replay_aps, replay_apm in zip(chunk, aps, apm):
+            # Only keep the rows of the players, not of every pid
+            pids = [player.pid for player in replay.players]
+            replay_aps, replay_apm = replay_aps[pids], replay_apm[pids]
+            rolling_apm = rolling_average(replay_aps, rolling)
+            rolling_apm *= 60
+            for row, player in enumerate(replay.players):
+                player.aps = replay_aps[row]
+                player.apm = replay_apm[row]
+                player.rolling_apm = rolling_apm[row]
+                active = numpy.count_nonzero(player.apm)
+                player.avg_apm = player.apm.sum()/float(active) if active else 0
 
 
 @plugin
-def SelectionTracker(replay):
-    debug = replay.opt.debug
-    logger = log_utils.get_logger(SelectionTracker)
-    efilter = lambda e: isinstance(e, SelectionEvent) or isinstance(e, HotkeyEvent)
+def APMArrayTracker(replay, rolling=60):
+    batch_apm([replay], rolling)
 
-    for person in replay.people:
-        # TODO: A more robust person interface might be nice
-        person.selection_errors = 0
-        player_selection = GameState(PlayerSelection())
-        for event in filter(efilter, person.events):
-            if debug: logger.debug("Event bytes: "+event.bytes.encode("hex"))
 
-            error = False
-            selection = player_selection[event.frame]
+def apply_selection_event(selection, event):
+    """
+    Applies a selection or hotkey event to a :class:`PlayerSelection` in
+    place. Returns True if the deselection couldn't be done cleanly.
+    """
+    error = False
+    if isinstance(event, SelectionEvent):
+        error = not selection[event.bank].deselect(*event.deselect)
+        selection[event.bank].select(event.objects)
 
-            if isinstance(event, SelectionEvent):
-                error = not selection[event.bank].deselect(*event.deselect)
-                selection[event.bank].select(event.objects)
-                if debug: logger.info("[{0}] {1} selected {2} units: {3}".format(Length(seconds=event.second),person.name,len(selection[0x0A].objects),selection[0x0A]))
+    elif isinstance(event, GetFromHotkeyEvent):
+        # For some reason they leave the hotkey buffer unmodified so make a copy
+        selection[0x0A] = selection[event.hotkey].copy()
+        error = not selection[0x0A].deselect(*event.deselect)
 
-            elif isinstance(event, GetFromHotkeyEvent):
-                # For some reason they leave the hotkey buffer unmodified so make a copy
-                selection[0x0A] = selection[event.hotkey].copy()
-                error = not selection[0x0A].deselect(*event.deselect)
-                if debug: logger.info("[{0}] {1} retrieved hotkey {2}, {3} units: {4}".format(Length(seconds=event.second),person.name,event.hotkey,len(selection[0x0A].objects),selection[0x0A]))
+    elif isinstance(event, SetToHotkeyEvent):
+        # Make a copy to decouple the hotkey from primary selection
+        selection[event.hotkey] = selection[0x0A].copy()
 
-            elif isinstance(event, SetToHotkeyEvent):
-                # Make a copy to decouple the hotkey from primary selection
-                selection[event.hotkey] = selection[0x0A].copy()
-                if debug: logger.info("[{0}] {1} set hotkey {2} to current selection".format(Length(seconds=event.second),person.name,event.hotkey))
+    elif isinstance(event, AddToHotkeyEvent):
+        error = not selection[event.hotkey].deselect(*event.deselect)
+        selection[event.hotkey].select(selection[0x0A].objects)
+
+    return error
+
+
+@loggable
+class SelectionTracker(EventPlugin):
+    handles = (SelectionEvent, HotkeyEvent)
 
+    def start(self, replay):
+        self.debug = replay.opt.debug
+        snapshot_interval = self.options.get('snapshot_interval', 32)
+        for person in replay.people:
+            # TODO: A more robust person interface might be nice
+            person.selection_errors = 0
+            # The selection at any frame can be looked up as person.selection[frame]
+            person.selection = StateHistory(PlayerSelection(), apply_selection_event, snapshot_interval)
+
+    def handle(self, event, replay):
+        if event.pid == 16:
+            return
+
+        debug, logger, person = self.debug, self.logger, event.player
+        if debug: logger.debug("Event bytes: "+event.bytes.encode("hex"))
+
+        error = person.selection.record(event.frame, event)
+        selection = person.selection.state
+
+        if debug:
+            if isinstance(event, SelectionEvent):
+                logger.info("[{0}] {1} selected {2} units: {3}".format(Length(seconds=event.second),person.name,len(selection[0x0A].objects),selection[0x0A]))
+            elif isinstance(event, GetFromHotkeyEvent):
+                logger.info("[{0}] {1} retrieved hotkey {2}, {3} units: {4}".format(Length(seconds=event.second),person.name,event.hotkey,len(selection[0x0A].objects),selection[0x0A]))
+            elif isinstance(event, SetToHotkeyEvent):
+                logger.info("[{0}] {1} set hotkey {2} to current selection".format(Length(seconds=event.second),person.name,event.hotkey))
             elif isinstance(event, AddToHotkeyEvent):
-                error = not selection[event.hotkey].deselect(*event.deselect)
-                selection[event.hotkey].select(selection[0x0A].objects)
-                if debug: logger.info("[{0}] {1} added current selection to hotkey {2}".format(Length(seconds=event.second),person.name,event.hotkey))
-
-            # TODO: The event level interface here should be improved
-            #       Possibly use 'added' and 'removed' unit lists as well
-            event.selected = selection[0x0A].objects
-            if error:
-                person.selection_errors += 1
-                if debug:
-                    logger.warn("Error detected in deselection mode {}.".format(event.deselect[0]))
-
-        person.selection = player_selection
-        # Not a real lock, so don't change it!
-        person.selection.locked = True
+                logger.info("[{0}] {1} added current selection to hotkey {2}".format(Length(seconds=event.second),person.name,event.hotkey))
+
+        # TODO: The event level interface here should be improved
+        #       Possibly use 'added' and 'removed' unit lists as well
+        event.selected = selection[0x0A].objects
+        if error:
+            person.selection_errors += 1
+            if debug:
+                logger.warn("Error detected in deselection mode {}.".format(event.deselect[0]))
+
+    def finish(self, replay):
+        for person in replay.people:
+            # Nothing changes the selections after this
+            person.selection.locked = True
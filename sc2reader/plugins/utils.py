@@ -6,8 +6,13 @@ from datetime import datetime
 from sc2reader.log_utils import loggable
 
 from functools import wraps
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right, insort
 from collections import defaultdict
+from itertools import chain, compress, groupby, imap, repeat
+from operator import attrgetter
+
+from sc2reader.events import Event, GameEvent
+from sc2reader.objects import SelectionMask
 
 def plugin(func):
     @wraps(func)
@@ -20,6 +25,129 @@ def plugin(func):
         return call
     return wrapper
 
+class EventPlugin(object):
+    """
+    A replay plugin that works event by event. Instead of walking the events
+    itself it lists the event classes it :attr:`handles` and is handed each
+    of those events in frame order. The factory runs plugins like this that
+    are registered one after another together in a single pass over the
+    events, see :func:`run_event_plugins`.
+
+    Called on a replay it does a pass of its own, so it can be used just like
+    any other plugin::
+
+        APMTracker()(replay)
+    """
+    #: The event classes to be handed to :meth:`handle`
+    handles = ()
+
+    def __init__(self, **options):
+        self.options = options
+
+    def start(self, replay):
+        """Called before the first event of the replay is handled."""
+        pass
+
+    def handle(self, event, replay):
+        """Called with each event that is an instance of one of :attr:`handles`."""
+        pass
+
+    def finish(self, replay):
+        """Called once all the events of the replay have been handled."""
+        pass
+
+    def __call__(self, replay):
+        run_event_plugins(replay, [self])
+
+
+def run_event_plugins(replay, plugins):
+    """
+    Runs the given :class:`EventPlugin` instances over the replay together,
+    handing each event to every plugin that handles its type in a single
+    ordered pass over the events. Lazy replays, and those loaded up to the
+    players, decode the game events as they go.
+    """
+    types = tuple(set(chain.from_iterable(plugin.handles for plugin in plugins)))
+    for plugin in plugins:
+        plugin.start(replay)
+
+    # Loaded replays are walked directly and the unwanted events dropped by
+    # the handler lookup, which matches each event type to the plugins once.
+    # Replays loaded without their players have no events for the plugins;
+    # streaming them would load the players as a side effect.
+    if replay._level >= 3 or (replay._level < 2 and not replay.lazy):
+        events = replay.events
+    else:
+        events = replay.iter_events(types=types)
+
+    handlers = dict()
+    for event in events:
+        event_type = type(event)
+        if event_type not in handlers:
+            handlers[event_type] = [plugin.handle for plugin in plugins if isinstance(event, plugin.handles)]
+        for handle in handlers[event_type]:
+            handle(event, replay)
+
+    for plugin in plugins:
+        plugin.finish(replay)
+
+
+def action_columns(replay):
+    """
+    Returns the frames and pids of the player actions in the replay's game
+    events as two NumPy arrays. The events are read straight from their slots
+    so no Python code runs for each event. Requires NumPy.
+    """
+    import numpy
+
+    events = replay.game_events()
+    types = numpy.fromiter(imap(GameEvent.type.__get__, events), 'i4', len(events))
+    actions = list(compress(events, (types >> 4) == 1))
+    frames = numpy.fromiter(imap(Event.frame.__get__, actions), 'i4', len(actions))
+    pids = numpy.fromiter(imap(Event.pid.__get__, actions), 'i4', len(actions))
+    return frames, pids
+
+
+def action_counts(columns, window=16, lengths=None, pids=17):
+    """
+    Counts actions per pid in consecutive windows of ``window`` frames with
+    a single ``numpy.bincount``. ``columns`` is a list of (frames, pids) array
+    pairs, one for each replay, as returned by :func:`action_columns`. Returns
+    a list with an array of shape (pids, windows) for each replay, with
+    enough windows to cover the number of frames given for it in ``lengths``
+    or else its last action. Replays are not padded to the longest one.
+    Requires NumPy.
+    """
+    import numpy
+
+    if lengths is None:
+        lengths = [frames.max()+1 if len(frames) else 0 for frames, players in columns]
+    windows = [(length+window-1)//window for length in lengths]
+    offsets = numpy.cumsum([0]+[pids*count for count in windows])
+
+    index = list()
+    for replay, (frames, players) in enumerate(columns):
+        keep = (players < pids) & (frames < lengths[replay])
+        index.append(offsets[replay] + players[keep].astype('i8')*windows[replay] + frames[keep]//window)
+    index = numpy.concatenate(index) if index else numpy.zeros(0, 'i8')
+
+    counts = numpy.bincount(index, minlength=offsets[-1])
+    return [counts[offsets[replay]:offsets[replay+1]].reshape(pids, windows[replay]) for replay in range(len(columns))]
+
+
+def rolling_average(counts, width):
+    """
+    The mean of each window and the ``width``-1 windows before it along the
+    last axis of ``counts``. The first windows average over those available.
+    Requires NumPy.
+    """
+    import numpy
+
+    totals = numpy.cumsum(counts, axis=-1, dtype='f8')
+    totals[..., width:] -= totals[..., :-width].copy()
+    return totals / numpy.minimum(numpy.arange(1, counts.shape[-1]+1), width)
+
+
 class JSONDateEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
@@ -39,41 +167,163 @@ class GameState(dict):
             return super(GameState, self).__getitem__(frame)
 
         # Get the previous frame from our sorted frame list
-        # bisect_left returns the left most key where an item is
-        # less than or equal to the value in that key. If it is
-        # less than we need to subtract 1
-        key = bisect_left(self._frames, frame)
-        if key == len(self._frames) or self._frames[key] > frame:
-            prev_frame = self._frames[key - 1]
-        else:
-            prev_frame = self._frames[key]
+        # bisect_right returns the index after any frame equal to
+        # the one requested so we always want the one before it
+        prev_frame = self._frames[max(bisect_right(self._frames, frame)-1, 0)]
 
-        # If we've locked the game state we don't need deep copies anymore
+        # If we've locked the game state nothing will change anymore so
+        # share the previous state and don't remember every frame asked for
         if self.locked:
-            state = self[prev_frame]
-        else:
-            # Copy the previous state and use it as our basis here
-            state = self[prev_frame].copy()
+            return super(GameState, self).__getitem__(prev_frame)
 
+        # Copy the previous state and use it as our basis here
+        state = super(GameState, self).__getitem__(prev_frame).copy()
         self[frame] = state
         return state
 
     def __setitem__(self, frame, value):
         if frame not in self._frameset:
-            self._frames.insert(bisect_left(self._frames, frame), frame)
+            # Frames almost always arrive in order so avoid shifting the list
+            if not self._frames or frame > self._frames[-1]:
+                self._frames.append(frame)
+            else:
+                insort(self._frames, frame)
             self._frameset.add(frame)
 
         super(GameState, self).__setitem__(frame, value)
 
+    def __reduce__(self):
+        # Rebuild through __init__ so the frame index exists before the
+        # frames are set again.
+        return (GameState, (self[0],), self.__dict__, None, self.iteritems())
+
+
+class StateHistory(object):
+    """
+    Keeps the state of something over the course of a game as a list of the
+    changes made to it. Every ``snapshot_interval`` changes a copy of the
+    state is kept so the state at any frame can be rebuilt by applying at
+    most that many changes to the closest snapshot before it.
+
+    :param initial_state: The state at frame 0, it needs a ``copy`` method.
+    :param apply: A function of (state, change) that applies a change to a
+        state in place. It is called again every time a past state is rebuilt
+        so it shouldn't have any other side effects; whatever it returns is
+        passed back from :meth:`record`.
+    :param snapshot_interval: The number of changes between snapshots. Lower
+        values make lookups faster at the cost of memory.
+
+    Changes must be recorded in frame order. Recording is O(1) and looking up
+    a frame is O(log n) plus at most ``snapshot_interval`` changes. ::
+
+        history[frame]  # The state at the given frame, a fresh copy
+        history.state   # The current state, changed by every record
+
+    The history can also be used like the :class:`GameState` dictionaries
+    it replaces. Its keys are frame 0 and every frame the state changed at,
+    ``items`` pairs them up with the state at each, and once ``locked`` no
+    more changes can be recorded.
+    """
+    def __init__(self, initial_state, apply, snapshot_interval=32):
+        self.apply = apply
+        self.snapshot_interval = snapshot_interval
+        self.state = initial_state
+        self.frames = list()
+        self.changes = list()
+        self.locked = False
+        self._length = 1
+        self._snapshots = [initial_state.copy()]
+        self._snapshot_counts = [0]
+        self._cursor = None
+
+    def record(self, frame, change):
+        """Applies the change to the current state as of the given frame."""
+        if self.locked:
+            raise ValueError("Change at frame {0} recorded after the history was locked".format(frame))
+        if self.frames and frame < self.frames[-1]:
+            raise ValueError("Change at frame {0} recorded after frame {1}".format(frame, self.frames[-1]))
+
+        result = self.apply(self.state, change)
+        if frame != (self.frames[-1] if self.frames else 0):
+            self._length += 1
+        self.frames.append(frame)
+        self.changes.append(change)
+        if len(self.changes) - self._snapshot_counts[-1] >= self.snapshot_interval:
+            self._snapshots.append(self.state.copy())
+            self._snapshot_counts.append(len(self.changes))
+        return result
+
+    def state_at(self, frame):
+        """Rebuilds the state after every change made up to the given frame."""
+        count = bisect_right(self.frames, frame)
+        index = bisect_right(self._snapshot_counts, count)-1
+        start = self._snapshot_counts[index]
+
+        # Frames tend to be looked up in order, so carry on from the last
+        # state rebuilt when it is closer than the snapshot
+        if self._cursor is not None and start <= self._cursor[0] <= count:
+            start, state = self._cursor
+        else:
+            state = self._snapshots[index].copy()
+
+        for change in self.changes[start:count]:
+            self.apply(state, change)
+        self._cursor = (count, state)
+        return state.copy()
+
+    __getitem__ = state_at
+
+    def iterkeys(self):
+        if not self.frames or self.frames[0] != 0:
+            yield 0
+        for frame, changes in groupby(self.frames):
+            yield frame
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        return imap(self.state_at, self.iterkeys())
+
+    def iteritems(self):
+        for frame in self.iterkeys():
+            yield frame, self.state_at(frame)
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __contains__(self, frame):
+        if frame == 0:
+            return True
+        index = bisect_left(self.frames, frame)
+        return index < len(self.frames) and self.frames[index] == frame
+
+    def __len__(self):
+        return self._length
+
 
 @loggable
 class UnitSelection(object):
+    """
+    The units in a selection, sorted by id. The ``objects`` list is never
+    changed in place, selecting and deselecting replace it, so copies of
+    a selection can share it.
+    """
     def __init__(self, objects=None):
         self.objects = objects or list()
 
     def select(self, new_objects):
-        new_set = set(self.objects+list(new_objects))
-        self.objects = sorted(new_set,key=lambda obj: obj.id)
+        current = set(self.objects)
+        added = [obj for obj in set(new_objects) if obj not in current]
+        if added:
+            # Sorting two sorted runs is a single merge pass
+            added.sort(key=attrgetter('id'))
+            self.objects = sorted(self.objects+added, key=attrgetter('id'))
 
     def deselect(self, mode, data):
         """Returns false if there was a data error when deselecting"""
@@ -82,18 +332,19 @@ class UnitSelection(object):
         if mode == 0x01:
             """ Deselect objects according to deselect mask """
             mask = data
-            if len(mask) < size:
-                # pad to the right
-                mask = mask+[False,]*(len(self.objects)-len(mask))
+            if not isinstance(mask, SelectionMask):
+                mask = SelectionMask.from_list(mask)
 
-            self.logger.debug("Deselection Mask: {0}".format(mask))
-            self.objects = [ obj for (slct, obj) in filter(lambda (slct, obj): not slct, zip(mask, self.objects)) ]
+            self.logger.debug("Deselection Mask: %r", mask)
+            if mask.bits:
+                self.objects = list(compress(self.objects, chain(mask.keep_flags(), repeat(1))))
             return len(mask) <= size
 
         elif mode == 0x02:
             """ Deselect objects according to indexes """
             clean_data = filter(lambda i: i < size, data)
-            self.objects = [ self.objects[i] for i in range(len(self.objects)) if i not in clean_data ]
+            deselected = set(clean_data)
+            self.objects = [obj for i, obj in enumerate(self.objects) if i not in deselected]
             return len(clean_data) == len(data)
 
         elif mode == 0x03:
@@ -109,15 +360,93 @@ class UnitSelection(object):
         return ', '.join(str(obj) for obj in self.objects)
 
     def copy(self):
-        return UnitSelection(self.objects[:])
+        return UnitSelection(self.objects)
 
 
 class PlayerSelection(defaultdict):
+    """
+    The selection in each of a player's selection banks. Copies share the
+    selections of each bank with the original until the bank is first
+    accessed, so only the banks that change are copied. Every way of getting
+    at a selection, item access, ``get``, ``values``, ``items`` and the like,
+    copies the banks it hands out first if they are still shared.
+    """
     def __init__(self):
         super(PlayerSelection, self).__init__(UnitSelection)
+        self._shared = set()
+
+    def __getitem__(self, bank):
+        selection = super(PlayerSelection, self).__getitem__(bank)
+        if bank in self._shared:
+            self._shared.discard(bank)
+            selection = selection.copy()
+            dict.__setitem__(self, bank, selection)
+        return selection
+
+    def __setitem__(self, bank, selection):
+        self._shared.discard(bank)
+        super(PlayerSelection, self).__setitem__(bank, selection)
+
+    def _unshare(self):
+        # Take a copy of every bank still shared before handing them all out
+        for bank in self._shared:
+            if dict.__contains__(self, bank):
+                dict.__setitem__(self, bank, dict.__getitem__(self, bank).copy())
+        self._shared.clear()
+
+    def get(self, bank, default=None):
+        return self[bank] if bank in self else default
+
+    def setdefault(self, bank, default=None):
+        if bank not in self:
+            self[bank] = default
+        return self[bank]
+
+    def pop(self, bank, *default):
+        if bank in self._shared:
+            self._shared.discard(bank)
+            return dict.pop(self, bank).copy()
+        return dict.pop(self, bank, *default)
+
+    def popitem(self):
+        self._unshare()
+        return dict.popitem(self)
+
+    def values(self):
+        self._unshare()
+        return dict.values(self)
+
+    def items(self):
+        self._unshare()
+        return dict.items(self)
+
+    def itervalues(self):
+        self._unshare()
+        return dict.itervalues(self)
+
+    def iteritems(self):
+        self._unshare()
+        return dict.iteritems(self)
+
+    def viewvalues(self):
+        self._unshare()
+        return dict.viewvalues(self)
+
+    def viewitems(self):
+        self._unshare()
+        return dict.viewitems(self)
+
+    def __reduce__(self):
+        # defaultdict pickles with the default factory as an __init__ argument.
+        # Selections shared with other copies stay shared when pickled along
+        # with them so the banks that are shared have to be kept as well.
+        return (PlayerSelection, (), dict(_shared=self._shared), None, dict.iteritems(self))
 
     def copy(self):
         new = PlayerSelection()
-        for bank, selection in self.iteritems():
-            new[bank] = UnitSelection(selection.objects[:])
+        dict.update(new, self)
+
+        # Both sides copy a bank before they use it again
+        new._shared = set(self.keys())
+        self._shared.update(new._shared)
         return new
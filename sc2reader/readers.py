@@ -1,12 +1,13 @@
 from __future__ import absolute_import
 
+import binascii
 from collections import defaultdict
 from itertools import chain
 
 from sc2reader.exceptions import ParseError, ReadError
 from sc2reader.objects import *
 from sc2reader.events import *
-from sc2reader.utils import AttributeDict, BIG_ENDIAN, LITTLE_ENDIAN
+from sc2reader.utils import AttributeDict, StructRecord, StructList, BIG_ENDIAN, LITTLE_ENDIAN
 
 class Reader(object):
     def __init__(self, **options):
@@ -93,7 +94,13 @@ class AttributesEventsReader_17326(AttributesEventsReader_Base):
 
 
 class DetailsReader_Base(Reader):
-    Details = namedtuple('Details',['players','map','unknown1','unknown2','os','file_time','utc_adjustment','unknown4','unknown5','unknown6','unknown7','unknown8','unknown9','unknown10'])
+    Details = Details
+
+    def __init__(self, **options):
+        super(DetailsReader_Base, self).__init__(**options)
+        player = StructRecord(PlayerData, {1: StructRecord(BnetData, keys=[0, 1, 2, 4]), 3: StructRecord(ColorData)})
+        self.schema = StructRecord(self.Details, {0: StructList(player)})
+
     def __call__(self, data, replay):
         # The entire details file is just a serialized data structure
         #
@@ -134,35 +141,16 @@ class DetailsReader_Base(Reader):
         #   Unknown9
         #   Unknown10
         #
-        details = data.read_data_struct()
-
-        # To make things a little more meaningful in the rest of the code we
-        # step through all the gathered data and map it into namedtuples so that
-        # we don't need to use data[0][0][1][3] to get the battle.net player id.
-        # The field names are documented in the namedtuples section of the
-        # objects file. The ordered_values function extracts the values while
-        # maintaining key order required for proper mapping
-        ordered_values = lambda dict: [v for k,v in sorted(dict.iteritems())]
-
-        # Because named tuples are read only, we need to build them in pieces
-        # from the bottom up instead of in place from the top down.
-        players = list()
-        for pdata in details[0]:
-            pdata[1] = BnetData(*ordered_values(pdata[1]))
-            pdata[3] = ColorData(*ordered_values(pdata[3]))
-            player = PlayerData(*ordered_values(pdata))
-            players.append(player)
-        details[0] = players
-
-        # As a final touch, label all extracted information using the Details
-        # named tuple from objects.py
-        return self.Details(*ordered_values(details))
+        # The players and the details are read straight into the namedtuples
+        # documented in the namedtuples section of the objects file so that we
+        # don't need to use data[0][0][1][3] to get the battle.net player id.
+        return data.read_struct(self.schema)
 
 class DetailsReader_22612(DetailsReader_Base):
-    Details = namedtuple('Details',['players','map','unknown1','unknown2','os','file_time','utc_adjustment','unknown4','unknown5','unknown6','unknown7','unknown8','unknown9','unknown10', 'unknown11'])
+    Details = Details22612
 
 class DetailsReader_Beta(DetailsReader_Base):
-    Details = namedtuple('Details',['players','map','unknown1','unknown2','os','file_time','utc_adjustment','unknown4','unknown5','unknown6','unknown7','unknown8','unknown9','unknown10', 'unknown11', 'unknown12'])
+    Details = DetailsBeta
 
 class MessageEventsReader_Base(Reader):
     def __call__(self, data, replay):
@@ -207,7 +195,51 @@ class GameEventsReader_Base(object):
     ABILITY_TEAM_FLAG = False
     UNIT_INDEX_BITS = 8
 
+    # The event classes each event type can be read as
+    EVENT_CLASSES = {
+        0x05: (GameStartEvent,),
+        0x0B: (PlayerJoinEvent,),
+        0x0C: (PlayerJoinEvent,),
+        0x19: (PlayerLeaveEvent,),
+        0x1B: (AbilityEvent, LocationAbilityEvent, TargetAbilityEvent, SelfAbilityEvent),
+        0x1C: (SelectionEvent,),
+        0x1D: (SetToHotkeyEvent, AddToHotkeyEvent, GetFromHotkeyEvent),
+        0x1F: (SendResourceEvent,),
+        0x31: (CameraEvent,),
+        0x46: (RequestResourceEvent,),
+    }
+
     def __call__(self, data, replay):
+        game_events = list()
+        try:
+            for event in self.iter_events(data, replay, replay.opt.get('event_types')):
+                game_events.append(event)
+        except ReadError as e:
+            # Hand back everything we managed to read for debugging
+            e.game_events = game_events
+            raise
+        return game_events
+
+    def read_table(self, data, replay, event_types=None, pids=None):
+        """
+        Decodes the game events into an :class:`EventTable`, adding each one
+        to the columns as it is read rather than keeping the events around.
+        ``event_types`` is as for :meth:`iter_events` and ``pids`` limits the
+        table to the events of those players.
+        """
+        table = EventTable()
+        append = table.append
+        for event in self.iter_events(data, replay, event_types):
+            if pids is None or event.pid in pids:
+                append(event)
+        return table.finish()
+
+    def iter_events(self, data, replay, event_types=None):
+        """
+        Decodes the game events one at a time as they are requested. With
+        ``event_types`` only instances of those event classes are decoded;
+        the rest are skipped over in the buffer without being built.
+        """
         EVENT_DISPATCH = {
             0x05: self.game_start_event,
             0x0B: self.player_join_event,
@@ -221,7 +253,33 @@ class GameEventsReader_Base(object):
             0x46: self.player_request_resource_event,
         }
 
-        game_events = list()
+        SKIP_DISPATCH = dict()
+        if event_types is not None:
+            event_types = tuple(event_types)
+            SKIP_DISPATCH = {
+                0x05: self.skip_game_start_event,
+                0x0B: self.skip_player_join_event,
+                0x0C: self.skip_player_join_event,
+                0x19: self.skip_player_leave_event,
+                0x1B: self.skip_player_ability_event,
+                0x1C: self.skip_player_selection_event,
+                0x1D: self.skip_player_hotkey_event,
+                0x1F: self.skip_player_send_resource_event,
+                0x31: self.skip_camera_event,
+                0x46: self.skip_player_request_resource_event,
+            }
+
+            # Only decode the event types that can be read as a wanted class
+            for event_type, classes in self.EVENT_CLASSES.items():
+                if any(issubclass(cls, event_types) for cls in classes):
+                    del SKIP_DISPATCH[event_type]
+
+                    # Some classes of this type are wanted, check each event
+                    if not all(issubclass(cls, event_types) for cls in classes):
+                        EVENT_DISPATCH[event_type] = self._filtered(EVENT_DISPATCH[event_type], event_types)
+                else:
+                    del EVENT_DISPATCH[event_type]
+
         fstamp = 0
         debug = replay.opt.debug
         data_length = data.length
@@ -231,7 +289,6 @@ class GameEventsReader_Base(object):
         tell = data.tell
         read_bytes = data.read_bytes
         byte_align = data.byte_align
-        append = game_events.append
         event_start = 0
 
         try:
@@ -243,9 +300,14 @@ class GameEventsReader_Base(object):
                 # Check for a lookup
                 if event_type in EVENT_DISPATCH:
                     event = EVENT_DISPATCH[event_type](data, fstamp, pid, event_type)
-                    if debug:
-                        event.bytes = data.read_range(event_start, tell())
-                    append(event)
+                    if event is not None:
+                        if debug:
+                            event.bytes = data.read_range(event_start, tell())
+                        yield event
+
+                # Or an unwanted event we can skip over
+                elif event_type in SKIP_DISPATCH:
+                    SKIP_DISPATCH[event_type](data)
 
                 # Otherwise maybe it is an unknown chunk
                 elif event_type == 0x26:
@@ -270,20 +332,27 @@ class GameEventsReader_Base(object):
 
                 # Otherwise throw a read error
                 else:
-                    raise ReadError("Event type {} unknown at position {}.".format(hex(event_type),hex(event_start)), event_type, event_start, replay, game_events, data)
+                    raise ReadError("Event type {} unknown at position {}.".format(hex(event_type),hex(event_start)), event_type, event_start, replay, buffer=data)
 
                 byte_align()
                 event_start = tell()
 
-            return game_events
         except ParseError as e:
-            raise ReadError("Parse error '{}' unknown at position {}.".format(e.msg, hex(event_start)), event_type, event_start, replay, game_events, data)
+            raise ReadError("Parse error '{}' unknown at position {}.".format(e, hex(event_start)), event_type, event_start, replay, buffer=data)
         except EOFError as e:
-            raise ReadError("EOFError error '{}' unknown at position {}.".format(e.msg, hex(event_start)), event_type, event_start, replay, game_events, data)
+            raise ReadError("EOFError error '{}' unknown at position {}.".format(e, hex(event_start)), event_type, event_start, replay, buffer=data)
+
+    def _filtered(self, read_event, event_types):
+        def read_wanted_event(data, fstamp, pid, event_type):
+            event = read_event(data, fstamp, pid, event_type)
+            return event if isinstance(event, event_types) else None
+        return read_wanted_event
 
 
 
 class GameEventsReader_16117(GameEventsReader_Base):
+    UNIT_TYPE_BITS = 24
+
     def game_start_event(self, data, fstamp, pid, event_type):
         return GameStartEvent(fstamp, pid, event_type)
 
@@ -377,44 +446,76 @@ class GameEventsReader_16117(GameEventsReader_Base):
         return CameraEvent(fstamp, pid, event_type, x, y, distance, pitch, yaw, height)
 
 
+    # Skips read just enough to find the end of an event and build nothing
+    def skip_game_start_event(self, data):
+        pass
+
+    def skip_player_join_event(self, data):
+        data.skip_bits(self.PLAYER_JOIN_FLAGS)
+
+    def skip_player_leave_event(self, data):
+        pass
+
+    def _skip_selection_update(self, data):
+        data.skip_bits(data.read_bits(self.UNIT_INDEX_BITS))
+
+    def skip_player_ability_event(self, data):
+        data.skip_bits(60)
+        if data.read_byte() in (0x30,0x50):
+            data.skip_bits(8)
+        data.skip_bits(192)
+
+    def skip_player_selection_event(self, data):
+        data.skip_bits(4+self.UNIT_INDEX_BITS)
+        self._skip_selection_update(data)
+        data.skip_bits(data.read_bits(self.UNIT_INDEX_BITS)*(self.UNIT_TYPE_BITS+self.UNIT_INDEX_BITS))
+        data.skip_bits(data.read_bits(self.UNIT_INDEX_BITS)*32)
+
+    def skip_player_hotkey_event(self, data):
+        data.skip_bits(6)
+        self._skip_selection_update(data)
+
+    def skip_player_send_resource_event(self, data):
+        data.skip_bits(136)
+
+    def skip_player_request_resource_event(self, data):
+        data.skip_bits(3)
+        for i in range(4):
+            if data.read_bits(1):
+                data.skip_bits(31)
+
+    def skip_camera_event(self, data):
+        data.skip_bits(32)
+        for i in range(4):
+            if data.read_bits(1):
+                data.skip_bits(16)
+
 class GameEventsReader_16561(GameEventsReader_16117):
-    # Don't want to do this more than once
-    SINGLE_BIT_MASKS = [0x1 << i for i in range(2**9)]
 
     def _parse_selection_update(self, data):
         update_type = data.read_bits(2)
         if update_type == 1:
-            bits_left = mask_length = data.read_bits(self.UNIT_INDEX_BITS)
-
-            mask = list()
+            mask_length = data.read_bits(self.UNIT_INDEX_BITS)
             bits = data.read_bits(mask_length)
 
             # If the mask_length is not a multiple of 8 the bit_shift on
             # the data buffer will change and cause the last byte to be
             # an odd length. This correctly sizes the last byte.
             shift_diff = (mask_length+data.bit_shift)%8 - data.bit_shift
-            if shift_diff > 0:
-                mask = [bits & data.lo_masks[shift_diff]]
-                bits = bits >> shift_diff
-                bits_left -= shift_diff
-            elif shift_diff < 0:
-                mask = [bits & data.lo_masks[8+shift_diff]]
-                bits = bits >> (8+shift_diff)
-                bits_left -= 8+shift_diff
-
-            # Now shift the rest of the bits off into the mask in byte-sized
-            # chunks in reverse order. No idea why it'd be stored like this.
-            while bits_left!=0:
-                mask.insert(0,bits & 0xFF)
-                bits = bits >> 8
-                bits_left -= 8
-
-            # Compile the finished mask into a large integer for bit checks
-            bit_mask = sum([c<<(i*8) for i,c in enumerate(mask)])
-
-            # Change mask representation from an int to a bit array with
-            #   True => Deselect, False => Keep
-            mask = [(bit_mask & bit != 0) for bit in self.SINGLE_BIT_MASKS[:mask_length]]
+            partial_bits = shift_diff if shift_diff >= 0 else 8+shift_diff
+            partial = bits & data.lo_masks[partial_bits]
+
+            # The rest of the bits are stored in byte-sized chunks in reverse
+            # order. No idea why it'd be stored like this. Reading them as a
+            # big endian number gives the bytes of the mask in little endian
+            # order, with the odd sized byte at the end.
+            full_bytes = (mask_length-partial_bits)/8
+            mask_bytes = binascii.unhexlify('{0:0{1}x}'.format(bits >> partial_bits, full_bytes*2)) if full_bytes else ''
+            if partial_bits:
+                mask_bytes += chr(partial)
+
+            # True => Deselect, False => Keep
+            mask = SelectionMask.from_bytes(mask_bytes, mask_length)
 
         elif update_type == 2:
             index_count = data.read_bits(self.UNIT_INDEX_BITS)
@@ -476,6 +577,31 @@ class GameEventsReader_16561(GameEventsReader_16117):
             return AbilityEvent(fstamp, pid, event_type, ability, flags)
 
 
+    def _skip_selection_update(self, data):
+        update_type = data.read_bits(2)
+        if update_type == 1:
+            data.skip_bits(data.read_bits(self.UNIT_INDEX_BITS))
+        elif update_type in (2,3):
+            data.skip_bits(data.read_bits(self.UNIT_INDEX_BITS)*self.UNIT_INDEX_BITS)
+
+    def skip_player_ability_event(self, data):
+        data.skip_bits(self.PLAYER_ABILITY_FLAGS)
+        if data.read_bits(1):
+            data.skip_bits(22)
+
+        target_type = data.read_bits(2)
+        if target_type == 1:
+            data.skip_bits(73)
+        elif target_type == 2:
+            data.skip_bits(64)
+            if self.ABILITY_TEAM_FLAG and data.read_bits(1):
+                data.skip_bits(4)
+            if data.read_bits(1):
+                data.skip_bits(4)
+            data.skip_bits(73)
+        elif target_type == 3:
+            data.skip_bits(33)
+
 class GameEventsReader_18574(GameEventsReader_16561):
     PLAYER_ABILITY_FLAGS = 18
 
@@ -488,6 +614,8 @@ class GameEventsReader_22612(GameEventsReader_19595):
     UNIT_INDEX_BITS = 9 # Now can select up to 512 units
 
 class GameEventsReader_Beta(GameEventsReader_22612):
+    UNIT_TYPE_BITS = 32
+
     def camera_event(self, data, fstamp, pid, event_type):
         x = y= distance = pitch = yaw = height = 0
         if data.read_bits(1):
@@ -519,4 +647,11 @@ class GameEventsReader_Beta(GameEventsReader_22612):
 
         unit_types = chain(*[[utype]*count for (utype, count) in unit_types])
         units = list(zip(unit_ids, unit_types))
-        return SelectionEvent(fstamp, pid, event_type, bank, units, overlay)
\ No newline at end of file
+        return SelectionEvent(fstamp, pid, event_type, bank, units, overlay)
+
+    def skip_camera_event(self, data):
+        if data.read_bits(1):
+            data.skip_bits(32)
+        for i in range(3):
+            if data.read_bits(1):
+                data.skip_bits(16)
@@ -1,12 +1,15 @@
 from __future__ import absolute_import
 
+import os
 import zlib
+import heapq
 import pprint
 import hashlib
 from datetime import datetime
 import time
 from StringIO import StringIO
 from collections import defaultdict, deque, namedtuple
+from itertools import chain
 from xml.etree import ElementTree
 
 import urllib2
@@ -14,8 +17,11 @@ from mpyq import MPQArchive
 
 from sc2reader import utils
 from sc2reader import log_utils
+from sc2reader.exceptions import MPQError
 from sc2reader import readers, data
-from sc2reader.objects import Player, Observer, Team, PlayerSummary, Graph, DepotFile
+from sc2reader.objects import Player, Observer, Team, PlayerSummary, Graph, DepotFile, EventTable
+from sc2reader.objects import SummaryDetails, SummaryLobby, SummaryPlayer, SummaryProperty, SummaryMapping, SummaryItem, SummaryEntry
+from sc2reader.events import GameEvent
 from sc2reader.constants import REGIONS, LOCALIZED_RACES, GAME_SPEED_FACTOR, GAME_SPEED_CODES, RACE_CODES, PLAYER_TYPE_CODES, TEAM_COLOR_CODES, GAME_FORMAT_CODES, GAME_TYPE_CODES, DIFFICULTY_CODES
 
 
@@ -28,17 +34,107 @@ def real_type(teams):
         return "v".join(str(size) for size in sorted(team_sizes))
 
 
+class LazyAttribute(object):
+    """
+    Stands in for a :class:`Replay` attribute filled in by one of the load
+    levels. Lazy replays set these attributes aside until they are first
+    accessed, which loads the level they belong to. Other replays shadow
+    them with instance attributes so this is never reached.
+    """
+    missing = object()
+
+    def __init__(self, name, level, default):
+        self.name = name
+        self.level = level
+        self.default = default
+
+    def __get__(self, replay, owner):
+        if replay is not None:
+            replay._load_attribute(self.name, self.level)
+            if self.name in replay.__dict__:
+                return replay.__dict__[self.name]
+
+        # Levels don't always fill in attributes with a class level default,
+        # the winner of a replay without a result for example.
+        if self.default is not LazyAttribute.missing:
+            return self.default
+
+        raise AttributeError("'{0}' object has no attribute '{1}'".format(owner.__name__, self.name))
+
+
 class Resource(object):
+
+    #: The hex digest of the resource file made with the ``hash_algorithm``
+    #: option, sha256 by default. None if hashing was turned off.
+    filehash = None
+
+    #: The number of seconds spent hashing the resource file
+    hash_time = 0.0
+
     def __init__(self, file_object, filename=None, factory=None, **options):
+        # A sha256 hash the factory already made of this file; it doesn't
+        # apply to any resources loaded along with this one.
+        filehash = options.pop('filehash', None)
+
         self.factory = factory
         self.opt = utils.AttributeDict(options)
         self.logger = log_utils.get_logger(self.__class__)
         self.filename = filename or getattr(file_object,'name','Unavailable')
 
-        if hasattr(file_object, 'seek'):
-            file_object.seek(0)
-            self.filehash = hashlib.sha256(file_object.read()).hexdigest()
-            file_object.seek(0)
+        algorithm = options.get('hash_algorithm', 'sha256')
+        if filehash and algorithm == 'sha256':
+            self.filehash = filehash
+
+        elif algorithm and hasattr(file_object, 'seek'):
+            start = time.time()
+            self.filehash = utils.hash_file(file_object, algorithm)
+            self.hash_time = time.time()-start
+
+    def __getstate__(self):
+        # The factory, logger, and archive are tied to the loading process and
+        # can't be pickled. Leave them behind; see __setstate__.
+        state = self.__dict__.copy()
+        for name in ('factory', 'logger', 'archive', '_source'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.factory = None
+        self.archive = None
+        self._source = None
+        self.logger = log_utils.get_logger(self.__class__)
+
+
+#: The readers used for each data file by default, shared by every replay.
+#: See :meth:`Replay.register_reader` for replay specific readers.
+default_readers = utils.BuildRegistry()
+default_readers.register('replay.details', readers.DetailsReader_Base(), end=22612)
+default_readers.register('replay.details', readers.DetailsReader_22612(), start=22612, expansion='WoL')
+default_readers.register('replay.details', readers.DetailsReader_Beta(), expansion='HotS')
+default_readers.register('replay.initData', readers.InitDataReader_Base())
+default_readers.register('replay.message.events', readers.MessageEventsReader_Base())
+default_readers.register('replay.attributes.events', readers.AttributesEventsReader_Base(), end=17326)
+default_readers.register('replay.attributes.events', readers.AttributesEventsReader_17326(), start=17326)
+default_readers.register('replay.game.events', readers.GameEventsReader_16117(), start=16117, end=16561)
+default_readers.register('replay.game.events', readers.GameEventsReader_16561(), start=16561, end=18574)
+default_readers.register('replay.game.events', readers.GameEventsReader_18574(), start=18574, end=19595)
+default_readers.register('replay.game.events', readers.GameEventsReader_19595(), start=19595, end=22612)
+default_readers.register('replay.game.events', readers.GameEventsReader_22612(), start=22612, expansion='WoL')
+default_readers.register('replay.game.events', readers.GameEventsReader_Beta(), expansion='HotS')
+
+#: The datapack used for each build by default, by the build id it is loaded
+#: with :func:`data.load_build` on first use. Shared by every replay. See
+#: :meth:`Replay.register_datapack` for replay specific datapacks.
+#: The datapack build numbers don't map at ALL to the first effective build
+#: number so do the correct range mapping here.
+default_datapacks = utils.BuildRegistry()
+default_datapacks.register('datapack', 16939, start=16117, end=17326)
+default_datapacks.register('datapack', 17811, start=17326, end=18092)
+default_datapacks.register('datapack', 18701, start=18092, end=19458)
+default_datapacks.register('datapack', 21029, start=19458, end=22612)
+default_datapacks.register('datapack', 22612, start=22612)
+
 
 class Replay(Resource):
 
@@ -188,11 +284,63 @@ class Replay(Resource):
     #: SC2 Expansion. One of 'WoL', 'HotS'
     expasion = str()
 
-    def __init__(self, replay_file, filename=None, load_level=4, **options):
+    #: The archive data files read at each load level
+    data_files = {
+        1: ['replay.initData', 'replay.details', 'replay.attributes.events'],
+        2: ['replay.message.events'],
+        3: ['replay.game.events'],
+    }
+
+    #: The attributes filled in by each load level. Lazy replays load the
+    #: level an attribute belongs to on first access; see :meth:`__init__`.
+    lazy_attributes = {
+        1: ['gateway', 'map_hash', 'map_file', 'attributes', 'speed', 'category',
+            'type', 'game_type', 'is_ladder', 'is_private', 'map_name', 'os',
+            'windows_timestamp', 'unix_timestamp', 'end_time', 'time_zone',
+            'game_length', 'real_length', 'start_time', 'date', 'datapack', 'map'],
+        2: ['messages', 'pings', 'packets', 'players', 'player', 'teams', 'team',
+            'observers', 'people', 'humans', 'person', 'recorder', 'winner',
+            'real_type', 'people_hash'],
+        3: ['events', 'objects'],
+    }
+
+    #: A dictionary of data file name => serialized reader output shared with
+    #: a cache. Data files found here are loaded from the store instead of the
+    #: archive and newly read data files are added to it; see :class:`SC2Cache`.
+    raw_data_store = None
+
+    def __init__(self, replay_file, filename=None, load_level=4, raw_data_store=None, lazy=False, **options):
+        """
+        Reads the replay file up to the given ``load_level``:
+
+            * 0 - The replay header and MPQ archive
+            * 1 - Game details, map data, and lobby attributes
+            * 2 - Players, teams, and messages
+            * 3 - Game events
+
+        With ``lazy`` set only the header and archive are read up front. The
+        rest is read a level at a time the first time something from it is
+        accessed; e.g. ``replay.map_name`` reads the details, ``replay.players``
+        the messages, and ``replay.events`` the game events. ``load_level`` is
+        ignored in this mode.
+
+        The ``event_types`` option limits the game events to instances of the
+        given event classes. Other game events are skipped over as they are
+        read without ever being built, which is considerably faster when only
+        a few kinds of events are needed::
+
+            replay = sc2reader.load_replay(path, event_types=[AbilityEvent])
+        """
         super(Replay, self).__init__(replay_file, filename, **options)
         self.datapack = None
         self.raw_data = dict()
-
+        self.raw_data_store = raw_data_store
+        self.archive = None
+        self._source = replay_file
+        self.lazy = lazy
+        self._level = 0
+        self._loading = False
+        self._lazy_state = dict()
         #default values, filled in during file read
         self.player_names = list()
         self.other_people = set()
@@ -221,44 +369,84 @@ class Replay(Resource):
         self.packets = list()
         self.objects = {}
 
-        # Bootstrap the readers.
+        # Replay specific readers and datapacks. The defaults are resolved
+        # for the build from the shared registries once it is known.
         self.registered_readers = defaultdict(list)
-        self.register_default_readers()
+        self.registered_datapacks = list()
+        self.default_readers = dict()
+        self.default_datapack_id = None
 
-        # Bootstrap the datapacks.
-        self.registered_datapacks= list()
-        self.register_default_datapacks()
-
-        # Unpack the MPQ and read header data if requested
-        if load_level >= 0:
+        # Unpack the MPQ and read header data if requested. Skip the archive
+        # if everything we need is in the raw data store already.
+        if load_level >= 0 or lazy:
             # Set ('versions', 'frames', 'build', 'release_string', 'length')
-            self.__dict__.update(utils.read_header(replay_file))
+            self.__dict__.update(self._read_stored('replay.header', lambda: utils.read_header(replay_file)))
             self.expansion = ['','WoL','HotS'][self.versions[1]]
-            self.archive = utils.open_archive(replay_file)
-
-        # Load basic details if requested
-        if load_level >= 1:
-            for data_file in ['replay.initData','replay.details','replay.attributes.events']:
-                self._read_data(data_file, self._get_reader(data_file))
-            self.load_details()
-            self.datapack = self._get_datapack()
-
-            # Can only be effective if map data has been loaded
-            if options.get('load_map', False):
-                self.load_map()
-
-        # Load players if requested
-        if load_level >= 2:
-            for data_file in ['replay.message.events']:
-                self._read_data(data_file, self._get_reader(data_file))
-            self.load_messages()
-            self.load_players()
-
-        # Load events if requested
-        if load_level >= 3:
-            for data_file in ['replay.game.events']:
-                self._read_data(data_file, self._get_reader(data_file))
-            self.load_events()
+            self.register_default_readers()
+            self.register_default_datapacks()
+            needed = [name for level, names in self.data_files.items() if level <= load_level or lazy for name in names]
+            if not all(name in (raw_data_store or ()) for name in needed):
+                self.archive = utils.open_archive(replay_file)
+
+        if lazy:
+            # Set aside the attributes of the remaining levels, see LazyAttribute
+            for names in self.lazy_attributes.values():
+                for name in names:
+                    if name in self.__dict__:
+                        self._lazy_state[name] = self.__dict__.pop(name)
+        else:
+            self._load_level(load_level)
+
+    def _load_level(self, level):
+        # Load each level up to the given one that hasn't been loaded yet
+        while self._level < level:
+            self._level += 1
+            self._loading = True
+            try:
+                for name in self.lazy_attributes.get(self._level, []):
+                    if name in self._lazy_state:
+                        self.__dict__[name] = self._lazy_state.pop(name)
+
+                for data_file in self.data_files.get(self._level, []):
+                    self._read_data(data_file, self._get_reader(data_file))
+
+                if self._level == 1:
+                    self._run_stage('load_details', self.load_details)
+                    self.datapack = self._get_datapack()
+
+                    # Can only be effective if map data has been loaded
+                    if self.opt.get('load_map', False):
+                        self._run_stage('load_map', self.load_map)
+
+                elif self._level == 2:
+                    self._run_stage('load_messages', self.load_messages)
+                    self._run_stage('load_players', self.load_players)
+
+                elif self._level == 3:
+                    self._run_stage('load_events', self.load_events)
+
+            finally:
+                self._loading = False
+
+            if self.lazy:
+                # Set aside anything this level touched from later levels
+                for later, names in self.lazy_attributes.items():
+                    for name in names:
+                        if later > self._level and name in self.__dict__:
+                            self._lazy_state[name] = self.__dict__.pop(name)
+
+    def _run_stage(self, stage, func, *args):
+        # Every step of loading a level goes through here so that subclasses
+        # can time them, see sc2reader.bench.
+        return func(*args)
+
+    def _load_attribute(self, name, level):
+        if self._loading:
+            # A level being loaded is touching an attribute of a later level
+            if name in self._lazy_state:
+                self.__dict__[name] = self._lazy_state.pop(name)
+        elif self.lazy:
+            self._load_level(level)
 
     def load_details(self):
         if 'replay.initData' in self.raw_data:
@@ -479,12 +667,79 @@ class Replay(Resource):
             if event.pid != 16:
                 self.person[event.pid].events.append(event)
 
+    def iter_events(self, types=None, pids=None):
+        """
+        Yields the game and message events of the replay in frame order,
+        optionally limited to instances of the given event ``types`` that
+        belong to the given ``pids``. Unless the game events have been loaded
+        already they are decoded as they are requested and are never gathered
+        into a list; nor are they added to ``person.events``. Game events
+        that aren't one of the wanted ``types`` are skipped without being
+        built.
+
+        ::
+
+            for event in replay.iter_events(types=[AbilityEvent], pids=[1]):
+                print event.frame, event.ability_name
+        """
+        types = tuple(types) if types is not None else None
+        pids = set(pids) if pids is not None else None
+
+        if self._level >= 3:
+            events, load_context = self.events, False
+        else:
+            self._load_level(2)
+
+            # Lazy replays keep the game event attributes aside until level 3
+            # is loaded; use them without triggering that load.
+            if 'objects' in self._lazy_state:
+                self.objects = self._lazy_state.pop('objects')
+            messages = self._lazy_state.get('events', self.__dict__.get('events'))
+
+            # Merge the message events into the game events in the same order
+            # the stable sort in load_events would put them.
+            messages = ((event.frame, 0, index, event) for index, event in enumerate(messages))
+            game_events = ((event.frame, 1, index, event) for index, event in enumerate(self._iter_game_events(types)))
+            events, load_context = (item[3] for item in heapq.merge(messages, game_events)), True
+
+        for event in events:
+            if types is not None and not isinstance(event, types):
+                continue
+            if pids is not None and event.pid not in pids:
+                continue
+            if load_context:
+                event.load_context(self)
+            yield event
+
+    def __getstate__(self):
+        # Registered readers and datapacks are keyed with filter functions
+        # which can't be pickled. The default readers are registered again.
+        # Lazy replays can't load anything without their archive
+        if self.lazy:
+            self._load_level(len(self.data_files))
+
+        state = super(Replay, self).__getstate__()
+        del state['registered_readers']
+        del state['registered_datapacks']
+        del state['default_readers']
+        state.pop('raw_data_store', None)
+        return state
+
+    def __setstate__(self, state):
+        super(Replay, self).__setstate__(state)
+        self.registered_readers = defaultdict(list)
+        self.registered_datapacks = list()
+        self.default_readers = dict()
+        if hasattr(self, 'build'):
+            self.register_default_readers()
+
     def register_reader(self, data_file, reader, filterfunc=lambda r: True):
         """
         Allows you to specify your own reader for use when reading the data
-        files packed into the .SC2Replay archives. Datapacks are checked for
+        files packed into the .SC2Replay archives. Readers are checked for
         use with the supplied filterfunc in reverse registration order to give
-        user registered datapacks preference over factory default datapacks.
+        user registered readers preference over factory registered readers,
+        which in turn take preference over the :data:`default_readers`.
 
         Don't use this unless you know what you are doing.
 
@@ -505,7 +760,7 @@ class Replay(Resource):
         Allows you to specify your own datapacks for use when loading replays.
         Datapacks are checked for use with the supplied filterfunc in reverse
         registration order to give user registered datapacks preference over
-        factory default datapacks.
+        factory registered datapacks and the :data:`default_datapacks`.
 
         This is how you would add mappings for your favorite custom map.
 
@@ -521,55 +776,152 @@ class Replay(Resource):
 
     # Override points
     def register_default_readers(self):
-        """Registers factory default readers."""
-        self.register_reader('replay.details', readers.DetailsReader_Base(), lambda r: r.build < 22612)
-        self.register_reader('replay.details', readers.DetailsReader_22612(), lambda r: r.build >= 22612 and r.expansion=='WoL')
-        self.register_reader('replay.details', readers.DetailsReader_Beta(), lambda r: r.expansion=='HotS')
-        self.register_reader('replay.initData', readers.InitDataReader_Base())
-        self.register_reader('replay.message.events', readers.MessageEventsReader_Base())
-        self.register_reader('replay.attributes.events', readers.AttributesEventsReader_Base(), lambda r: r.build <  17326)
-        self.register_reader('replay.attributes.events', readers.AttributesEventsReader_17326(), lambda r: r.build >= 17326)
-        self.register_reader('replay.game.events', readers.GameEventsReader_16117(), lambda r: 16117 <= r.build < 16561)
-        self.register_reader('replay.game.events', readers.GameEventsReader_16561(), lambda r: 16561 <= r.build < 18574)
-        self.register_reader('replay.game.events', readers.GameEventsReader_18574(), lambda r: 18574 <= r.build < 19595)
-        self.register_reader('replay.game.events', readers.GameEventsReader_19595(), lambda r: 19595 <= r.build < 22612)
-        self.register_reader('replay.game.events', readers.GameEventsReader_22612(), lambda r: 22612 <= r.build and r.expansion=='WoL')
-        self.register_reader('replay.game.events', readers.GameEventsReader_Beta(), lambda r: r.expansion=='HotS')
+        """
+        Registers the readers used when none registered with the replay or
+        its factory apply; by default those the shared :data:`default_readers`
+        resolve for the build of the replay.
+        """
+        for data_file in chain.from_iterable(self.data_files.values()):
+            reader = default_readers.get(data_file, self.build, self.expansion)
+            if reader is not None:
+                self.default_readers[data_file] = reader
 
     def register_default_datapacks(self):
-        """Registers factory default datapacks."""
-        self.register_datapack(data.build16117, lambda r: 16117 <= r.build < 17326)
-        self.register_datapack(data.build17326, lambda r: 17326 <= r.build < 18092)
-        self.register_datapack(data.build18092, lambda r: 18092 <= r.build < 19458)
-        self.register_datapack(data.build19458, lambda r: 19458 <= r.build < 22612)
-        self.register_datapack(data.build22612, lambda r: 22612 <= r.build)
+        """
+        Registers the datapack used when none registered with the replay or
+        its factory apply; by default the build id the shared
+        :data:`default_datapacks` resolve for the build of the replay, which
+        is loaded on first use.
+        """
+        self.default_datapack_id = default_datapacks.get('datapack', self.build, self.expansion)
 
 
     # Internal Methods
     def _get_reader(self, data_file):
-        for callback, reader in self.registered_readers[data_file]:
+        factory_readers = getattr(self.factory, 'registered_readers', {})
+        for callback, reader in chain(self.registered_readers[data_file], factory_readers.get(data_file, [])):
             if callback(self):
                 return reader
-        else:
+
+        reader = self.default_readers.get(data_file)
+        if reader is None:
             raise ValueError("Valid {} reader could not found for build {}".format(data_file, self.build))
+        return reader
 
     def _get_datapack(self):
-        for callback, datapack in self.registered_datapacks:
+        factory_datapacks = getattr(self.factory, 'registered_datapacks', [])
+        for callback, datapack in chain(self.registered_datapacks, factory_datapacks):
             if callback(self):
                 return datapack
-        else:
-            return None
+
+        build_id = self.default_datapack_id
+        return data.load_build(build_id) if build_id is not None else None
 
     def _read_data(self, data_file, reader):
-        data = utils.extract_data_file(data_file,self.archive)
-        if data:
-            data_buffer = utils.ReplayBuffer(data)
-            self.raw_data[data_file] = reader(data_buffer, self)
+        raw_data = self._read_stored(data_file, lambda: self._read_file(data_file, reader))
+        if raw_data is not None:
+            self.raw_data[data_file] = raw_data
         elif self.opt.debug and data_file != 'replay.message.events':
             raise ValueError("{0} not found in archive".format(data_file))
         else:
             self.logger.error("{0} not found in archive".format(data_file))
 
+    def _read_file(self, data_file, reader):
+        data = self._run_stage('extract:'+data_file, utils.extract_data_file, data_file, self._get_archive())
+        if data:
+            return self._run_stage('read:'+data_file, reader, utils.ReplayBuffer(data), self)
+
+    def game_events(self, types=None):
+        """
+        Returns a list of the game events of the replay, optionally limited to
+        instances of the given event ``types``. Unlike :meth:`iter_events` the
+        message events are left out and no event context is loaded; game
+        events that haven't been loaded are decoded for the call and not kept.
+        """
+        types = tuple(types) if types is not None else None
+        if self._level >= 3:
+            events = self.raw_data.get('replay.game.events', [])
+            return [event for event in events if isinstance(event, types)] if types is not None else list(events)
+        return list(self._iter_game_events(types))
+
+    def event_table(self, types=None, pids=None):
+        """
+        Returns the game events of the replay, optionally limited as with
+        :meth:`iter_events`, as an :class:`EventTable` of NumPy arrays for
+        vectorized analysis::
+
+            table = replay.event_table()
+            abilities = numpy.bincount(table.ability_code[table.ability_code >= 0])
+
+        When the events haven't been loaded the game events reader fills the
+        table in as it decodes them, see :meth:`GameEventsReader_Base.read_table`,
+        and no event context is loaded for them. Loaded events are converted.
+        Requires NumPy.
+        """
+        types = tuple(types) if types is not None else None
+        pids = set(pids) if pids is not None else None
+
+        data_file = 'replay.game.events'
+        if self._level >= 3:
+            events = (event for event in self.events if isinstance(event, GameEvent))
+        elif self.raw_data_store is not None and data_file in self.raw_data_store:
+            events = self._iter_game_events(types)
+        else:
+            data = utils.extract_data_file(data_file, self._get_archive())
+            if not data:
+                self.logger.error("{0} not found in archive".format(data_file))
+                return EventTable([])
+            return self._get_reader(data_file).read_table(utils.ReplayBuffer(data), self, types, pids)
+
+        if types is not None:
+            events = (event for event in events if isinstance(event, types))
+        if pids is not None:
+            events = (event for event in events if event.pid in pids)
+        return EventTable(events)
+
+    def _iter_game_events(self, event_types=None):
+        data_file = 'replay.game.events'
+        if self.raw_data_store is not None and data_file in self.raw_data_store:
+            return iter(utils.deserialize(self.raw_data_store[data_file]) or [])
+
+        data = utils.extract_data_file(data_file, self._get_archive())
+        if not data:
+            self.logger.error("{0} not found in archive".format(data_file))
+            return iter([])
+
+        return self._get_reader(data_file).iter_events(utils.ReplayBuffer(data), self, event_types)
+
+    def _get_archive(self):
+        # Replays rebuilt from a raw data store open the archive only once a
+        # data file that wasn't stored is needed. Unpickled replays no longer
+        # have their source and go back to the replay file.
+        if self.archive is None:
+            source = self._source
+            if source is None:
+                if not os.path.isfile(self.filename):
+                    raise MPQError("Unable to reopen the MPQArchive of {0}".format(self.filename))
+                with open(self.filename, 'rb') as replay_file:
+                    source = self._source = StringIO(replay_file.read())
+            self.archive = utils.open_archive(source)
+        return self.archive
+
+    def _read_stored(self, data_file, read):
+        # Use the output stored by a previous load if there is one. Otherwise
+        # read it and store a copy before the loaders add any context to it.
+        store = self.raw_data_store
+        if store is not None and data_file in store:
+            return utils.deserialize(store[data_file])
+
+        value = read()
+        if store is not None:
+            store[data_file] = utils.serialize(value)
+        return value
+
+for level, names in Replay.lazy_attributes.items():
+    for name in names:
+        setattr(Replay, name, LazyAttribute(name, level, Replay.__dict__.get(name, LazyAttribute.missing)))
+
+
 class Map(Resource):
     url_template = 'http://{0}.depot.battle.net:1119/{1}.s2ma'
 
@@ -640,6 +992,24 @@ class Localization(Resource):
     def __getitem__(self, key):
         return self.mapping[key]
 
+# The parts of a game summary are read into the records below. The records
+# keep the values of the keys they don't name in their extra field so that
+# nothing in the file is lost. Part 0 holds the game details and part 1 the
+# translation ids. Parts 3 and on hold lists of stats, graphs and build
+# order items, each with a list of entries per player; there can be
+# thousands of them.
+SUMMARY_ITEM = utils.StructRecord(SummaryItem, {1: utils.StructList(utils.StructList(utils.StructRecord(SummaryEntry, extra=True)))}, extra=True)
+SUMMARY_PARTS = [
+    utils.StructRecord(SummaryDetails, {
+        3: utils.StructList(utils.StructRecord(SummaryPlayer, extra=True)),
+        5: utils.StructList(utils.StructRecord(SummaryProperty, keys=[0, 1, 2, 3, 8], extra=True)),
+        6: utils.StructRecord(SummaryLobby, keys=[6, 7, 8], extra=True),
+    }, keys=[0, 3, 5, 6, 7, 8], extra=True),
+    utils.StructDict(fields={0: utils.StructList(utils.StructRecord(SummaryMapping, keys=[1, 2], extra=True))}),
+    None,
+]
+SUMMARY_ITEMS_PART = utils.StructDict(fields={0: utils.StructList(SUMMARY_ITEM)})
+
 class GameSummary(Resource):
 
     url_template = 'http://{0}.depot.battle.net:1119/{1}.s2gs'
@@ -671,8 +1041,34 @@ class GameSummary(Resource):
     #: Map localization urls
     localization_urls = dict()
 
-    def __init__(self, summary_file, filename=None, **options):
+    #: The sections that can be loaded with the ``sections`` option, see
+    #: :meth:`__init__`.
+    SECTIONS = ('map_info', 'settings', 'stats', 'builds', 'players', 'results')
+
+    def __init__(self, summary_file, filename=None, sections=None, **options):
+        """
+        Loads the given ``sections`` of the summary, all of them by default:
+
+            * map_info - map_name, map_description and map_tileset
+            * settings - the settings and player_settings dicts
+            * stats - the player_stats dict, score screen stats and graphs
+            * builds - the build_orders dict
+            * players - players, observers, teams, winners and the game type;
+              requires the settings and fills in the stats of the players if
+              those are loaded too.
+            * results - just the winners
+
+        The parts of the file are read into the game summary records of
+        :mod:`sc2reader.objects`, see :data:`SUMMARY_PARTS`. Those that
+        aren't needed for the chosen sections are skipped without being
+        decoded and left as None in :attr:`parts`.
+        The localization sheets are only fetched once translations are
+        needed, see :attr:`lang_sheets`.
+        """
         super(GameSummary, self).__init__(summary_file, filename,**options)
+        self.sections = set(self.SECTIONS if sections is None else sections)
+        if 'players' in self.sections:
+            self.sections.add('settings')
 
         #: A list of teams
         self.team = dict()
@@ -708,30 +1104,52 @@ class GameSummary(Resource):
 
         # TODO: Is there a fixed number of entries?
         # TODO: Maybe the # of parts is recorded somewhere?
+        #
+        # Part 0 holds the game details, part 1 the ids of the translations,
+        # parts 3 and 4 the stats and parts 4 and on the build orders.
+        translated = self.sections - set(['results'])
+        needed = lambda part: (part == 0 or sections is None
+                               or (part == 1 and translated)
+                               or (part in (3, 4) and 'stats' in self.sections)
+                               or (part >= 4 and 'builds' in self.sections))
         self.parts = list()
         while not buffer.is_empty:
-            self.parts.append(buffer.read_data_struct())
+            part = len(self.parts)
+            if needed(part):
+                self.parts.append(buffer.read_data_struct(SUMMARY_PARTS[part] if part < len(SUMMARY_PARTS) else SUMMARY_ITEMS_PART))
+            elif 'builds' not in self.sections and part >= 4:
+                break
+            else:
+                buffer.skip_data_struct()
+                self.parts.append(None)
 
-        self.end_time = datetime.utcfromtimestamp(self.parts[0][8])
-        self.game_speed = GAME_SPEED_CODES[self.parts[0][0][1]]
-        self.game_length = utils.Length(seconds=self.parts[0][7])
-        self.real_length = utils.Length(seconds=self.parts[0][7]/GAME_SPEED_FACTOR[self.game_speed])
-        self.start_time = datetime.utcfromtimestamp(self.parts[0][8] - self.real_length.seconds)
+        details = self.parts[0]
+        self.end_time = datetime.utcfromtimestamp(details.end_time)
+        self.game_speed = GAME_SPEED_CODES[details.options[1]]
+        self.game_length = utils.Length(seconds=details.game_length)
+        self.real_length = utils.Length(seconds=details.game_length/GAME_SPEED_FACTOR[self.game_speed])
+        self.start_time = datetime.utcfromtimestamp(details.end_time - self.real_length.seconds)
 
         self.load_translations()
-        self.load_map_info()
-        self.load_settings()
-        self.load_player_stats()
-        self.load_player_builds()
-        self.load_players()
-
-        self.game_type = self.settings['Teams'].replace(" ","")
-        self.real_type = real_type(self.teams.values())
+        if 'map_info' in self.sections:
+            self.load_map_info()
+        if 'settings' in self.sections:
+            self.load_settings()
+        if 'stats' in self.sections:
+            self.load_player_stats()
+        if 'builds' in self.sections:
+            self.load_player_builds()
+        if 'players' in self.sections:
+            self.load_players()
+            self.game_type = self.settings['Teams'].replace(" ","")
+            self.real_type = real_type(self.teams.values())
+        elif 'results' in self.sections:
+            self.load_results()
 
         # The s2gs file also keeps reference to a series of s2mv files
         # Some of these appear to be encoded bytes and others appear to be
         # the preview images that authors may bundle with their maps.
-        self.s2mv_urls = [str(DepotFile(file_hash)) for file_hash in self.parts[0][6][7]]
+        self.s2mv_urls = [str(DepotFile(file_hash)) for file_hash in self.parts[0].lobby.s2mv_files]
 
     def load_translations(self):
         # This section of the file seems to map numerical ids to their
@@ -744,24 +1162,26 @@ class GameSummary(Resource):
         # In some cases it seems that these ids don't map to an entry so
         # there must be some additional purpose to this section as well.
         #
+        # Part 1 is skipped when none of the sections need translations.
         self.id_map = dict()
-        for mapping in self.parts[1][0]:
-            if isinstance(mapping[2][0], dict):
-                self.id_map[mapping[1][1]] = (mapping[2][0][1],mapping[2][0][2])
+        mappings = self.parts[1][0] if self.parts[1] is not None else list()
+        for mapping in mappings:
+            if isinstance(mapping.translation[0], dict):
+                self.id_map[mapping.id[1]] = (mapping.translation[0][1],mapping.translation[0][2])
 
         # The id mappings for lobby and player properties are stored
-        # separately in the parts[0][5] entry.
+        # separately with the properties in part 0.
         #
         # The values for each property are also mapped but the values
         # don't have their own unique ids so we use a compound key
         self.lobby_properties = dict()
-        for item in self.parts[0][5]:
-            uid = item[0][1]
-            sheet = item[2][0][1]
-            entry = item[2][0][2]
+        for item in self.parts[0].properties:
+            uid = item.id[1]
+            sheet = item.name[0][1]
+            entry = item.name[0][2]
             self.id_map[uid] = (sheet, entry)
 
-            for value in item[1]:
+            for value in item.values:
                 sheet = value[1][0][1]
                 entry = value[1][0][2]
                 self.id_map[(uid, value[0])] = (sheet, entry)
@@ -771,7 +1191,7 @@ class GameSummary(Resource):
         # resources hosted on the battle.net depot servers.
         #
         # Sometimes these byte strings are all NULLed out and need to be ignored.
-        for localization in self.parts[0][6][8]:
+        for localization in self.parts[0].lobby.localizations:
             language = localization[0]
 
             files = list()
@@ -783,27 +1203,47 @@ class GameSummary(Resource):
         # Grab the gateway from the one of the files
         self.gateway = self.localization_urls.values()[0][0].server.lower()
 
+        # The sheets are fetched from the depot once they are first needed
+        self._lang_sheets = None
+        self._translations = None
+
+    @property
+    def lang_sheets(self):
+        """The localization sheets of the summary by language, fetched on first use."""
+        if self._lang_sheets is None:
+            self.load_lang_sheets()
+        return self._lang_sheets
+
+    @property
+    def translations(self):
+        """A map from internal id to localized string by language, see :attr:`lang_sheets`."""
+        if self._translations is None:
+            self.load_lang_sheets()
+        return self._translations
+
+    def load_lang_sheets(self):
         # Each of the localization urls points to an XML file with a set of
         # localization strings and their unique ids. After reading these mappings
         # into a lang_sheets variable we can use these sheets to make a direct
         # map from internal id to localize string.
         #
         # For now we'll only do this for english localizations.
-        self.lang_sheets = dict()
-        self.translations =  dict()
+        self._lang_sheets = dict()
+        self._translations =  dict()
         for lang, files in self.localization_urls.items():
             if lang != 'enUS': continue
 
-            sheets = list()
-            for depot_file in files:
-                sheets.append(self.factory.load_localization(depot_file, **self.opt))
+            # The factory fetches all the sheets at once. They're loaded in
+            # this process even when the summaries are spread over workers.
+            options = utils.merged_dict(self.opt, dict(workers=1))
+            sheets = list(self.factory.load_localizations(files, options=options))
 
             translation = dict()
             for uid, (sheet, item) in self.id_map.items():
                 translation[uid] = sheets[sheet][item]
 
-            self.lang_sheets[lang] = sheets
-            self.translations[lang] = translation
+            self._lang_sheets[lang] = sheets
+            self._translations[lang] = translation
 
     def load_map_info(self):
         map_strings = self.lang_sheets['enUS'][-1]
@@ -815,11 +1255,11 @@ class GameSummary(Resource):
         Property = namedtuple('Property',['id','values','requirements','defaults','is_lobby'])
 
         properties = dict()
-        for p in self.parts[0][5]:
-            properties[p[0][1]] = Property(p[0][1],p[1],p[3],p[8],isinstance(p[8],dict))
+        for p in self.parts[0].properties:
+            properties[p.id[1]] = Property(p.id[1],p.values,p.requirements,p.defaults,isinstance(p.defaults,dict))
 
         settings = dict()
-        for setting in self.parts[0][6][6]:
+        for setting in self.parts[0].lobby.settings:
             prop = properties[setting[0][1]]
             if prop.is_lobby:
                 settings[setting[0][1]] = setting[1][0]
@@ -885,15 +1325,13 @@ class GameSummary(Resource):
         #   {0: {0:999, 1:translation_id}, 1: [ [{0: Value, 1:0, 2:871???}], [], ...]
         #
         # Value is as seen on the score screen in game.
-        stats_items = self.parts[3][0]
-        if len(self.parts) > 4:
-            stats_items.append(self.parts[4][0][0])
+        stats_items = self.parts[3][0] + self.parts[4][0][:1] if len(self.parts) > 4 else self.parts[3][0]
 
         for item in stats_items:
-            stat_name = self.translations['enUS'][item[0][1]]
-            for index, value in enumerate(item[1]):
+            stat_name = self.translations['enUS'][item.id[1]]
+            for index, value in enumerate(item.values):
                 if value:
-                    self.player_stats[index][stat_name] = value[0][0]
+                    self.player_stats[index][stat_name] = value[0].value
 
         if len(self.parts) < 5: return
 
@@ -904,12 +1342,12 @@ class GameSummary(Resource):
         #
         # The 2nd part of the tuple appears to always be zero and
         # the time is in seconds of game time.
-        for index, items in enumerate(self.parts[4][0][1][1]):
-            xy = [(o[2], o[0]) for o in items]
+        for index, items in enumerate(self.parts[4][0][1].values):
+            xy = [(o.time, o.value) for o in items]
             self.player_stats[index]['Income Graph'] = Graph([], [], xy_list=xy)
 
-        for index, items in enumerate(self.parts[4][0][2][1]):
-            xy = [(o[2], o[0]) for o in items]
+        for index, items in enumerate(self.parts[4][0][2].values):
+            xy = [(o.time, o.value) for o in items]
             self.player_stats[index]['Army Graph'] = Graph([], [], xy_list=xy)
 
     def load_player_builds(self):
@@ -926,49 +1364,56 @@ class GameSummary(Resource):
         # up to the first 64 successful actions in the game.
         BuildEntry = namedtuple('BuildEntry',['supply','total_supply','time','order','build_index'])
         for build_item in build_items:
-            if build_item[0][1] in self.translations['enUS']:
-                order_name = self.translations['enUS'][build_item[0][1]]
-                for pindex, commands in enumerate(build_item[1]):
+            if build_item.id[1] in self.translations['enUS']:
+                order_name = self.translations['enUS'][build_item.id[1]]
+                for pindex, commands in enumerate(build_item.values):
                     for command in commands:
                         self.build_orders[pindex].append(BuildEntry(
-                                supply=command[0],
-                                total_supply=command[1]&0xff,
-                                time=(command[2] >> 8) / 16,
+                                supply=command.value,
+                                total_supply=command.info&0xff,
+                                time=(command.time >> 8) / 16,
                                 order=order_name,
-                                build_index=command[1] >> 16
+                                build_index=command.info >> 16
                             ))
             else:
-                self.logger.warn("Unknown item in build order, key = {}".format(build_item[0][1]))
+                self.logger.warn("Unknown item in build order, key = {}".format(build_item.id[1]))
 
         # Once we've compiled all the build commands we need to make
         # sure they are properly sorted for presentation.
         for build_order in self.build_orders.values():
             build_order.sort(key=lambda x: x.build_index)
 
+    def load_results(self):
+        # The winners can be found without the settings as long as observers,
+        # which never win, aren't needed.
+        for struct in self.parts[0].players:
+            if struct.slot[1] and isinstance(struct.result,dict) and struct.result[0] == 0:
+                self.winners.append(struct.slot[0])
+
     def load_players(self):
-        for index, struct in enumerate(self.parts[0][3]):
-            if not struct[0][1]: continue # Slot is closed
+        for index, struct in enumerate(self.parts[0].players):
+            if not struct.slot[1]: continue # Slot is closed
 
-            player = PlayerSummary(struct[0][0])
+            player = PlayerSummary(struct.slot[0])
             stats = self.player_stats[index]
             settings = self.player_settings[index]
-            player.is_ai = not isinstance(struct[0][1], dict)
+            player.is_ai = not isinstance(struct.slot[1], dict)
             if not player.is_ai:
                 player.gateway = self.gateway
-                player.subregion = struct[0][1][0][2]
+                player.subregion = struct.slot[1][0][2]
                 player.region = REGIONS[player.gateway].get(player.subregion, 'Unknown')
-                player.bnetid = struct[0][1][0][3]
-                player.unknown1 = struct[0][1][0]
-                player.unknown2 = struct[0][1][1]
+                player.bnetid = struct.slot[1][0][3]
+                player.unknown1 = struct.slot[1][0]
+                player.unknown2 = struct.slot[1][1]
 
             # Either a referee or a spectator, nothing else to do
             if settings['Participant Role'] != 'Participant':
                 self.observers.append(player)
                 continue
 
-            player.play_race = RACE_CODES.get(struct[2], None)
+            player.play_race = RACE_CODES.get(struct.race, None)
 
-            player.is_winner = isinstance(struct[1],dict) and struct[1][0] == 0
+            player.is_winner = isinstance(struct.result,dict) and struct.result[0] == 0
             if player.is_winner:
                 self.winners.append(player.pid)
 
@@ -1,6 +1,5 @@
 from __future__ import absolute_import
 
-from cStringIO import StringIO
 import fnmatch
 import os
 import re
@@ -8,205 +7,300 @@ import struct
 import textwrap
 import sys
 import mpyq
+import mmap
+import zlib
+import hashlib
+import gc
+import cPickle
 import functools
+import operator
+from bisect import bisect_right
 from itertools import groupby
 from datetime import timedelta
-from collections import deque
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from binascii import hexlify
 
 from sc2reader import exceptions
 from sc2reader.constants import COLOR_CODES, BUILD_ORDER_UPGRADES
-from sc2reader.data import build22612 as Data
+from sc2reader.data import load_build
 
 LITTLE_ENDIAN,BIG_ENDIAN = '<','>'
 
+LO_MASKS = [0x00, 0x01, 0x03, 0x07, 0x0F, 0x1F, 0x3F, 0x7F, 0xFF]
+HI_MASKS = [0xFF ^ mask for mask in LO_MASKS]
+
+# Pre-compiled structs for unpacking straight out of the buffer
+SHORT_STRUCTS = {LITTLE_ENDIAN: struct.Struct('<H'), BIG_ENDIAN: struct.Struct('>H')}
+INT_STRUCTS = {LITTLE_ENDIAN: struct.Struct('<I'), BIG_ENDIAN: struct.Struct('>I')}
+
+unpack_short_be = SHORT_STRUCTS[BIG_ENDIAN].unpack_from
+unpack_int_be = INT_STRUCTS[BIG_ENDIAN].unpack_from
+unpack_word = struct.Struct('>Q').unpack_from
+
 class ReplayBuffer(object):
-    """ The ReplayBuffer is a wrapper over the a StringIO object and provides
-        convenience functions for reading structured data from Starcraft II
-        replay files.
+    """ The ReplayBuffer holds an entire data file as a single bytearray and
+        provides convenience functions for reading structured data from
+        Starcraft II replay files.
+
+        The small reads that make up most of the event decoding index plain
+        ints out of the bytearray rather than going through a stream or
+        struct call per field. Wider fields are unpacked from a single big
+        endian word and byte strings are sliced out of it.
     """
 
+    lo_masks = LO_MASKS
+    hi_masks = HI_MASKS
+
     def __init__(self, source):
         #Accept file like objects and string objects
         if hasattr(source,'read'):
             source = source.read()
-        self.istream = StringIO(source)
 
-        # Expose part of the interface
-        self.read = self.istream.read
-        self.seek = self.istream.seek
-        self.tell = self.istream.tell
-
-        # get length of stream
-        self.seek(0, os.SEEK_END)
-        self.length = self.istream.tell()
-        self.seek(0, os.SEEK_SET)
+        # The buffer is never modified, reads just move the position along
+        self._bytes = bytearray(source)
+        self._pos = 0
+        self.length = len(source)
 
         # helpers to deal with bit reads
         self.bit_shift = 0
         self.bit_buffer = None
 
-        # Extra optimization stuff
-        self.lo_masks = [0x00, 0x01, 0x03, 0x07, 0x0F, 0x1F, 0x3F, 0x7F, 0xFF]
-        self.hi_masks = [0xFF ^ mask for mask in self.lo_masks]
-        self.masks = zip(self.lo_masks, self.hi_masks)
-        self.temp_buffer = StringIO()
-
     '''
         Helper Functions
     '''
     @property
     def is_empty(self):
-        return self.tell() == self.length
+        return self._pos == self.length
 
     def bytes_left(self):
-        return self.length - self.tell()
+        return self.length - self._pos
 
     def byte_align(self):
         self.bit_shift=0
 
     def reset(self):
         self.bit_shift=0
-        self.seek(0, os.SEEK_SET)
+        self._pos = 0
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.length
+
+        if offset < 0:
+            raise IOError("Cannot seek to negative position {0}".format(offset))
+        self._pos = offset
+
+    def read(self, bytes=-1):
+        start = self._pos
+        end = self.length if bytes < 0 else min(start+bytes, self.length)
+        if end > start:
+            self._pos = end
+        return str(self._bytes[start:end])
 
     def skip(self, bytes):
-        self.seek(bytes-1, os.SEEK_CUR)
-        self.bit_buffer = ord(self.read(1))
+        self._pos += bytes
+        if self._pos > self.length:
+            raise EOFError("Cannot skip {0} bytes; only {1} bytes left in buffer".format(bytes, self.length-self._pos+bytes))
+        self.bit_buffer = self._bytes[self._pos-1]
+
+    def skip_bits(self, bits):
+        """Moves past the given number of bits without reading them."""
+        bit_shift = self.bit_shift
+        if bit_shift != 0:
+            bits_left = 8-bit_shift
+            if bits < bits_left:
+                self.bit_shift = bit_shift+bits
+                return
+            bits -= bits_left
+
+        # Whole bytes are stepped over, a trailing partial byte becomes the
+        # new bit buffer just as it would for read_bits.
+        bit_shift = bits & 0x07
+        pos = self._pos + (bits >> 3) + (bit_shift != 0)
+        if pos > self.length:
+            raise EOFError("Cannot skip {0} bits; only {1} bytes left in buffer".format(bits, self.length-self._pos))
+        self._pos = pos
+        self.bit_shift = bit_shift
+        if bit_shift != 0:
+            self.bit_buffer = self._bytes[pos-1]
 
     def read_range(self, start, end):
-        cur = self.tell()
-        self.seek(start, os.SEEK_SET)
-        bytes = self.read(end-start)
-        self.seek(cur, os.SEEK_SET)
-        return bytes
+        return str(self._bytes[start:end])
 
     def peek(self, length):
-        cur = self.tell()
-        bytes = self.read(length)
-        self.istream.seek(cur, os.SEEK_SET)
-        return bytes
+        return str(self._bytes[self._pos:self._pos+length])
 
     '''
         Optimized bit-shift aware read methods
     '''
     def read_byte(self):
-        #if self.bytes_left() == 0:
-        #    raise EOFError("Cannot read byte; no bytes remaining")
+        pos = self._pos
+        try:
+            byte = self._bytes[pos]
+        except IndexError:
+            raise EOFError("Cannot read byte; no bytes remaining")
 
-        if self.bit_shift==0:
-            return ord(self.read(1))
+        self._pos = pos+1
+        bit_shift = self.bit_shift
+        if bit_shift == 0:
+            return byte
         else:
-            lo_mask, hi_mask = self.masks[self.bit_shift]
-            hi_bits = self.bit_buffer & hi_mask
-            self.bit_buffer = ord(self.read(1))
-            lo_bits = self.bit_buffer & lo_mask
-            return hi_bits | lo_bits
+            hi_bits = self.bit_buffer & HI_MASKS[bit_shift]
+            self.bit_buffer = byte
+            return hi_bits | byte & LO_MASKS[bit_shift]
 
     def read_short(self, endian=LITTLE_ENDIAN):
-        #if self.bytes_left() < 2:
-        #    raise EOFError("Cannot read short; only {} bytes left in buffer".format(self.left))
+        pos = self._pos
+        data = self._bytes
+        try:
+            hi, lo = data[pos], data[pos+1]
+        except IndexError:
+            raise EOFError("Cannot read short; only {0} bytes left in buffer".format(self.length-pos))
 
-        if self.bit_shift == 0:
-            return struct.unpack(endian+'H', self.read(2))[0]
+        self._pos = pos+2
+        bit_shift = self.bit_shift
+        if bit_shift == 0:
+            return lo << 8 | hi if endian == LITTLE_ENDIAN else hi << 8 | lo
 
-        else:
-            lo_mask, hi_mask = self.masks[self.bit_shift]
-            block = struct.unpack('>H', self.read(2))[0]
-            number = (self.bit_buffer & hi_mask) << 8 | (block & 0xFF00) >> (8-self.bit_shift) | (block & lo_mask)
-            self.bit_buffer = block & 0xFF
-            if endian == LITTLE_ENDIAN:
-                number = (number & 0xFF00) >> 8 | (number & 0xFF) << 8
+        number = (self.bit_buffer & HI_MASKS[bit_shift]) << 8 | hi << bit_shift | lo & LO_MASKS[bit_shift]
+        self.bit_buffer = lo
+        if endian == LITTLE_ENDIAN:
+            number = (number & 0xFF00) >> 8 | (number & 0xFF) << 8
 
-            return number
+        return number
 
     def read_int(self, endian=LITTLE_ENDIAN):
-        #if self.bytes_left() < 4:
-        #    raise EOFError("Cannot read int; only {} bytes left in buffer".format(self.left))
-
-        if self.bit_shift == 0:
-            return struct.unpack(endian+'I', self.read(4))[0]
+        pos = self._pos
+        data = self._bytes
+        try:
+            b0, b1, b2, b3 = data[pos], data[pos+1], data[pos+2], data[pos+3]
+        except IndexError:
+            raise EOFError("Cannot read int; only {0} bytes left in buffer".format(self.length-pos))
 
-        else:
-            lo_mask, hi_mask = self.masks[self.bit_shift]
-            block = struct.unpack('>I', self.read(4))[0]
-            number = (self.bit_buffer & hi_mask) << 24 | (block & 0xFFFFFF00) >> (8-self.bit_shift) | (block & lo_mask)
-            self.bit_buffer = block & 0xFF
+        self._pos = pos+4
+        bit_shift = self.bit_shift
+        if bit_shift == 0:
             if endian == LITTLE_ENDIAN:
-                number = (number & 0xFF000000) >> 24 | (number & 0xFF0000) >> 8 | (number & 0xFF00) << 8 | (number & 0xFF) << 24
+                return b3 << 24 | b2 << 16 | b1 << 8 | b0
+            return b0 << 24 | b1 << 16 | b2 << 8 | b3
+
+        number = (self.bit_buffer & HI_MASKS[bit_shift]) << 24 | (b0 << 16 | b1 << 8 | b2) << bit_shift | b3 & LO_MASKS[bit_shift]
+        self.bit_buffer = b3
+        if endian == LITTLE_ENDIAN:
+            number = (number & 0xFF000000) >> 24 | (number & 0xFF0000) >> 8 | (number & 0xFF00) << 8 | (number & 0xFF) << 24
 
-            return number
+        return number
 
     def read_bits(self, bits):
-        #if self.bytes_left()*8 < bits-(8-self.bit_shift):
-        #    raise EOFError("Cannot read {} bits. only {} bits left in buffer.".format(bits, (self.length-self.tell()+1)*8-self.bit_shift))
         bit_shift = self.bit_shift
-        if bit_shift!=0:
-            bits_left = 8-bit_shift
-
-            # Read it all and continue
-            if bits_left < bits:
-                bits -= bits_left
-                result = (self.bit_buffer >> bit_shift) << bits
+        if bit_shift != 0:
+            end_shift = bit_shift+bits
 
             # Read part and return
-            elif bits_left > bits:
-                self.bit_shift+=bits
-                return (self.bit_buffer >> bit_shift) & self.lo_masks[bits]
+            if end_shift < 8:
+                self.bit_shift = end_shift
+                return (self.bit_buffer >> bit_shift) & LO_MASKS[bits]
 
             # Read all and return
-            else:
+            elif end_shift == 8:
                 self.bit_shift = 0
                 return self.bit_buffer >> bit_shift
 
-        else:
-            result = 0
-
-        if bits >= 8:
-            bytes = bits/8
-
-            if bytes == 1:
-                bits -= 8
-                result |= ord(self.read(1)) << bits
+            # Read it all and continue
+            bits = end_shift-8
+            result = self.bit_buffer >> bit_shift << bits
 
-            elif bytes == 2:
-                bits -= 16
-                result |= struct.unpack(">H",self.read(2))[0] << bits
+        elif bits == 0:
+            return 0
 
-            elif bytes == 4:
-                bits -= 32
-                result |= struct.unpack(">I",self.read(4))[0] << bits
+        else:
+            result = 0
 
+        # The remaining bits are made up of whole bytes in big endian order
+        # followed by the low bits of a final partial byte, which becomes the
+        # new bit buffer. Reads of up to three bytes index the byte array.
+        pos = self._pos
+        data = self._bytes
+        try:
+            if bits <= 8:
+                byte = data[pos]
+                self._pos = pos+1
+                if bits == 8:
+                    self.bit_shift = 0
+                    return result | byte
+                self.bit_shift = bits
+                self.bit_buffer = byte
+                return result | byte & LO_MASKS[bits]
+            elif bits <= 16:
+                word = data[pos] << 8 | data[pos+1]
+                self._pos = pos+2
+            elif bits <= 24:
+                word = data[pos] << 16 | data[pos+1] << 8 | data[pos+2]
+                self._pos = pos+3
             else:
-                for byte in struct.unpack("B"*bytes, self.read(bytes)):
-                    bits -= 8
-                    result |= byte << bits
-
-        if bits != 0:
-            self.bit_buffer = ord(self.read(1))
-            result |= self.bit_buffer & self.lo_masks[bits]
-
-        self.bit_shift = bits
-        return result
+                return self._read_long_bits(result, bits, pos)
+        except IndexError:
+            raise EOFError("Cannot read {0} bits; only {1} bytes left in buffer".format(bits, self.length-pos))
+
+        bit_shift = bits & 0x07
+        self.bit_shift = bit_shift
+        if bit_shift == 0:
+            return result | word
+        else:
+            self.bit_buffer = word & 0xFF
+            return result | (word >> 8) << bit_shift | word & LO_MASKS[bit_shift]
+
+    def _read_long_bits(self, result, bits, pos):
+        # Grab all the bytes at once as a single big endian word. Ints are
+        # unpacked directly, the rest are cut out of a 64 bit word and only
+        # really long bit masks fall back to hexlify.
+        byte_count = (bits+7) >> 3
+        try:
+            if byte_count == 4:
+                word = unpack_int_be(self._bytes, pos)[0]
+            elif byte_count <= 8 and pos+8 <= self.length:
+                # Keep results as plain ints rather than the longs struct gives us
+                word = int(unpack_word(self._bytes, pos)[0] >> (64-8*byte_count))
+            elif pos+byte_count <= self.length:
+                word = int(hexlify(self._bytes[pos:pos+byte_count]), 16)
+            else:
+                raise IndexError
+        except (IndexError, struct.error):
+            raise EOFError("Cannot read {0} bits; only {1} bytes left in buffer".format(bits, self.length-pos))
+        self._pos = pos+byte_count
+
+        bit_shift = bits & 0x07
+        self.bit_shift = bit_shift
+        if bit_shift == 0:
+            return result | word
+        else:
+            self.bit_buffer = word & 0xFF
+            return result | (word >> 8) << bit_shift | word & LO_MASKS[bit_shift]
 
     def read_bytes(self, bytes):
-        #if self.bytes_left() < bytes:
-        #    raise EOFError("Cannot read {} bytes. only {} bytes left in buffer.".format(bytes, self.length-self.tell()))
+        pos = self._pos
+        end = pos+bytes
+        if end > self.length:
+            raise EOFError("Cannot read {0} bytes; only {1} bytes left in buffer".format(bytes, self.length-pos))
+        self._pos = end
 
-        if self.bit_shift==0:
-            return self.read(bytes)
+        if self.bit_shift == 0 or bytes == 0:
+            return str(self._bytes[pos:end])
 
         else:
-            temp_buffer = self.temp_buffer
-            prev_byte = self.bit_buffer
-            lo_mask, hi_mask = self.masks[self.bit_shift]
-            for next_byte in struct.unpack("B"*bytes, self.read(bytes)):
-                temp_buffer.write(chr(prev_byte & hi_mask | next_byte & lo_mask))
-                prev_byte = next_byte
-
-            self.bit_buffer = prev_byte
-            final_bytes = temp_buffer.getvalue()
-            temp_buffer.truncate(0)
-            return final_bytes
-
+            # Each byte is stitched together from the high bits of the
+            # previous byte and the low bits of the next byte.
+            lo_mask, hi_mask = LO_MASKS[self.bit_shift], HI_MASKS[self.bit_shift]
+            next_bytes = self._bytes[pos:end]
+            prev_bytes = bytearray((self.bit_buffer,)) + next_bytes[:-1]
+            self.bit_buffer = next_bytes[-1]
+            return str(bytearray(prev & hi_mask | next & lo_mask for prev, next in zip(prev_bytes, next_bytes)))
 
     '''
         Common read patterns
@@ -240,23 +334,281 @@ class ReplayBuffer(object):
         The least significant 2 bits of the first byte specify how many extra
         bytes the timestamp has.
         """
-        first = self.read_byte()
-        time,count = first >> 2, first & 0x03
-        if count == 0:
-            return time
-        elif count == 1:
-            return time << 8 | self.read_byte()
-        elif count == 2:
-            return time << 16 | self.read_short(BIG_ENDIAN)
-        elif count == 3:
-            return time << 24 | self.read_short(BIG_ENDIAN) << 8 | self.read_byte()
-
-    def read_data_struct(self, indent=0, key=None):
+        if self.bit_shift != 0:
+            first = self.read_byte()
+            time,count = first >> 2, first & 0x03
+            if count == 0:
+                return time
+            elif count == 1:
+                return time << 8 | self.read_byte()
+            elif count == 2:
+                return time << 16 | self.read_short(BIG_ENDIAN)
+            elif count == 3:
+                return time << 24 | self.read_short(BIG_ENDIAN) << 8 | self.read_byte()
+
+        # Aligned timestamps, nearly all of them, are read straight out of
+        # the byte array
+        pos = self._pos
+        data = self._bytes
+        try:
+            first = data[pos]
+            time,count = first >> 2, first & 0x03
+            if count == 0:
+                end, time = pos+1, time
+            elif count == 1:
+                end, time = pos+2, time << 8 | data[pos+1]
+            elif count == 2:
+                end, time = pos+3, time << 16 | data[pos+1] << 8 | data[pos+2]
+            else:
+                end, time = pos+4, time << 24 | data[pos+1] << 16 | data[pos+2] << 8 | data[pos+3]
+        except IndexError:
+            raise EOFError("Cannot read timestamp; only {0} bytes left in buffer".format(self.length-pos))
+
+        self._pos = end
+        return time
+
+    def read_data_struct(self, schema=None):
         """
         Read a Blizzard data-structure. Structure can contain strings, lists,
-        dictionaries and custom integer types.
+        dictionaries and custom integer types. See :meth:`trace_data_struct`
+        for a description of the format and for a decoder that reports each
+        value as it is read.
+
+        The structure is decoded in a single loop over the buffer with a
+        stack of the lists and dictionaries still being filled. Given a
+        schema, see :class:`StructRecord`, dictionaries are read straight
+        into records and the values they don't need are skipped over.
+        """
+        if self.bit_shift != 0:
+            # Data structures are always byte aligned in practice
+            value = self.trace_data_struct()
+            return schema.convert(value) if schema else value
+
+        data, pos = self._bytes, self._pos
+        stack = list()
+
+        # The container being filled, the values it still needs, the key of
+        # the next value, how it stores values (LIST, DICT or RECORD), its
+        # schema and the schema of the next value.
+        container, remaining, key, mode, parent, schema = None, 0, None, LIST, None, schema
+        index = None
+        try:
+            while True:
+                if schema is SKIP:
+                    self._pos = pos
+                    self.skip_data_struct()
+                    pos = self._pos
+                    value = SKIP
+
+                else:
+                    datatype = data[pos]
+                    pos += 1
+
+                    if datatype == 0x09:
+                        value = shift = 0
+                        while True:
+                            byte = data[pos]
+                            pos += 1
+                            value |= (byte & 0x7F) << shift
+                            if not byte & 0x80:
+                                break
+                            shift += 7
+                        value = -(value >> 1) if value & 1 else value >> 1
+
+                    elif datatype == 0x02:
+                        length = data[pos] >> 1
+                        start, pos = pos+1, pos+1+length
+                        if pos > self.length:
+                            raise EOFError("Cannot read {0} bytes; only {1} bytes left in buffer".format(length, self.length-start))
+                        value = str(data[start:pos])
+
+                    elif datatype == 0x06:
+                        value = data[pos]
+                        pos += 1
+
+                    elif datatype == 0x07:
+                        value = str(data[pos:pos+4])
+                        pos += len(value)
+
+                    elif datatype == 0x03:
+                        # The value follows in place unless it is marked missing
+                        pos += 1
+                        if data[pos:pos+2] != '\x04\x04':
+                            continue
+                        value = 0
+
+                    elif datatype == 0x04:
+                        # The value follows in place only if the flag is set
+                        pos += 1
+                        if data[pos-1]:
+                            continue
+                        value = 0
+
+                    elif datatype == 0x00 or datatype == 0x01 or datatype == 0x05:
+                        if datatype == 0x05:
+                            entries = data[pos] >> 1
+                            pos += 1
+                        else:
+                            if datatype == 0x01:
+                                pos += 2
+                            entries = shift = 0
+                            while True:
+                                byte = data[pos]
+                                pos += 1
+                                entries |= (byte & 0x7F) << shift
+                                if not byte & 0x80:
+                                    break
+                                shift += 7
+                            entries = -(entries >> 1) if entries & 1 else entries >> 1
+
+                        # Schemas for the other kind of container don't apply
+                        new_mode = LIST if datatype != 0x05 else (schema.mode if schema and schema.mode != LIST else DICT)
+                        if schema and schema.mode != new_mode:
+                            schema = None
+                        if new_mode == LIST:
+                            value = list()
+                        elif new_mode == DICT:
+                            value = dict()
+                        else:
+                            value = [None]*schema.size
+                            if schema.extra:
+                                value[EXTRA] = dict()
+
+                        # Start filling the new container, empty ones are done
+                        if entries > 0:
+                            stack.append((container, remaining, key, mode, parent, index))
+                            container, remaining, mode, parent = value, entries, new_mode, schema
+                            if mode == LIST:
+                                key, schema = None, parent.item if parent else None
+                            else:
+                                key = data[pos] >> 1
+                                pos += 1
+                                if mode == DICT:
+                                    schema = parent.fields.get(key, parent.item) if parent else None
+                                else:
+                                    index, schema = parent.slots[key]
+                            continue
+
+                        elif new_mode == RECORD:
+                            value = tuple.__new__(schema.cls, value)
+
+                    else:
+                        raise TypeError("Unknown Data Structure: '%s'" % datatype)
+
+                # Store the value, and each container it completes, in the
+                # container it belongs to.
+                while True:
+                    if container is None:
+                        self._pos = pos
+                        return value
+                    elif mode == LIST:
+                        container.append(value)
+                    elif mode == DICT:
+                        container[key] = value
+                    elif value is not SKIP:
+                        if index != EXTRA:
+                            container[index] = value
+                        else:
+                            container[EXTRA][key] = value
+
+                    remaining -= 1
+                    if remaining:
+                        if mode == LIST:
+                            schema = parent.item if parent else None
+                        else:
+                            key = data[pos] >> 1
+                            pos += 1
+                            if mode == DICT:
+                                schema = parent.fields.get(key, parent.item) if parent else None
+                            else:
+                                index, schema = parent.slots[key]
+                        break
+
+                    value = container if mode != RECORD else tuple.__new__(parent.cls, container)
+                    container, remaining, key, mode, parent, index = stack.pop()
+
+        except IndexError:
+            raise EOFError("Cannot read byte; no bytes remaining")
+        finally:
+            self._pos = min(pos, self.length)
+
+    def read_struct(self, schema):
+        """
+        Read a Blizzard data-structure into the types described by the given
+        schema, see :class:`StructRecord`.
+        """
+        return self.read_data_struct(schema)
+
+    def skip_data_struct(self):
+        """Moves past a Blizzard data-structure without building its values."""
+        data, pos = self._bytes, self._pos
+
+        # The values left in each open list or dictionary, negative counts
+        # for dictionaries where each value follows a key byte.
+        stack = [1]
+        try:
+            while stack:
+                remaining = stack[-1]
+                if remaining == 0:
+                    stack.pop()
+                    continue
+                elif remaining > 0:
+                    stack[-1] = remaining-1
+                else:
+                    stack[-1] = remaining+1
+                    pos += 1
+
+                datatype = data[pos]
+                pos += 1
+                if datatype == 0x09:
+                    while data[pos] & 0x80:
+                        pos += 1
+                    pos += 1
+                elif datatype == 0x02:
+                    pos += 1+(data[pos] >> 1)
+                elif datatype == 0x06:
+                    pos += 1
+                elif datatype == 0x07:
+                    pos += 4
+                elif datatype == 0x00 or datatype == 0x01:
+                    if datatype == 0x01:
+                        pos += 2
+                    entries = shift = 0
+                    while True:
+                        byte = data[pos]
+                        pos += 1
+                        entries |= (byte & 0x7F) << shift
+                        if not byte & 0x80:
+                            break
+                        shift += 7
+                    stack.append(max(0, entries >> 1 if not entries & 1 else 0))
+                elif datatype == 0x05:
+                    stack.append(-(data[pos] >> 1))
+                    pos += 1
+                elif datatype == 0x03:
+                    pos += 1
+                    if data[pos:pos+2] != '\x04\x04':
+                        stack.append(1)
+                elif datatype == 0x04:
+                    pos += 1
+                    if data[pos-1]:
+                        stack.append(1)
+                else:
+                    raise TypeError("Unknown Data Structure: '%s'" % datatype)
+
+            if pos > self.length:
+                raise IndexError
+        except IndexError:
+            raise EOFError("Cannot read byte; no bytes remaining")
+        finally:
+            self._pos = min(pos, self.length)
+
+    def trace_data_struct(self, out=None, indent=0, key=None):
+        """
+        Read a Blizzard data-structure one value at a time, writing a line to
+        ``out``, when given, for each value read. Slower than
+        :meth:`read_data_struct` but useful for debugging.
         """
-        debug = False
 
         #The first byte serves as a flag for the type of data to follow
         datatype = self.read_byte()
@@ -270,8 +622,8 @@ class ReplayBuffer(object):
             #the array. See variable int documentation for details.
             entries = self.read_variable_int()
             prefix+=" ({0})".format(entries)
-            if debug: print prefix
-            data = [self.read_data_struct(indent+1,i) for i in range(entries)]
+            if out is not None: out.write(prefix+'\n')
+            data = [self.trace_data_struct(out,indent+1,i) for i in range(entries)]
 
         elif datatype == 0x01:
             #0x01 is an array where the first X bytes mark the number of entries in
@@ -280,8 +632,8 @@ class ReplayBuffer(object):
             self.read_bytes(2).encode("hex")
             entries = self.read_variable_int()
             prefix+=" ({0})".format(entries)
-            if debug: print prefix
-            data = [self.read_data_struct(indent+1,i) for i in range(entries)]
+            if out is not None: out.write(prefix+'\n')
+            data = [self.trace_data_struct(out,indent+1,i) for i in range(entries)]
 
         elif datatype == 0x02:
             #0x02 is a byte string with the first byte indicating
@@ -289,15 +641,15 @@ class ReplayBuffer(object):
             byte = self.read_byte()
             data = self.read_string(byte/2)
             prefix+=" ({0}) - {1}".format(len(data),data)
-            if debug: print prefix
+            if out is not None: out.write(prefix+'\n')
 
         elif datatype == 0x03:
             #0x03 is an unknown data type where the first byte appears
             #to have no effect and kicks back the next instruction
             flag = self.read_byte()
-            if debug: print prefix
+            if out is not None: out.write(prefix+'\n')
             if self.peek(2).encode('hex')!='0404':
-                data = self.read_data_struct(indent,key)
+                data = self.trace_data_struct(out,indent,key)
             else:
                 data = 0
 
@@ -307,12 +659,12 @@ class ReplayBuffer(object):
             #read.
             flag = self.read_byte()
             if flag:
-                if debug: print prefix
-                data = self.read_data_struct(indent,key)
+                if out is not None: out.write(prefix+'\n')
+                data = self.trace_data_struct(out,indent,key)
             else:
                 data = 0
                 prefix+=" - {0}".format(data)
-                if debug: print prefix
+                if out is not None: out.write(prefix+'\n')
 
         elif datatype == 0x05:
             #0x05 is a serialized key,value structure with the first byte
@@ -322,30 +674,181 @@ class ReplayBuffer(object):
             data = dict()
             entries = self.read_byte()/2
             prefix+=" ({0})".format(entries)
-            if debug: print prefix
+            if out is not None: out.write(prefix+'\n')
             for i in range(entries):
                 key = self.read_byte()/2
-                data[key] = self.read_data_struct(indent+1,key) #Done like this to keep correct parse order
+                data[key] = self.trace_data_struct(out,indent+1,key) #Done like this to keep correct parse order
 
         elif datatype == 0x06:
             data = self.read_byte()
             prefix+=" - {0}".format(data)
-            if debug: print prefix
+            if out is not None: out.write(prefix+'\n')
         elif datatype == 0x07:
             data = self.read(4)
             prefix+=" - {0}".format(data)
-            if debug: print prefix
+            if out is not None: out.write(prefix+'\n')
         elif datatype == 0x09:
             data = self.read_variable_int()
             prefix+=" - {0}".format(data)
-            if debug: print prefix
+            if out is not None: out.write(prefix+'\n')
         else:
-            if debug: print prefix
+            if out is not None: out.write(prefix+'\n')
             raise TypeError("Unknown Data Structure: '%s'" % datatype)
 
         return data
 
 
+# How the containers of a data structure store their values
+LIST, DICT, RECORD = range(3)
+
+#: Stands in for the values a schema skips
+SKIP = object()
+SKIPPED_SLOT = (None, SKIP)
+
+#: The index of the field records keep the values of unlisted keys in
+EXTRA = -1
+EXTRA_SLOT = (EXTRA, None)
+
+class StructList(object):
+    """
+    Schema for a list in a Blizzard data-structure, see :class:`StructRecord`.
+    Each entry is read with the ``item`` schema.
+    """
+    mode = LIST
+
+    def __init__(self, item=None):
+        self.item = item
+
+    def convert(self, value):
+        if not isinstance(value, list) or self.item is None:
+            return value
+        return [self.item.convert(item) for item in value]
+
+
+class StructDict(object):
+    """
+    Schema for a dictionary in a Blizzard data-structure which is kept as a
+    dictionary, see :class:`StructRecord`. The values with a key in
+    ``fields`` are read with that schema, the rest with the ``item`` schema.
+    """
+    mode = DICT
+
+    def __init__(self, item=None, fields=None):
+        self.item = item
+        self.fields = fields or dict()
+
+    def convert(self, value):
+        if not isinstance(value, dict):
+            return value
+        converted = dict()
+        for key, item in value.items():
+            schema = self.fields.get(key, self.item)
+            converted[key] = schema.convert(item) if schema else item
+        return converted
+
+
+class StructRecord(object):
+    """
+    Schema for a dictionary in a Blizzard data-structure which is read
+    straight into the namedtuple ``cls``. The values of ``keys``, 0, 1, 2,
+    ... by default, fill its fields in order and are read with the schema
+    given for their key in ``fields``. Values under other keys are skipped
+    without being read and missing keys are left as None::
+
+        Point = namedtuple('Point', ['x', 'y'])
+        points = buffer.read_struct(StructList(StructRecord(Point)))
+
+    With ``extra`` set nothing is skipped; the last field of ``cls`` holds
+    a dictionary of the values under the other keys, read as they are.
+
+    A schema only applies to values of its kind, other values are read as
+    they are. :meth:`convert` applies a schema to a structure that has
+    already been read.
+    """
+    mode = RECORD
+
+    def __init__(self, cls, fields=None, keys=None, extra=False):
+        self.cls = cls
+        self.size = len(cls._fields)
+        self.extra = extra
+        self.keys = keys or range(self.size-1 if extra else self.size)
+        fields = fields or dict()
+
+        # Indexed by key, the field index and schema of the value under it.
+        # Keys are stored in 7 bits so every key has a slot.
+        self.slots = [EXTRA_SLOT if extra else SKIPPED_SLOT]*128
+        for index, key in enumerate(self.keys):
+            self.slots[key] = (index, fields.get(key))
+
+    def convert(self, value):
+        if not isinstance(value, dict):
+            return value
+        values = [None]*self.size
+        if self.extra:
+            values[EXTRA] = dict()
+        for key, item in value.items():
+            index, schema = self.slots[key]
+            if schema is not SKIP:
+                item = schema.convert(item) if schema else item
+                if index != EXTRA:
+                    values[index] = item
+                else:
+                    values[EXTRA][key] = item
+        return self.cls(*values)
+
+
+class BuildRegistry(object):
+    """
+    Resolves a key, such as a data file name, to the value registered for a
+    range of builds. Ranges registered for a specific expansion are checked
+    before those for any expansion. Resolved lookups are cached so each
+    (key, build, expansion) is only ever searched for once.
+
+    ::
+
+        registry = BuildRegistry()
+        registry.register('replay.details', reader, start=22612, expansion='WoL')
+        reader = registry.get('replay.details', 22612, 'WoL')
+    """
+    def __init__(self):
+        self._ranges = defaultdict(list)
+        self._starts = dict()
+        self._cache = dict()
+
+    def register(self, key, value, start=0, end=sys.maxint, expansion=None):
+        """
+        Registers ``value`` for builds ``start`` up to but not including ``end``.
+        Ranges registered for the same key and expansion can't overlap.
+        """
+        ranges = self._ranges[key, expansion]
+        for other_start, other_end, other in ranges:
+            if start < other_end and other_start < end:
+                raise ValueError("Builds {0}-{1} overlap builds {2}-{3} already registered for {4}".format(start, end, other_start, other_end, key))
+
+        ranges.append((start, end, value))
+        ranges.sort(key=lambda r: r[0])
+        self._starts[key, expansion] = [r[0] for r in ranges]
+        self._cache.clear()
+
+    def get(self, key, build, expansion=None):
+        """Returns the value registered for the build, or None."""
+        try:
+            return self._cache[key, build, expansion]
+        except KeyError:
+            pass
+
+        value = None
+        for ranges_key in ((key, expansion), (key, None)):
+            if ranges_key in self._starts:
+                index = bisect_right(self._starts[ranges_key], build)-1
+                if index >= 0 and build < self._ranges[ranges_key][index][1]:
+                    value = self._ranges[ranges_key][index][2]
+                    break
+
+        self._cache[key, build, expansion] = value
+        return value
+
+
 class PersonDict(dict):
     """
     Supports lookup on both the player name and player id
@@ -379,6 +882,15 @@ class PersonDict(dict):
 
         super(PersonDict, self).__setitem__(value.pid, value)
 
+    def __reduce__(self):
+        # Players may not be fully unpickled when they are put back in the
+        # dict, so restore the items directly instead of via __setitem__.
+        return (PersonDict, (), (self.__dict__, dict(self)))
+
+    def __setstate__(self, state):
+        self.__dict__.update(state[0])
+        dict.update(self, state[1])
+
 
 def windows_to_unix(windows_time):
     # This windows timestamp measures the number of 100 nanosecond periods since
@@ -463,15 +975,49 @@ def extract_data_file(data_file, archive):
         trace = sys.exc_info()[2]
         raise exceptions.MPQError("Unable to extract file: {}".format(data_file),e), None, trace
 
+#: The number of bytes hashed at a time by hash_file
+HASH_CHUNK_SIZE = 64*1024
+
+def hash_file(file_object, algorithm='sha256'):
+    """
+    Returns the hex digest of the whole file and rewinds it. The algorithm
+    can be anything hashlib supports or one of the much faster, but not
+    cryptographic, ``crc32`` and ``adler32`` checksums. Files are hashed a
+    chunk at a time; memory maps are hashed in place.
+    """
+    file_object.seek(0)
+    if isinstance(file_object, mmap.mmap):
+        chunks = [file_object]
+    else:
+        chunks = iter(functools.partial(file_object.read, HASH_CHUNK_SIZE), '')
+
+    if algorithm in ('crc32', 'adler32'):
+        checksum = getattr(zlib, algorithm)
+        value = checksum('')
+        for chunk in chunks:
+            value = checksum(chunk, value)
+        filehash = "{0:08x}".format(value & 0xFFFFFFFF)
+    else:
+        digest = hashlib.new(algorithm)
+        for chunk in chunks:
+            digest.update(chunk)
+        filehash = digest.hexdigest()
+
+    file_object.seek(0)
+    return filehash
+
 def read_header(replay_file):
     # Extract useful header information from the MPQ files. This information
     # can be used to configure the rest of the program to correctly parse
     # the archived data files.
+    #
+    # Only the MPQ user data header and the data_size bytes of user data that
+    # follow it are read, not the rest of the file.
     replay_file.seek(0)
-    data = ReplayBuffer(replay_file)
+    data = ReplayBuffer(replay_file.read(16))
 
     # Sanity check that the input is in fact an MPQ file
-    if data.length==0 or data.read(4) != "MPQ\x1b":
+    if data.length!=16 or data.read(4) != "MPQ\x1b":
         msg = "File '{}' is not an MPQ file";
         raise exceptions.FileError(msg.format(getattr(replay_file, 'name', '<NOT AVAILABLE>')))
 
@@ -480,6 +1026,7 @@ def read_header(replay_file):
     data_size = data.read_int(LITTLE_ENDIAN)
 
     #array [unknown,version,major,minor,build,unknown] and frame count
+    data = ReplayBuffer(replay_file.read(data_size))
     header_data = data.read_data_struct()
     versions = header_data[1].values()
     frames = header_data[3]
@@ -495,6 +1042,27 @@ def merged_dict(a, b):
     c.update(b)
     return c
 
+@contextmanager
+def gc_paused():
+    # The garbage collector kicks in over and over while (un)pickling large
+    # object graphs without finding anything, hold it off until we're done.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def serialize(obj):
+    """Pickles loaded resources and reader output for another process or later use."""
+    with gc_paused():
+        return cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+
+def deserialize(contents):
+    with gc_paused():
+        return cPickle.loads(contents)
+
 def extension_filter(filename, extension):
     name, ext = os.path.splitext(filename)
     return ext.lower()[1:] == extension.lower()
@@ -566,8 +1134,9 @@ def get_unit(type_int):
     """
     # Try to parse a unit
     unit_code = ((type_int & 0xff) << 8) | 0x01
-    if unit_code in Data.units:
-        unit_name = Data.units[unit_code].name
+    units = load_build(22612).units
+    if unit_code in units:
+        unit_name = units[unit_code].name
     else:
         unit_name = "Unknown Unit ({0:X})".format(type_int)
 
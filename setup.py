@@ -37,7 +37,7 @@ setuptools.setup(
     },
     install_requires=['mpyq','argparse'] if float(sys.version[:3]) < 2.7 else ['mpyq'],
     packages=['sc2reader', 'sc2reader.scripts', 'sc2reader.plugins', 'sc2reader.data'],
-    package_data={'sc2reader.data': ['*.csv']},
+    package_data={'sc2reader.data': ['*.csv', '*.datapack']},
     include_package_data=True,
     zip_safe=True
 )
@@ -0,0 +1,115 @@
+# Encoding: UTF-8
+
+# Microbenchmark for the ReplayBuffer bit reader. Decodes the replay.game.events
+# file of every bundled replay with both the ReplayBuffer and the original
+# StringIOReplayBuffer from legacy_buffer.py and reports the time taken by each.
+#
+# The ReplayBuffer indexes bytes out of a bytearray where the original read
+# them one at a time from a StringIO; it does not buffer whole words between
+# reads. Expect a modest gain, around 1.1x on decoding and 1.2x on reads.
+#
+# Two numbers are given per reader: "decode" is the full game event decoding,
+# events and all, and "reads" replays just the buffer calls that decoding
+# made, which is the part of the work the bit reader is responsible for.
+# The garbage collector is paused while timing since it costs the same for
+# every reader and otherwise swamps the difference.
+#
+# Run with "python test_replays/bench_buffer.py [repeat]" in the project root dir
+import os, sys
+import glob
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),"../")))
+
+import sc2reader
+from sc2reader import utils
+from sc2reader.exceptions import SC2ReaderError
+
+from legacy_buffer import StringIOReplayBuffer
+
+BUFFERS = [StringIOReplayBuffer, utils.ReplayBuffer]
+READ_METHODS = ['read', 'read_bits', 'read_byte', 'read_short', 'read_int', 'read_bytes', 'read_string',
+                'read_timestamp', 'byte_align', 'skip', 'skip_bits']
+
+
+class TracingBuffer(utils.ReplayBuffer):
+    """Records every read call made against it so they can be replayed."""
+    def __init__(self, source):
+        utils.ReplayBuffer.__init__(self, source)
+        self.trace = list()
+        for name in READ_METHODS:
+            setattr(self, name, self._tracer(name, getattr(self, name)))
+
+    def _tracer(self, name, method):
+        # Reads made from within another read are covered by the outer call
+        trace, depth = self.trace, [0]
+        def traced(*args):
+            if not depth[0]:
+                trace.append((name, args))
+            depth[0] += 1
+            try:
+                return method(*args)
+            finally:
+                depth[0] -= 1
+        return traced
+
+
+def decode(buffer_cls, data, reader, replay):
+    start = time.time()
+    events = reader(buffer_cls(data), replay)
+    return time.time()-start, len(events)
+
+
+def reads(buffer_cls, data, trace):
+    buffer = buffer_cls(data)
+    calls = [(getattr(buffer, name), args) for name, args in trace]
+    start = time.time()
+    for method, args in calls:
+        method(*args)
+    return time.time()-start
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    base = os.path.dirname(os.path.abspath(__file__))
+
+    totals = dict((cls, [0.0, 0.0]) for cls in BUFFERS)
+    event_count = 0
+    for build_dir in sorted(glob.glob(os.path.join(base, '*', ''))):
+        build_totals = dict((cls, [0.0, 0.0]) for cls in BUFFERS)
+        build_events = 0
+        for path in sorted(glob.glob(os.path.join(build_dir, '*.SC2Replay'))):
+            try:
+                replay = sc2reader.load_replay(path, load_level=1)
+                reader = replay._get_reader('replay.game.events')
+                data = utils.extract_data_file('replay.game.events', replay.archive)
+                tracer = TracingBuffer(data)
+                reader(tracer, replay)
+            except SC2ReaderError:
+                continue
+
+            with utils.gc_paused():
+                for cls in BUFFERS:
+                    # Best of N to keep noise out of the comparison
+                    elapsed, events = min(decode(cls, data, reader, replay) for i in range(repeat))
+                    build_totals[cls][0] += elapsed
+                    build_totals[cls][1] += min(reads(cls, data, tracer.trace) for i in range(repeat))
+            build_events += events
+
+        if build_events:
+            print "{0:<16} {1:>8} events  {2}".format(os.path.basename(build_dir.rstrip(os.sep)), build_events,
+                '  '.join("{0}: {1:.3f}s/{2:.3f}s".format(cls.__name__, *build_totals[cls]) for cls in BUFFERS))
+            for cls in BUFFERS:
+                totals[cls][0] += build_totals[cls][0]
+                totals[cls][1] += build_totals[cls][1]
+            event_count += build_events
+
+    print
+    for cls in BUFFERS:
+        decode_time, read_time = totals[cls]
+        print "{0:<22} decode {1:.3f}s  reads {2:.3f}s  {3:>10.0f} events/sec".format(cls.__name__, decode_time, read_time, event_count/decode_time)
+    old, new = totals[BUFFERS[0]], totals[BUFFERS[-1]]
+    print "Speedup: decode {0:.2f}x  reads {1:.2f}x".format(old[0]/new[0], old[1]/new[1])
+
+if __name__ == '__main__':
+    main()
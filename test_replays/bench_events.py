@@ -0,0 +1,84 @@
+# Encoding: UTF-8
+
+# Memory benchmark for the event classes. Decodes the replay.game.events file
+# of every bundled replay, keeps all the events around and reports how many
+# bytes they take per event: both the size of everything reachable from the
+# events (objects shared between events are counted once) and the growth of
+# the process' resident memory.
+#
+# Run with "python test_replays/bench_events.py" in the project root dir
+import os, sys
+import gc
+import glob
+import resource
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),"../")))
+
+import sc2reader
+from sc2reader import utils
+from sc2reader.exceptions import SC2ReaderError
+
+
+def rss():
+    # Current resident set size in bytes, falling back to the peak size
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1])*resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+def reachable_size(objects):
+    seen, size = set(), 0
+    pending = list(objects)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, (list, tuple, set)):
+            pending.extend(obj)
+        elif isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        else:
+            if hasattr(obj, '__dict__'):
+                pending.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    if hasattr(obj, slot):
+                        pending.append(getattr(obj, slot))
+    return size
+
+
+def main():
+    base = os.path.dirname(os.path.abspath(__file__))
+
+    # Read the files up front so they don't show up in the memory growth
+    files = list()
+    for path in sorted(glob.glob(os.path.join(base, '*', '*.SC2Replay'))):
+        try:
+            replay = sc2reader.load_replay(path, load_level=1)
+            reader = replay._get_reader('replay.game.events')
+            data = utils.extract_data_file('replay.game.events', replay.archive)
+            reader(utils.ReplayBuffer(data), replay)
+        except SC2ReaderError:
+            continue
+        files.append((data, reader, replay))
+
+    gc.collect()
+    start = rss()
+    events = list()
+    for data, reader, replay in files:
+        events.extend(reader(utils.ReplayBuffer(data), replay))
+    gc.collect()
+    grown = rss()-start
+
+    print "{0} events from {1} replays".format(len(events), len(files))
+    print "Reachable: {0:>8.1f} bytes/event".format(reachable_size(events)/float(len(events)))
+    print "RSS:       {0:>8.1f} bytes/event".format(grown/float(len(events)))
+
+if __name__ == '__main__':
+    main()
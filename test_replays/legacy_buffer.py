@@ -0,0 +1,222 @@
+# Encoding: UTF-8
+
+# The StringIO based bit reader sc2reader used before the ReplayBuffer was
+# rewritten. It is kept out of the package and only used by test_all.py and
+# bench_buffer.py to check and time the ReplayBuffer against.
+import os
+import struct
+from cStringIO import StringIO
+
+from sc2reader.utils import ReplayBuffer, LITTLE_ENDIAN, BIG_ENDIAN
+
+
+class StringIOReplayBuffer(ReplayBuffer):
+    """ The original ReplayBuffer implementation; a wrapper over a StringIO
+        object that reads the data one stream call at a time. Used as the
+        reference the :class:`sc2reader.utils.ReplayBuffer` is checked and
+        benchmarked against.
+    """
+
+    def __init__(self, source):
+        #Accept file like objects and string objects
+        if hasattr(source,'read'):
+            source = source.read()
+        self.istream = StringIO(source)
+
+        # Expose part of the interface
+        self.read = self.istream.read
+        self.seek = self.istream.seek
+        self.tell = self.istream.tell
+
+        # get length of stream
+        self.seek(0, os.SEEK_END)
+        self.length = self.istream.tell()
+        self.seek(0, os.SEEK_SET)
+
+        # helpers to deal with bit reads
+        self.bit_shift = 0
+        self.bit_buffer = None
+
+        # Extra optimization stuff
+        self.lo_masks = [0x00, 0x01, 0x03, 0x07, 0x0F, 0x1F, 0x3F, 0x7F, 0xFF]
+        self.hi_masks = [0xFF ^ mask for mask in self.lo_masks]
+        self.masks = zip(self.lo_masks, self.hi_masks)
+        self.temp_buffer = StringIO()
+
+    '''
+        Helper Functions
+    '''
+    @property
+    def is_empty(self):
+        return self.tell() == self.length
+
+    def bytes_left(self):
+        return self.length - self.tell()
+
+    def byte_align(self):
+        self.bit_shift=0
+
+    def reset(self):
+        self.bit_shift=0
+        self.seek(0, os.SEEK_SET)
+
+    def skip(self, bytes):
+        self.seek(bytes-1, os.SEEK_CUR)
+        self.bit_buffer = ord(self.read(1))
+
+    def skip_bits(self, bits):
+        while bits > 32:
+            self.read_bits(32)
+            bits -= 32
+        self.read_bits(bits)
+
+    def read_data_struct(self, schema=None):
+        value = self.trace_data_struct()
+        return schema.convert(value) if schema else value
+
+    def read_range(self, start, end):
+        cur = self.tell()
+        self.seek(start, os.SEEK_SET)
+        bytes = self.read(end-start)
+        self.seek(cur, os.SEEK_SET)
+        return bytes
+
+    def peek(self, length):
+        cur = self.tell()
+        bytes = self.read(length)
+        self.istream.seek(cur, os.SEEK_SET)
+        return bytes
+
+    '''
+        Optimized bit-shift aware read methods
+    '''
+    def read_byte(self):
+        #if self.bytes_left() == 0:
+        #    raise EOFError("Cannot read byte; no bytes remaining")
+
+        if self.bit_shift==0:
+            return ord(self.read(1))
+        else:
+            lo_mask, hi_mask = self.masks[self.bit_shift]
+            hi_bits = self.bit_buffer & hi_mask
+            self.bit_buffer = ord(self.read(1))
+            lo_bits = self.bit_buffer & lo_mask
+            return hi_bits | lo_bits
+
+    def read_short(self, endian=LITTLE_ENDIAN):
+        #if self.bytes_left() < 2:
+        #    raise EOFError("Cannot read short; only {} bytes left in buffer".format(self.left))
+
+        if self.bit_shift == 0:
+            return struct.unpack(endian+'H', self.read(2))[0]
+
+        else:
+            lo_mask, hi_mask = self.masks[self.bit_shift]
+            block = struct.unpack('>H', self.read(2))[0]
+            number = (self.bit_buffer & hi_mask) << 8 | (block & 0xFF00) >> (8-self.bit_shift) | (block & lo_mask)
+            self.bit_buffer = block & 0xFF
+            if endian == LITTLE_ENDIAN:
+                number = (number & 0xFF00) >> 8 | (number & 0xFF) << 8
+
+            return number
+
+    def read_int(self, endian=LITTLE_ENDIAN):
+        #if self.bytes_left() < 4:
+        #    raise EOFError("Cannot read int; only {} bytes left in buffer".format(self.left))
+
+        if self.bit_shift == 0:
+            return struct.unpack(endian+'I', self.read(4))[0]
+
+        else:
+            lo_mask, hi_mask = self.masks[self.bit_shift]
+            block = struct.unpack('>I', self.read(4))[0]
+            number = (self.bit_buffer & hi_mask) << 24 | (block & 0xFFFFFF00) >> (8-self.bit_shift) | (block & lo_mask)
+            self.bit_buffer = block & 0xFF
+            if endian == LITTLE_ENDIAN:
+                number = (number & 0xFF000000) >> 24 | (number & 0xFF0000) >> 8 | (number & 0xFF00) << 8 | (number & 0xFF) << 24
+
+            return number
+
+    def read_bits(self, bits):
+        #if self.bytes_left()*8 < bits-(8-self.bit_shift):
+        #    raise EOFError("Cannot read {} bits. only {} bits left in buffer.".format(bits, (self.length-self.tell()+1)*8-self.bit_shift))
+        bit_shift = self.bit_shift
+        if bit_shift!=0:
+            bits_left = 8-bit_shift
+
+            # Read it all and continue
+            if bits_left < bits:
+                bits -= bits_left
+                result = (self.bit_buffer >> bit_shift) << bits
+
+            # Read part and return
+            elif bits_left > bits:
+                self.bit_shift+=bits
+                return (self.bit_buffer >> bit_shift) & self.lo_masks[bits]
+
+            # Read all and return
+            else:
+                self.bit_shift = 0
+                return self.bit_buffer >> bit_shift
+
+        else:
+            result = 0
+
+        if bits >= 8:
+            bytes = bits/8
+
+            if bytes == 1:
+                bits -= 8
+                result |= ord(self.read(1)) << bits
+
+            elif bytes == 2:
+                bits -= 16
+                result |= struct.unpack(">H",self.read(2))[0] << bits
+
+            elif bytes == 4:
+                bits -= 32
+                result |= struct.unpack(">I",self.read(4))[0] << bits
+
+            else:
+                for byte in struct.unpack("B"*bytes, self.read(bytes)):
+                    bits -= 8
+                    result |= byte << bits
+
+        if bits != 0:
+            self.bit_buffer = ord(self.read(1))
+            result |= self.bit_buffer & self.lo_masks[bits]
+
+        self.bit_shift = bits
+        return result
+
+    def read_bytes(self, bytes):
+        #if self.bytes_left() < bytes:
+        #    raise EOFError("Cannot read {} bytes. only {} bytes left in buffer.".format(bytes, self.length-self.tell()))
+
+        if self.bit_shift==0:
+            return self.read(bytes)
+
+        else:
+            temp_buffer = self.temp_buffer
+            prev_byte = self.bit_buffer
+            lo_mask, hi_mask = self.masks[self.bit_shift]
+            for next_byte in struct.unpack("B"*bytes, self.read(bytes)):
+                temp_buffer.write(chr(prev_byte & hi_mask | next_byte & lo_mask))
+                prev_byte = next_byte
+
+            self.bit_buffer = prev_byte
+            final_bytes = temp_buffer.getvalue()
+            temp_buffer.truncate(0)
+            return final_bytes
+
+    def read_timestamp(self):
+        first = self.read_byte()
+        time,count = first >> 2, first & 0x03
+        if count == 0:
+            return time
+        elif count == 1:
+            return time << 8 | self.read_byte()
+        elif count == 2:
+            return time << 16 | self.read_short(BIG_ENDIAN)
+        elif count == 3:
+            return time << 24 | self.read_short(BIG_ENDIAN) << 8 | self.read_byte()
@@ -177,3 +177,760 @@ def test_datetimes():
     # Played at 25 Feb 2011 16:36:28 UTC+2
     replay = sc2reader.read_file("test_replays/1.2.2.17811/3.SC2Replay")
     assert replay.utc_date == datetime.datetime(2011, 2, 25, 14, 36, 26)
+
+def test_replay_buffer():
+    # The ReplayBuffer must decode exactly like the original
+    # StringIO implementation, whatever the alignment of the reads.
+    import random
+    from sc2reader.utils import ReplayBuffer, BIG_ENDIAN, LITTLE_ENDIAN
+    from legacy_buffer import StringIOReplayBuffer
+
+    rng = random.Random(2012)
+    for trial in range(200):
+        data = ''.join(chr(rng.randint(0,255)) for i in range(rng.randint(20,200)))
+        new, old = ReplayBuffer(data), StringIOReplayBuffer(data)
+        while new.bytes_left() > 16:
+            op = rng.choice(['bits','byte','short','int','bytes','timestamp','align'])
+            if op == 'bits':
+                count = rng.choice([1,3,5,8,9,16,20,32,33,64])
+                assert new.read_bits(count) == old.read_bits(count)
+            elif op == 'byte':
+                assert new.read_byte() == old.read_byte()
+            elif op == 'short':
+                endian = rng.choice([BIG_ENDIAN,LITTLE_ENDIAN])
+                assert new.read_short(endian) == old.read_short(endian)
+            elif op == 'int':
+                endian = rng.choice([BIG_ENDIAN,LITTLE_ENDIAN])
+                assert new.read_int(endian) == old.read_int(endian)
+            elif op == 'bytes':
+                count = rng.randint(1,6)
+                assert new.read_bytes(count) == old.read_bytes(count)
+            elif op == 'timestamp':
+                assert new.read_timestamp() == old.read_timestamp()
+            else:
+                new.byte_align()
+                old.byte_align()
+            assert new.tell() == old.tell() and new.bit_shift == old.bit_shift
+
+    buffer = ReplayBuffer('\x01\x02')
+    buffer.read_bits(4)
+    with pytest.raises(EOFError):
+        buffer.read_bits(16)
+
+def test_parallel_load():
+    from sc2reader.factories import SC2Factory, LoadFailure
+    from sc2reader.exceptions import ReadError
+    from sc2reader.plugins.replay import APMTracker
+
+    factory = SC2Factory()
+    factory.register_plugin('Replay', APMTracker())
+    sources = [
+        "test_replays/1.2.2.17811/1.SC2Replay",
+        "test_replays/1.0.1.16195/Froadac_vs_Bunnies_5770.SC2Replay",
+        "test_replays/1.2.2.17811/2.SC2Replay",
+    ]
+
+    replays = list(factory.load_replays(sources, workers=2))
+    assert [replay.filename for replay in replays] == sources
+
+    # Read errors come back in place instead of stopping the batch
+    assert isinstance(replays[1], LoadFailure)
+    assert replays[1].error is ReadError
+
+    # Plugins run in the workers
+    serial = factory.load_replay(sources[0])
+    assert replays[0].players[0].apm == serial.players[0].apm
+    assert [str(event) for event in replays[0].events] == [str(event) for event in serial.events]
+    assert replays[0].factory is factory
+
+    unordered = list(factory.load_replays(sources, workers=2, ordered=False))
+    assert sorted(replay.filename for replay in unordered) == sorted(sources)
+
+def test_cache(tmpdir):
+    from sc2reader import utils
+    from sc2reader.events import GameEvent
+    from sc2reader.factories import SC2Cache
+
+    path = "test_replays/1.2.2.17811/1.SC2Replay"
+    cache = SC2Cache(str(tmpdir.join('cache.db')))
+    replay = cache.load_replay(path)
+    assert len(cache.cache) == 1
+
+    # The second load is rebuilt from the cache without the archive
+    cached = cache.load_replay(path)
+    assert cached.archive is None
+    assert cached.filehash == replay.filehash
+    assert cached.map_hash == replay.map_hash
+    assert [player.name for player in cached.players] == [player.name for player in replay.players]
+    assert [(event.frame, event.name) for event in cached.events] == [(event.frame, event.name) for event in replay.events]
+
+    # Different load levels are cached separately
+    cache.load_replay(path, load_level=2)
+    assert len(cache.cache) == 2
+
+    # Game events that weren't cached are read from the archive when needed
+    cached = cache.load_replay(path, load_level=2)
+    assert cached.archive is None
+    assert [(event.frame, event.name) for event in cached.iter_events()] == [(event.frame, event.name) for event in replay.events]
+    assert cached.archive is not None
+
+    # As they are for unpickled replays
+    cached = utils.deserialize(utils.serialize(cache.load_replay(path, load_level=2)))
+    assert len(cached.game_events()) == len([event for event in replay.events if isinstance(event, GameEvent)])
+
+    # Least recently used replays are evicted to stay under the size limit
+    cache.cache.max_size = 1
+    cache.load_replay("test_replays/1.2.2.17811/2.SC2Replay")
+    assert len(cache.cache) == 1
+
+def test_lazy_load():
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", lazy=True)
+    assert replay.raw_data == {}
+
+    # Metadata only reads the details
+    assert replay.map_name == "Lost Temple"
+    assert replay.speed == "Faster"
+    assert 'replay.details' in replay.raw_data
+    assert 'replay.game.events' not in replay.raw_data
+
+    assert replay.person[1].name == "Emperor"
+    assert 'replay.message.events' in replay.raw_data
+    assert 'replay.game.events' not in replay.raw_data
+
+    eager = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+    assert [(event.frame, event.name) for event in replay.events] == [(event.frame, event.name) for event in eager.events]
+    assert len(replay.person[1].events) == len(eager.person[1].events)
+
+def test_lazy_default():
+    # The winner is never set when the result is unknown, the class level
+    # default must be returned rather than an AttributeError.
+    path = "test_replays/1.1.0.16561/3v3_Dig Site_11014.SC2Replay"
+    assert sc2reader.load_replay(path).winner is None
+    assert sc2reader.load_replay(path, lazy=True).winner is None
+
+def test_iter_events():
+    from sc2reader.events import AbilityEvent
+    eager = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", load_level=2)
+    assert [(event.frame, event.name) for event in replay.iter_events()] == [(event.frame, event.name) for event in eager.events]
+    assert 'replay.game.events' not in replay.raw_data
+    assert not replay.person[1].events
+
+    abilities = [(event.frame, event.name) for event in eager.events if isinstance(event, AbilityEvent) and event.pid == 1]
+    assert [(event.frame, event.name) for event in replay.iter_events(types=[AbilityEvent], pids=[1])] == abilities
+    assert [(event.frame, event.name) for event in eager.iter_events(types=[AbilityEvent], pids=[1])] == abilities
+
+def test_event_types():
+    from sc2reader.events import AbilityEvent, CameraEvent, GameEvent, SelectionEvent
+    eager = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", event_types=[AbilityEvent, SelectionEvent])
+    assert not [event for event in replay.events if isinstance(event, CameraEvent)]
+
+    wanted = lambda event: not isinstance(event, GameEvent) or isinstance(event, (AbilityEvent, SelectionEvent))
+    assert [(event.frame, event.name) for event in replay.events] == [(event.frame, event.name) for event in eager.events if wanted(event)]
+
+def test_event_table():
+    numpy = pytest.importorskip("numpy")
+    from sc2reader.events import GameEvent
+    eager = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+    game_events = [event for event in eager.events if isinstance(event, GameEvent)]
+
+    table = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", load_level=1).event_table()
+    assert len(table) == len(game_events)
+    assert list(table.frame) == [event.frame for event in game_events]
+    assert list(table.name) == [event.name for event in game_events]
+
+    abilities = table.ability_code >= 0
+    assert list(table.ability_code[abilities]) == [event.ability_code for event in game_events if hasattr(event, 'ability_code')]
+    assert numpy.isnan(table.x[~abilities & (table.name != 'CameraEvent')]).all()
+
+    selections = [event for event in game_events if event.name == 'SelectionEvent']
+    assert len(table.selections.unit_id) == sum(len(event.raw_objects) for event in selections)
+    assert set(table.name[table.selections.event]) == set(['SelectionEvent'])
+
+    # Tables filled in by the reader match those converted from loaded events
+    converted = eager.event_table(pids=[1])
+    decoded = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", load_level=1).event_table(pids=[1])
+    assert len(converted) and len(converted) < len(table)
+    for column, dtype in table.columns:
+        numpy.testing.assert_array_equal(getattr(converted, column), getattr(decoded, column))
+    numpy.testing.assert_array_equal(converted.selections.unit_id, decoded.selections.unit_id)
+
+def test_event_slots():
+    import pickle
+    from sc2reader.events import GameEvent
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+    event = [event for event in replay.events if isinstance(event, GameEvent)][-1]
+    assert not hasattr(event, '__dict__')
+    assert event.second == event.frame >> 4
+    assert event.time.seconds == event.second
+    assert event.is_local and event.is_player_action == (event.type >> 4 == 1)
+
+    copy = pickle.loads(pickle.dumps(event, pickle.HIGHEST_PROTOCOL))
+    assert (copy.frame, copy.pid, copy.type, copy.player.name) == (event.frame, event.pid, event.type, event.player.name)
+
+def test_reader_registry():
+    from sc2reader import readers
+    from sc2reader.utils import BuildRegistry
+    registry = BuildRegistry()
+    registry.register('replay.details', 'base', end=22612)
+    registry.register('replay.details', 'wol', start=22612, expansion='WoL')
+    registry.register('replay.details', 'hots', expansion='HotS')
+    assert registry.get('replay.details', 17811, 'WoL') == 'base'
+    assert registry.get('replay.details', 22612, 'WoL') == 'wol'
+    assert registry.get('replay.details', 23925, 'HotS') == 'hots'
+    assert registry.get('replay.game.events', 17811, 'WoL') is None
+    with pytest.raises(ValueError):
+        registry.register('replay.details', 'overlap', start=20000, end=23000)
+
+    # Factory readers take preference over the shared defaults
+    class Reader(readers.DetailsReader_Base):
+        calls = 0
+        def __call__(self, data, replay):
+            Reader.calls += 1
+            return super(Reader, self).__call__(data, replay)
+
+    factory = sc2reader.factories.SC2Factory()
+    factory.register_reader('replay.details', Reader(), lambda r: r.build < 22612)
+    replay = factory.load_replay("test_replays/1.2.2.17811/1.SC2Replay", load_level=1)
+    assert Reader.calls == 1 and replay.map_name == "Lost Temple"
+    assert isinstance(replay._get_reader('replay.game.events'), readers.GameEventsReader_16561)
+
+    # Replay subclasses can still override the defaults
+    class CustomReplay(sc2reader.resources.Replay):
+        def register_default_readers(self):
+            super(CustomReplay, self).register_default_readers()
+            self.default_readers['replay.details'] = Reader()
+
+        def register_default_datapacks(self):
+            self.default_datapack_id = 22612
+
+    replay = CustomReplay(open("test_replays/1.2.2.17811/1.SC2Replay", 'rb'), load_level=1)
+    assert Reader.calls == 2 and replay.map_name == "Lost Temple"
+    assert replay.datapack.id == 22612
+
+def test_bench():
+    import json
+    from sc2reader import bench
+    results = json.loads(json.dumps(bench.bench(["test_replays/1.2.2.17811/1.SC2Replay"])))
+    build = results['builds']['1.2.2.17811']
+    assert build['replays'] == 1 and build['events'] > 0
+    assert set(['open_archive', 'read_header', 'read:replay.details', 'load_players', 'load_events', 'plugin:SelectionTracker']) <= set(build['stages'])
+    assert build['stages']['read:replay.game.events']['events_per_sec'] > 0
+    assert 'rss_growth_kb' in build['stages']['load_events']
+    assert results['total']['replays'] == 1
+
+def test_scan_headers():
+    headers = list(sc2reader.scan_headers("test_replays/1.2.2.17811"))
+    assert len(headers) == 14
+    for header in headers:
+        replay = sc2reader.load_replay(header.filename, load_level=0)
+        assert (header.build, header.release_string, header.expansion, header.frames, header.length) == (replay.build, replay.release_string, replay.expansion, replay.frames, replay.length)
+
+    with open("test_replays/1.2.2.17811/1.SC2Replay", 'rb') as replay_file:
+        header = next(sc2reader.scan_headers([replay_file]))
+    assert header.release_string == "1.2.2.17811"
+
+def test_mmap_load():
+    import mmap
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", mmap=True)
+    eager = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+    assert isinstance(replay.archive.file, mmap.mmap)
+    assert replay.filehash == eager.filehash
+    assert [(event.frame, event.name) for event in replay.events] == [(event.frame, event.name) for event in eager.events]
+
+def test_hash_algorithm():
+    import hashlib, zlib
+    with open("test_replays/1.2.2.17811/1.SC2Replay", 'rb') as replay_file:
+        contents = replay_file.read()
+
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", load_level=0)
+    assert replay.filehash == hashlib.sha256(contents).hexdigest()
+    assert replay.hash_time > 0
+
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", load_level=0, hash_algorithm='crc32')
+    assert replay.filehash == "{0:08x}".format(zlib.crc32(contents) & 0xFFFFFFFF)
+
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", load_level=0, hash_algorithm=None)
+    assert replay.filehash is None and replay.hash_time == 0
+
+def test_map_cache(tmpdir):
+    from sc2reader.factories import SC2Factory, DepotMirror
+    from sc2reader.objects import DepotFile
+
+    # No maps are bundled so a replay archive stands in for the s2ma file
+    class DepotFactory(SC2Factory):
+        downloads = 0
+        def load_remote_resource_contents(self, resource, **options):
+            self.downloads += 1
+            with open("test_replays/1.2.2.17811/1.SC2Replay", 'rb') as map_file:
+                return map_file.read()
+
+    factory = DepotFactory(map_cache_path=str(tmpdir))
+    replay = factory.load_replay("test_replays/1.2.2.17811/1.SC2Replay", load_map=True)
+    assert replay.map.hash == replay.map_file.hash
+    assert factory.load_replay("test_replays/1.2.2.17811/1.SC2Replay", load_map=True).map is replay.map
+    assert (factory.downloads, factory.map_cache.hits, factory.map_cache.misses) == (1, 1, 1)
+
+    # A new factory picks the stored map up from disk
+    factory = DepotFactory(map_cache_path=str(tmpdir))
+    depot_file = DepotFile('s2ma\x00\x00US'+'\xab'*32)
+    factory.load_map(replay.map_file)
+    assert (factory.downloads, factory.map_cache.disk_hits) == (0, 1)
+    factory.load_map(depot_file)
+    assert factory.downloads == 1 and len(factory.map_cache) == 2
+
+    # Stored maps are laid out as a depot mirror
+    mirror = DepotMirror(str(tmpdir), offline=True)
+    assert mirror.read(depot_file) == mirror.read(replay.map_file) is not None
+
+def test_depot_mirror(tmpdir):
+    from sc2reader.factories import SC2Factory, DepotMirror
+    from sc2reader.objects import DepotFile
+    from sc2reader.exceptions import FileError
+
+    with open("test_replays/1.2.2.17811/1.SC2Replay", 'rb') as map_file:
+        contents = map_file.read()
+    depot_file = DepotFile('s2ma\x00\x00US'+'\xab'*32)
+    assert DepotFile.from_url(depot_file.url).url == depot_file.url
+
+    downloads = list()
+    mirror = DepotMirror(str(tmpdir))
+    assert mirror.resolve(depot_file, lambda url: downloads.append(url) or contents) == contents
+    assert mirror.resolve(depot_file, downloads.append) == contents
+    assert downloads == [depot_file.url]
+    assert tmpdir.join('ab', 'ab'*32+'.s2ma').check()
+
+    # Offline factories load urls and depot files from the mirror alone
+    factory = SC2Factory(depot_resolver=DepotMirror(str(tmpdir), offline=True))
+    assert factory.load_map(depot_file.url).filename == depot_file.url
+    assert factory.load_map(depot_file).hash == depot_file.hash
+    with pytest.raises(FileError):
+        factory.load_map(DepotFile('s2ma\x00\x00US'+'\xcd'*32))
+
+def test_depot_fetcher():
+    import threading, time, urllib2
+    import BaseHTTPServer, SocketServer
+    from sc2reader.factories import SC2Factory, DepotResolver
+    from sc2reader.objects import DepotFile
+
+    # A stand-in depot server which is slow to answer, fails each file's
+    # first request and doesn't have the 0xdd files at all
+    requests = list()
+    active = [0, 0]
+    class DepotHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            active[0] += 1
+            active[1] = max(active)
+            time.sleep(0.1)
+            active[0] -= 1
+            if self.path.startswith('/dd'):
+                self.send_error(404)
+            elif requests.count(self.path) == 1:
+                self.send_error(500)
+            else:
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write('<Locale><e id="1">{0}</e></Locale>'.format(self.path[1:3]))
+        def log_message(self, *args):
+            pass
+
+    class DepotServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = DepotServer(('127.0.0.1', 0), DepotHandler)
+    threading.Thread(target=server.serve_forever).start()
+
+    class LocalDepot(DepotResolver):
+        def resolve(self, depot_file, download):
+            return download("http://127.0.0.1:{0}/{1}.{2}".format(server.server_port, depot_file.hash, depot_file.type))
+
+    try:
+        factory = SC2Factory(depot_resolver=LocalDepot())
+        factory.depot_fetcher.retry_delay = 0
+        files = [DepotFile('s2ml\x00\x00US'+chr(byte)*32) for byte in (0xaa, 0xbb, 0xcc, 0xaa)]
+        sheets = list(factory.load_localizations(files))
+
+        # Missing files aren't requested again
+        missing = [DepotFile('s2ml\x00\x00US'+chr(0xdd)*31+chr(byte)) for byte in (1, 2)]
+        with pytest.raises(urllib2.HTTPError):
+            list(factory.load_localizations(missing))
+        pool = factory.depot_fetcher.pool
+        factory.close()
+    finally:
+        server.shutdown()
+
+    assert [sheet[1] for sheet in sheets] == ['aa', 'bb', 'cc', 'aa']
+    assert sheets[0].filename == files[0].url
+    assert len([path for path in requests if not path.startswith('/dd')]) == 6 and active[1] > 1
+    assert sorted(path for path in requests if path.startswith('/dd')) == sorted('/'+hashed.hash+'.s2ml' for hashed in missing)
+    assert factory.depot_fetcher._pool is None
+    assert not any(worker.is_alive() for worker in pool._pool)
+
+def test_data_struct():
+    from cStringIO import StringIO
+    from sc2reader.utils import ReplayBuffer
+
+    # A dict of: a list with a string, a negative and a large int; a flagged
+    # and an unflagged optional; a skipped header array; 4 raw bytes; a byte
+    # and a missing value.
+    data = ('\x05\x0e'
+            '\x00\x00\x06\x02\x06abc\x09\x05\x09\x80\x01'
+            '\x02\x04\x01\x06\x07'
+            '\x04\x04\x00'
+            '\x06\x01\xff\xff\x04\x09\x02\x09\x02'
+            '\x08\x07SC2\x00'
+            '\x0a\x06\x2a'
+            '\x0c\x03\x00\x04\x04')
+    expected = {0: ['abc', -2, 64], 1: 7, 2: 0, 3: [1, 1], 4: 'SC2\x00', 5: 42, 6: 0}
+    assert ReplayBuffer(data).read_data_struct() == expected
+
+    out = StringIO()
+    assert ReplayBuffer(data).trace_data_struct(out) == expected
+    assert len(out.getvalue().splitlines()) == 14
+
+    for bad_data in (data[:-6], '\x05\x02\x00\x02\x10ab'):
+        with pytest.raises(EOFError):
+            ReplayBuffer(bad_data).read_data_struct()
+    with pytest.raises(TypeError):
+        ReplayBuffer('\x00\x02\x08').read_data_struct()
+
+def encode_struct(value):
+    # Serializes lists, dicts, strings and non-negative ints as a Blizzard
+    # data structure
+    def variable_int(value):
+        value, encoded = value << 1, ''
+        while value > 0x7F:
+            encoded += chr(value & 0x7F | 0x80)
+            value >>= 7
+        return encoded+chr(value)
+
+    if isinstance(value, dict):
+        return '\x05'+chr(len(value)*2)+''.join(chr(key*2)+encode_struct(item) for key, item in sorted(value.items()))
+    elif isinstance(value, list):
+        return '\x00'+variable_int(len(value))+''.join(encode_struct(item) for item in value)
+    elif isinstance(value, str):
+        return '\x02'+chr(len(value)*2)+value
+    else:
+        return '\x09'+variable_int(value)
+
+def test_struct_schema():
+    from collections import namedtuple
+    from sc2reader.utils import ReplayBuffer, StructList, StructDict, StructRecord
+    from legacy_buffer import StringIOReplayBuffer
+
+    Point = namedtuple('Point', ['x', 'y'])
+    points = [{0: 1, 1: 2, 2: {0: ['skipped']}}, {1: 3}, 'not a record', {}]
+    value = {0: 'name', 1: points, 3: {0: 4, 2: 5}}
+    data = encode_struct(value)+encode_struct(6)
+
+    schema = StructDict(fields={1: StructList(StructRecord(Point)), 3: StructRecord(Point, keys=[2, 0])})
+    expected = {0: 'name', 1: [Point(1, 2), Point(None, 3), 'not a record', Point(None, None)], 3: Point(5, 4)}
+    for buffer_cls in (ReplayBuffer, StringIOReplayBuffer):
+        buffer = buffer_cls(data)
+        assert buffer.read_struct(schema) == expected
+        assert buffer.read_data_struct() == 6
+    assert schema.convert(value) == expected
+
+    # Schemas for the wrong kind of value are ignored
+    assert ReplayBuffer(data).read_struct(StructList(StructRecord(Point))) == value
+
+    buffer = ReplayBuffer(data)
+    buffer.skip_data_struct()
+    assert buffer.read_data_struct() == 6
+
+    # Records with an extra field keep the values of the keys they don't list
+    Named = namedtuple('Named', ['name', 'points', 'extra'])
+    schema = StructRecord(Named, {1: StructList(StructRecord(Point, keys=[0], extra=True))}, extra=True)
+    expected = Named('name', [Point(1, {1: 2, 2: {0: ['skipped']}}), Point(None, {1: 3}), 'not a record', Point(None, {})], {3: {0: 4, 2: 5}})
+    for buffer_cls in (ReplayBuffer, StringIOReplayBuffer):
+        assert buffer_cls(data).read_struct(schema) == expected
+    assert schema.convert(value) == expected
+
+def test_game_summary_sections(tmpdir):
+    import zlib
+    from cStringIO import StringIO
+    from sc2reader.factories import SC2Factory, DepotMirror
+    from sc2reader.exceptions import FileError
+    from sc2reader.objects import DepotFile, SummaryDetails, SummaryPlayer, SummaryItem, SummaryEntry
+    from sc2reader.resources import SUMMARY_PARTS
+
+    # A made up summary of a game won by player 0 with its slot 2 closed
+    players = [
+        {0: {0: 0, 1: {0: {2: 1, 3: 1001}, 1: {}}}, 1: {0: 0}, 2: 'Terr'},
+        {0: {0: 1, 1: {0: {2: 1, 3: 1002}, 1: {}}}, 1: {0: 1}, 2: 'Zerg'},
+        {0: {0: 2, 1: 0}, 1: 0, 2: ''},
+    ]
+    sheet_bytes = 's2ml\x00\x00US'+'\xab'*32
+    sheet = DepotFile(sheet_bytes)
+    details = {0: {1: 'Fasr'}, 3: players, 5: [], 6: {7: [], 8: [['enUS', [sheet_bytes]]]}, 7: 840, 8: 1350000000, 9: 'unknown'}
+    mappings = {0: [{0: 1, 1: {0: 999, 1: 5}, 2: [{1: 0, 2: 1}]}]}
+    stats = {0: [
+        {0: {0: 999, 1: 5}, 1: [[{0: 1, 1: 0, 2: 2, 3: 'unknown'}], []]},
+        {0: {0: 999, 1: 6}, 1: [[{0: 10, 1: 0, 2: 60}, {0: 20, 1: 0, 2: 120}], []]},
+        {0: {0: 999, 1: 7}, 1: [[{0: 3, 1: 0, 2: 60}], []]},
+    ]}
+    parts = [details, mappings, {0: []}, {0: []}, stats]
+    contents = '\x00'*16+zlib.compress(''.join(encode_struct(part) for part in parts))
+
+    # The sheets aren't in the mirror so fetching them would fail
+    mirror = DepotMirror(str(tmpdir), offline=True)
+    factory = SC2Factory(depot_resolver=mirror)
+    summary = factory.load_game_summary(StringIO(contents), sections=['results'])
+    assert summary.winners == [0]
+    assert summary.game_speed == 'Faster' and summary.game_length.seconds == 840
+    assert summary.parts == [SUMMARY_PARTS[0].convert(details), None, None, None]
+    with pytest.raises(FileError):
+        summary.lang_sheets
+
+    # Parts are read into records which keep the values of unnamed keys
+    assert summary.parts[0].players[1] == SummaryPlayer({0: 1, 1: {0: {2: 1, 3: 1002}, 1: {}}}, {0: 1}, 'Zerg', {})
+    assert summary.parts[0].extra == {9: 'unknown'}
+
+    mirror.store(sheet, '<Locale><e id="1">Resources</e></Locale>')
+    summary = factory.load_game_summary(StringIO(contents), sections=['stats'])
+    assert summary.parts[4][0][0] == SummaryItem({0: 999, 1: 5}, [[SummaryEntry(1, 0, 2, {3: 'unknown'})], []], {})
+    assert summary.player_stats[0]['Resources'] == 1
+    assert summary.player_stats[0]['Income Graph'].as_points() == [(60, 10), (120, 20)]
+    assert summary.player_stats[0]['Army Graph'].as_points() == [(60, 3)]
+
+def test_selection_mask():
+    from sc2reader.objects import SelectionMask
+    from sc2reader.plugins.utils import UnitSelection
+
+    flags = [True, False, False, True, False, False, False, False, False, True]
+    mask = SelectionMask.from_bytes('\x09\x02', 10)
+    assert mask == SelectionMask.from_list(flags)
+    assert list(mask) == flags and len(mask) == 10
+    assert mask[0] and mask[-1] and not mask[1] and mask[2:4] == [False, True]
+    assert mask.indexes() == [0, 3, 9]
+
+    for deselect in (mask, flags):
+        selection = UnitSelection(range(12))
+        assert selection.deselect(0x01, deselect)
+        assert selection.objects == [1, 2, 4, 5, 6, 7, 8, 10, 11]
+    selection = UnitSelection(range(5))
+    assert not selection.deselect(0x01, mask)
+    assert selection.objects == [1, 2, 4]
+
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+    masks = [event.deselect[1] for event in replay.events if getattr(event, 'deselect', (None,))[0] == 0x01]
+    assert masks and all(isinstance(mask, SelectionMask) for mask in masks)
+
+def test_player_selection_copy_on_write():
+    import pickle
+    from sc2reader.data import Unit
+    from sc2reader.plugins.utils import PlayerSelection
+
+    units = [Unit(unit_id) for unit_id in (5, 1, 9, 3)]
+    selection = PlayerSelection()
+    selection[0x0A].select(units[:2])
+    selection[1].select(units[2:])
+    selection[1].select(units[1:3])
+    assert [unit.id for unit in selection[1].objects] == [1, 3, 9]
+
+    copy = selection.copy()
+    assert dict.__getitem__(copy, 1) is dict.__getitem__(selection, 1)
+    copy[1].deselect(0x02, [0])
+    copy[0x0A].select(units[3:])
+    assert [unit.id for unit in copy[1].objects] == [3, 9]
+    assert [unit.id for unit in selection[1].objects] == [1, 3, 9]
+    assert [unit.id for unit in selection[0x0A].objects] == [1, 5]
+
+    # Selections handed out any other way are never shared either
+    def ids(selection):
+        return dict((bank, [unit.id for unit in units.objects]) for bank, units in dict.items(selection))
+    before = ids(selection)
+    for get in (lambda copy: copy.get(1), lambda copy: copy.values()[0],
+                lambda copy: dict(copy.items())[1], lambda copy: next(copy.itervalues()),
+                lambda copy: copy.setdefault(1), lambda copy: copy.pop(1)):
+        get(selection.copy()).select(units)
+    assert ids(selection) == before
+
+    # Pickled copies keep track of the banks they share
+    copies = pickle.loads(pickle.dumps([selection, selection.copy()], pickle.HIGHEST_PROTOCOL))
+    copies[1][1].select(units)
+    assert ids(copies[0]) == before
+
+def test_state_history():
+    from sc2reader.plugins.utils import StateHistory, GameState
+    from sc2reader.plugins.replay import SelectionTracker
+
+    history = StateHistory(dict(), dict.update, snapshot_interval=3)
+    for frame in range(0, 100, 10):
+        history.record(frame, dict(last=frame))
+        history.record(frame, {frame: True})
+    assert len(history.changes) == 20 and history.state['last'] == 90
+    assert history[5] == {'last': 0, 0: True}
+    for frame in (95, 42, 60, 0, 61, -1):
+        state = history[frame]
+        assert state.get('last') == (min(frame, 90)//10*10 if frame >= 0 else None)
+        assert len(state) == (min(frame, 90)//10+2 if frame >= 0 else 0)
+    history[42]['last'] = 'changed'
+    assert history[42]['last'] == 40
+    with pytest.raises(ValueError):
+        history.record(10, dict())
+
+    # Used like the GameState dictionary it replaced
+    assert history.keys() == range(0, 100, 10) and len(history) == 10
+    assert 40 in history and 42 not in history
+    assert dict(history.items())[40] == history[42]
+    history = StateHistory(dict(), dict.update)
+    for frame in (5, 5, 8):
+        history.record(frame, {frame: True})
+    assert history.keys() == [0, 5, 8] and len(history) == 3
+
+    # Game states keep their frames sorted whatever order they are set in
+    state = GameState(dict(unit=0))
+    for frame in (30, 10, 20, 10):
+        state[frame] = dict(unit=frame)
+    assert state._frames == [0, 10, 20, 30]
+    assert state[25] == dict(unit=20) and state._frames == [0, 10, 20, 25, 30]
+
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+    SelectionTracker(snapshot_interval=4)(replay)
+    person = replay.people[0]
+    selected = dict((event.frame, event.selected) for event in person.events if hasattr(event, 'selected'))
+    assert len(selected) > 100
+    for frame, units in selected.items():
+        assert person.selection[frame][0x0A].objects == units
+    assert person.selection.locked and set(person.selection.keys()) == set(selected) | set([0])
+    assert len(person.selection) == len(set(selected) | set([0]))
+    with pytest.raises(ValueError):
+        person.selection.record(replay.frames, None)
+
+def test_event_plugins():
+    from collections import defaultdict
+    from sc2reader.events import SelectionEvent
+    from sc2reader.plugins.utils import EventPlugin
+    from sc2reader.plugins.replay import APMTracker, SelectionTracker
+
+    calls, counts = list(), defaultdict(int)
+    class Counter(EventPlugin):
+        handles = (SelectionEvent,)
+        def start(self, replay):
+            calls.append(('start', self.options['name']))
+        def handle(self, event, replay):
+            counts[self.options['name']] += 1
+        def finish(self, replay):
+            calls.append(('finish', self.options['name']))
+
+    def plain(replay):
+        calls.append(('plain', None))
+
+    factory = sc2reader.factories.SC2Factory()
+    for plugin in (Counter(name='a'), APMTracker(), Counter(name='b'), plain, Counter(name='c'), SelectionTracker()):
+        factory.register_plugin('Replay', plugin)
+    replay = factory.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+
+    # The plugins before and after the plain plugin each share a pass
+    assert calls == [('start', 'a'), ('start', 'b'), ('finish', 'a'), ('finish', 'b'), ('plain', None), ('start', 'c'), ('finish', 'c')]
+    selections = len([event for event in replay.events if isinstance(event, SelectionEvent)])
+    assert counts == dict(a=selections, b=selections, c=selections)
+
+    player = replay.players[0]
+    apm, avg_apm = dict(player.apm), player.avg_apm
+    assert avg_apm > 0 and all(hasattr(person, 'selection') for person in replay.people)
+    APMTracker()(replay)
+    assert player.apm == apm and player.avg_apm == avg_apm
+
+def test_event_plugins_below_events(tmpdir):
+    from sc2reader.events import GameEvent
+    from sc2reader.factories import SC2Cache
+    from sc2reader.plugins.replay import APMTracker
+
+    path = "test_replays/1.2.2.17811/1.SC2Replay"
+    replay = sc2reader.load_replay(path, load_level=3)
+    APMTracker()(replay)
+    apm = dict((player.pid, player.avg_apm) for player in replay.players)
+
+    # Replays loaded up to the players stream their game events to the
+    # plugins, from the archive when the cache doesn't have them
+    cache = SC2Cache(str(tmpdir.join('cache.db')))
+    cache.register_plugin('Replay', APMTracker())
+    for attempt in range(2):
+        replay = cache.load_replay(path, load_level=2)
+        assert replay._level == 2 and not any(isinstance(event, GameEvent) for event in replay.events)
+        assert dict((player.pid, player.avg_apm) for player in replay.players) == apm
+
+    # Replays loaded without their players are left alone
+    replay = cache.load_replay(path, load_level=1)
+    assert replay._level == 1 and replay.players == []
+
+def test_apm_arrays():
+    numpy = pytest.importorskip("numpy")
+    from sc2reader.plugins.utils import action_counts, rolling_average
+    from sc2reader.plugins.replay import APMTracker, APMArrayTracker, batch_apm
+
+    columns = [(numpy.array([0, 5, 16, 40]), numpy.array([1, 1, 2, 1])), (numpy.array([3]), numpy.array([2]))]
+    counts = action_counts(columns, window=16, pids=3)
+    assert counts[0].tolist() == [[0, 0, 0], [2, 0, 1], [0, 1, 0]]
+    assert counts[1].tolist() == [[0], [0], [1]]
+    counts = action_counts(columns, window=16, lengths=[32, 48], pids=3)
+    assert [count.shape for count in counts] == [(3, 2), (3, 3)]
+    assert counts[0].tolist() == [[0, 0], [2, 0], [0, 1]]
+    assert rolling_average(numpy.array([2, 4, 0, 6]), 2).tolist() == [2, 3, 2, 3]
+
+    paths = ["test_replays/1.2.2.17811/1.SC2Replay", "test_replays/1.2.2.17811/3.SC2Replay"]
+    replays = [sc2reader.load_replay(path) for path in paths]
+    expected = list()
+    for replay in replays:
+        APMTracker()(replay)
+        expected.append([(dict(player.aps), dict(player.apm), player.avg_apm) for player in replay.players])
+
+    def check(replay, expected):
+        for player, (aps, apm, avg_apm) in zip(replay.players, expected):
+            assert player.aps.sum() == sum(aps.values()) and all(player.aps[second] == count for second, count in aps.items())
+            assert player.apm.tolist() == [apm.get(minute, 0) for minute in range(len(player.apm))]
+            assert player.avg_apm == pytest.approx(avg_apm)
+            assert len(player.rolling_apm) == len(player.aps)
+
+    APMArrayTracker()(replays[0])
+    check(replays[0], expected[0])
+
+    # Replays without their events loaded read them from the archive
+    lazy = sc2reader.load_replay(paths[1], load_level=2)
+    assert [event.frame for event in lazy.game_events()] == [event.frame for event in replays[1].game_events()]
+    batch_apm([replays[0], lazy], chunk_size=1)
+    check(replays[0], expected[0])
+    check(lazy, expected[1])
+
+def test_lazy_datapacks():
+    import subprocess
+    from sc2reader import data
+
+    # The precompiled datapacks must be rebuilt whenever the CSV files change
+    for build in data.BUILDS:
+        assert data.read_datapack(build) == data.compile_build(build)
+
+    # The CSV files are only hashed when they may have changed since the
+    # datapack was written. Datapacks made from other files are ignored.
+    hashed = list()
+    source_hash, sources_unchanged = data.source_hash, data.sources_unchanged
+    data.source_hash = lambda build: hashed.append(build) or 'stale'
+    try:
+        data.sources_unchanged = lambda build, sizes: True
+        assert data.read_datapack(17811) is not None and hashed == []
+        data.sources_unchanged = lambda build, sizes: False
+        assert data.read_datapack(17811) is None and hashed == [17811]
+    finally:
+        data.source_hash, data.sources_unchanged = source_hash, sources_unchanged
+    assert not data.sources_unchanged(17811, (0, 0))
+
+    # Builds created directly aren't shared or pickled by reference
+    build = data.load_build(17811)
+    created = data.create_build(17811)
+    assert data.builds[17811] is build and data.get_reference(build) == ('build', 17811, None)
+    assert data.get_reference(created) is None and data.get_reference(created.units.values()[0]) is None
+
+    # The datapacks can still be used by the names they had on import
+    assert data.build17326 is build and 'build17326' in dir(data)
+
+    # Only the datapack for the build of the replay is ever created
+    script = "import sc2reader; from sc2reader import data; print sorted(data.builds); sc2reader.load_replay('test_replays/1.2.2.17811/1.SC2Replay'); print sorted(data.builds)"
+    output = subprocess.check_output([sys.executable, '-c', script], stderr=open(os.devnull, 'w'), cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert output.split('\n')[:2] == ['[]', '[17811]']
+
+    replay = sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay")
+    assert replay.datapack is data.load_build(17811) is data.builds[17811]